@@ -0,0 +1,219 @@
+import contextlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import mlx.core as mx
+from mlx.utils import tree_flatten
+from mlx_lm.tuner.utils import linear_to_lora_layers
+
+from app.logging_setup import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class AdapterLayoutError(Exception):
+    """The adapter's LoRA structure differs from the one already applied to the model."""
+
+
+@dataclass
+class _ResidentAdapter:
+    name: str
+    config: dict[str, Any]
+    layout: tuple
+    scale: float
+    weights: list[tuple[str, mx.array]]
+    nbytes: int
+
+
+def _layout(config: dict[str, Any]) -> tuple:
+    params = config.get("lora_parameters") or {}
+    return (
+        config.get("fine_tune_type", "lora"),
+        config.get("num_layers"),
+        params.get("rank"),
+        tuple(params.get("keys") or ()),
+    )
+
+
+class AdapterPool:
+    """
+    Keeps several LoRA adapters resident on top of a single copy of the base weights.
+
+    The base model is converted to LoRA layers once; swapping adapters re-points the
+    low-rank weights (lora_a / lora_b, and a DoRA adapter's magnitude m) to the chosen
+    adapter's resident arrays instead of reloading the model from disk. The base model is
+    served with zeroed lora_b weights and the magnitudes the conversion computed.
+    All adapters in the pool must share one LoRA layout (layers, rank, target keys);
+    `activate` raises AdapterLayoutError otherwise so the caller can fall back to a reload.
+    """
+
+    def __init__(self, model, max_adapters: int, max_bytes: int):
+        self.max_adapters = max_adapters
+        self.max_bytes = max_bytes
+        self.reset(model)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.swaps = 0
+        self.last_swap_sec = 0.0
+        self.total_swap_sec = 0.0
+
+    def reset(self, model) -> None:
+        """
+        Binds the pool to a freshly loaded base model and drops all resident adapters.
+        """
+        self.model = model
+        self._resident: "OrderedDict[str, _ResidentAdapter]" = OrderedDict()
+        self._layout: tuple | None = None
+        self._base_weights: list[tuple[str, mx.array]] = []
+        self.active: str | None = None
+        self.bytes_used = 0
+
+    def _load(self, name: str, path: Path) -> _ResidentAdapter:
+        with open(path / "adapter_config.json", "r") as f:
+            config = json.load(f)
+        if config.get("fine_tune_type", "lora") == "full":
+            raise AdapterLayoutError(f"Adapter {name} is a full fine-tune and cannot be pooled")
+
+        weights = mx.load(str(path / "adapters.safetensors"))
+        mx.eval(list(weights.values()))
+        scale = (config.get("lora_parameters") or {}).get("scale", 20.0)
+        return _ResidentAdapter(
+            name=name,
+            config=config,
+            layout=_layout(config),
+            scale=scale,
+            weights=list(weights.items()),
+            nbytes=sum(v.nbytes for v in weights.values()),
+        )
+
+    def _get(self, name: str, path: Path) -> _ResidentAdapter:
+        adapter = self._resident.get(name)
+        if adapter is not None:
+            self._resident.move_to_end(name)
+            self.hits += 1
+            return adapter
+
+        self.misses += 1
+        adapter = self._load(name, path)
+        self._ensure_layout(adapter)
+        self._resident[name] = adapter
+        self.bytes_used += adapter.nbytes
+        self._evict(keep=name)
+        return adapter
+
+    def _evict(self, keep: str | None = None) -> None:
+        """
+        Drops least recently used adapters over the count or byte budget, never the active
+        one or `keep` (the adapter being loaded).
+        """
+        while len(self._resident) > self.max_adapters or self.bytes_used > self.max_bytes:
+            victim = next((n for n in self._resident if n not in (self.active, keep)), None)
+            if victim is None:
+                return
+            self.bytes_used -= self._resident.pop(victim).nbytes
+            self.evictions += 1
+            logger.info("Evicted adapter %s from the pool.", victim)
+
+    def _ensure_layout(self, adapter: _ResidentAdapter) -> None:
+        if self._layout == adapter.layout:
+            return
+        if self._layout is not None:
+            raise AdapterLayoutError(
+                f"Adapter {adapter.name} layout {adapter.layout} does not match pool layout {self._layout}"
+            )
+
+        config = adapter.config
+        linear_to_lora_layers(
+            self.model,
+            config["num_layers"],
+            config["lora_parameters"],
+            use_dora=config.get("fine_tune_type") == "dora",
+        )
+        self._layout = adapter.layout
+        # what serves the base model: no low-rank delta, and DoRA magnitudes as converted
+        # (the norms of the base weights), which every DoRA adapter overwrites
+        self._base_weights = [
+            (k, mx.zeros_like(v) if k.endswith("lora_b") else v)
+            for k, v in tree_flatten(self.model.parameters())
+            if k.endswith("lora_b") or k.endswith(".m")
+        ]
+        mx.eval([v for _, v in self._base_weights])
+        if self.active is None:
+            self.model.load_weights(self._base_weights, strict=False)
+
+    def _set_scale(self, scale: float) -> None:
+        for _, module in self.model.named_modules():
+            if hasattr(module, "lora_a"):
+                module.scale = scale
+
+    def preload(self, name: str, path: Path) -> None:
+        """
+        Makes an adapter resident without activating it.
+        """
+        self._get(name, path)
+
+    def activate(self, name: str, path: Path) -> float:
+        """
+        Points the model's LoRA weights at `name`, loading it from disk on a pool miss.
+        Returns the swap latency in seconds.
+        """
+        start = time.perf_counter()
+        adapter = self._get(name, path)
+        self.model.load_weights(adapter.weights, strict=False)
+        self._set_scale(adapter.scale)
+        self.active = name
+        # the previously active adapter may now be over budget
+        self._evict()
+        return self._record_swap(start)
+
+    def deactivate(self) -> float:
+        """
+        Reverts to the base model by zeroing the low-rank deltas (and restoring DoRA magnitudes).
+        """
+        start = time.perf_counter()
+        if self._layout is not None:
+            self.model.load_weights(self._base_weights, strict=False)
+        self.active = None
+        return self._record_swap(start)
+
+    @contextlib.contextmanager
+    def uncounted(self):
+        """
+        Leaves activations inside the block out of the hit and swap stats (boot warm-up).
+        """
+        saved = (self.hits, self.misses, self.swaps, self.last_swap_sec, self.total_swap_sec)
+        try:
+            yield
+        finally:
+            self.hits, self.misses, self.swaps, self.last_swap_sec, self.total_swap_sec = saved
+
+    def _record_swap(self, start: float) -> float:
+        elapsed = time.perf_counter() - start
+        self.swaps += 1
+        self.last_swap_sec = elapsed
+        self.total_swap_sec += elapsed
+        return elapsed
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "active": self.active or "base",
+            "resident": list(self._resident),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "max_adapters": self.max_adapters,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "swaps": self.swaps,
+            "last_swap_sec": self.last_swap_sec,
+            "avg_swap_sec": self.total_swap_sec / self.swaps if self.swaps else 0.0,
+        }
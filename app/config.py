@@ -1,12 +1,30 @@
 import yaml
 from pydantic import BaseModel
 from pathlib import Path
+from typing import Literal
+
+CONFIG_PATHS = (Path("settings.yaml"), Path("config") / "queue.yaml")
 
 class QueueConfig(BaseModel):
     max_size: int = 100
     starvation_prevention: bool = True
     aging_interval_sec: int = 60
     default_priority: int = 10
+    # order among jobs of equal priority: "fair" shares the GPU between clients by weight
+    # (weighted fair queuing on requested tokens), "fifo" serves them in arrival order,
+    # "edf" serves the earliest deadline first, "sjf" the job with the fewest estimated
+    # tokens (prompt + expected output) unless another has waited over sjf_max_wait_sec
+    scheduling: Literal["fair", "fifo", "edf", "sjf"] = "fair"
+    sjf_max_wait_sec: float = 30
+    # cap on estimated tokens waiting in the queue, alongside max_size; 0 means no cap
+    max_queued_tokens: int = 0
+    # most jobs one client may have waiting; 0 means no cap below max_size
+    max_per_client: int = 0
+    default_client_weight: float = 1.0
+    # per-client weights, e.g. {"ui": 4, "agent": 1}: a weight-4 client gets 4x the share
+    client_weights: dict[str, float] = {}
+    # per-client stats (waits, served tokens) are kept for this many most recently active clients
+    max_tracked_clients: int = 1024
 
 class Priorities(BaseModel):
     ui: int = 0
@@ -14,13 +32,99 @@ class Priorities(BaseModel):
     standard: int = 10
     background: int = 20
 
+    def class_of(self, priority: int) -> str:
+        """
+        The priority class a numeric priority falls in: the class with the highest value
+        not above it (e.g. 15 -> "standard").
+        """
+        levels = self.model_dump()
+        name = min(levels, key=levels.get)
+        for level, value in levels.items():
+            if levels[name] < value <= priority:
+                name = level
+        return name
+
+class PreemptionConfig(BaseModel):
+    enabled: bool = True
+    # what happens to a running sequence of each priority class when sufficiently more
+    # important work is waiting for its batch slot: "never" (run to completion),
+    # "snapshot" (keep its KV state in memory and resume from it) or "recompute"
+    # (free its KV state and re-prefill prompt + generated tokens on resume)
+    policy: dict[str, Literal["never", "snapshot", "recompute"]] = {"background": "snapshot"}
+    # a waiting job preempts only sequences at least this many priority levels below it
+    min_priority_gap: int = 5
+
+    def policy_for(self, priority: int, priorities: "Priorities") -> str:
+        return self.policy.get(priorities.class_of(priority), "never") if self.enabled else "never"
+
+class EngineConfig(BaseModel):
+    # max sequences decoded together in one continuous batch
+    max_batch_size: int = 8
+    # max waiting prompts prefilled together when they join the batch
+    prefill_batch_size: int = 4
+    prefill_step_size: int = 2048
+    # shared-prefix KV cache (static system prompt)
+    prefix_cache_max_mb: int = 2048
+    prefix_cache_min_tokens: int = 128
+    # per-session KV retention between chat turns
+    session_cache_max_mb: int = 4096
+    # speculative decoding: small draft model from the same tokenizer family
+    draft_model_id: str | None = None
+    speculative_default: bool = False
+    num_draft_tokens: int = 3
+    # resident LoRA adapters (swapped in place, LRU beyond these limits)
+    adapter_pool_size: int = 4
+    adapter_pool_max_mb: int = 1024
+    preload_adapters: list[str] = []
+    # how long a job for another adapter may be passed over before the batch drains for a swap
+    adapter_max_wait_sec: float = 2.0
+    # tool calls ([SEARCH: ...] / [EXPAND: ...]) one single-pass chat turn may make
+    max_tool_rounds: int = 3
+    # queued jobs tokenized ahead of time while the batch decodes
+    prepare_ahead: int = 2
+    # boot warm-up: prefill/decode shapes run per resident adapter before serving
+    warmup_enabled: bool = True
+    warmup_prompt_tokens: list[int] = [32, 512]
+    warmup_decode_tokens: int = 8
+    warmup_prime_prefix: bool = True
+    # exact-match response cache; requests opt in with `cache`, or all do when default is on
+    response_cache_default: bool = False
+    # only requests sampled at or below this temperature are cached
+    response_cache_max_temp: float = 0.3
+    response_cache_max_entries: int = 1024
+    response_cache_ttl_sec: float = 86400
+    # SQLite file for the on-disk tier; None keeps the cache in memory only
+    response_cache_db: str | None = None
+    # prompts with more uncached tokens than this are prefilled in chunks of this size,
+    # one chunk between decode steps, so running streams keep flowing; 0 disables
+    prefill_chunk_tokens: int = 512
+    # largest `n` (parallel samples per request); each choice takes a batch slot
+    max_choices: int = 4
+    # single-flight: identical in-flight requests sampled at or below this temperature
+    # share one generation
+    coalesce_enabled: bool = True
+    coalesce_max_temp: float = 0.3
+    # semantic layer over the response cache: near-duplicate prompts (cosine similarity of
+    # their memory embeddings at or above the threshold) reuse an earlier answer
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.92
+    semantic_cache_max_entries: int = 512
+    semantic_cache_ttl_sec: float = 3600
+    # admission control: reject a request with a deadline up front when the backlog ahead of
+    # it at the recent decode throughput says it cannot finish in time (needs this many
+    # throughput samples first)
+    deadline_shedding: bool = True
+    shed_min_samples: int = 32
+
 class Settings(BaseModel):
     queue: QueueConfig
     priorities: Priorities
+    engine: EngineConfig = EngineConfig()
+    preemption: PreemptionConfig = PreemptionConfig()
 
 def load_config() -> Settings:
-    path = Path("settings.yaml")
-    if not path.exists():
+    path = next((p for p in CONFIG_PATHS if p.exists()), None)
+    if path is None:
         return Settings(
             queue=QueueConfig(),
             priorities=Priorities()
@@ -30,4 +134,4 @@ def load_config() -> Settings:
         data = yaml.safe_load(f)
         return Settings(**data)
 
-settings = load_config()
\ No newline at end of file
+settings = load_config()
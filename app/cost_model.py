@@ -0,0 +1,78 @@
+import threading
+from collections import deque
+from typing import Any, Optional
+
+from sqlmodel import Session, select
+
+from app.database import InferenceLog, engine as db_engine
+
+# rough prompt size before tokenization (the prep thread tokenizes later)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_prompt_tokens(request) -> int:
+    """
+    Approximate prompt tokens from the request text, without the tokenizer.
+    """
+    chars = len(request.prompt or "") + len(getattr(request, "system_prompt", None) or "")
+    return chars // CHARS_PER_TOKEN + 1
+
+
+class CostModel:
+    """
+    Expected output length per (priority class, adapter), learned from finished jobs and
+    seeded from InferenceLog history (which records the adapter but not the priority).
+    Lookups fall back from (class, adapter) to the adapter alone, then to all jobs, then to
+    the request's `max_tokens`.
+    """
+
+    def __init__(self, window: int = 256, min_samples: int = 8):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: dict[tuple[Optional[str], Optional[str]], deque[int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, priority_class: Optional[str], adapter: Optional[str], tokens_out: int) -> None:
+        with self._lock:
+            for key in ((priority_class, adapter), (None, adapter), (None, None)):
+                self._samples.setdefault(key, deque(maxlen=self.window)).append(tokens_out)
+
+    def expected_output(
+        self, max_tokens: int, priority_class: Optional[str] = None, adapter: Optional[str] = None
+    ) -> float:
+        with self._lock:
+            for key in ((priority_class, adapter), (None, adapter), (None, None)):
+                samples = self._samples.get(key)
+                if samples and len(samples) >= self.min_samples:
+                    return min(max_tokens, sum(samples) / len(samples))
+        return max_tokens
+
+    def estimate(self, request, priority_class: Optional[str] = None, adapter: Optional[str] = None) -> float:
+        """
+        Estimated tokens a request costs: its prompt plus the expected output of every choice.
+        """
+        expected = self.expected_output(request.max_tokens, priority_class, adapter)
+        return estimate_prompt_tokens(request) + expected * getattr(request, "n", 1)
+
+    def load_history(self, limit: int = 2000) -> int:
+        """
+        Seeds the per-adapter estimates from the most recent InferenceLog rows.
+        Returns the number of rows read.
+        """
+        with Session(db_engine) as session:
+            rows = session.exec(
+                select(InferenceLog.adapter_name, InferenceLog.tokens_out).order_by(InferenceLog.id.desc()).limit(limit)
+            ).all()
+        for adapter, tokens_out in reversed(rows):
+            self.observe(None, adapter or "base", tokens_out)
+        return len(rows)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                f"{priority_class or '*'}/{adapter or '*'}": {
+                    "samples": len(samples),
+                    "mean_tokens_out": round(sum(samples) / len(samples), 1),
+                }
+                for (priority_class, adapter), samples in self._samples.items()
+            }
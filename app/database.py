@@ -1,4 +1,5 @@
 from datetime import datetime
+from sqlalchemy import inspect, text
 from sqlmodel import SQLModel, Field, create_engine, Session
 
 sqlite_file_name = "inference_logs.db"
@@ -35,8 +36,31 @@ class InferenceLog(SQLModel, table=True):
     ram_usage_pct: float = 0.0
     wattage: float = 0.0
 
+    # Decoding
+    draft_model_name: str | None = None         # set when speculative decoding was used
+    draft_acceptance_rate: float | None = None  # accepted draft tokens / proposed draft tokens
+    effective_tokens_per_sec: float | None = None  # decode-only rate after the first token
+
+def _add_missing_columns():
+    """
+    create_all() never alters existing tables, so add columns introduced since the DB was created.
+    New columns must be nullable.
+    """
+    inspector = inspect(engine)
+    table = InferenceLog.__tablename__
+    if not inspector.has_table(table):
+        return
+
+    existing = {column["name"] for column in inspector.get_columns(table)}
+    with engine.begin() as conn:
+        for column in InferenceLog.__table__.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type}"))
+
 def init_db():
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
 
 def log_interaction(log_entry: InferenceLog):
     """Fire and forget logger."""
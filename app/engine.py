@@ -1,16 +1,37 @@
 import asyncio
+import contextlib
+import copy
+import dataclasses
+import hashlib
+import heapq
 import logging
 import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Awaitable, Callable
 
-from mlx_lm import generate, load, stream_generate
+import mlx.core as mx
+from mlx_lm import load, stream_generate
+from mlx_lm.generate import BatchGenerator
+from mlx_lm.models.cache import make_prompt_cache, trim_prompt_cache
 from mlx_lm.sample_utils import make_sampler
 
+from app.adapters import AdapterLayoutError, AdapterPool
+from app.config import settings
+from app.cost_model import CostModel
 from app.database import InferenceLog, init_db, log_stats
+from app.kv_cache import PrefixCache, SessionCache, common_prefix_len
 from app.logging_setup import setup_logging
+from app.metrics import LoopLagMonitor, RollingWindow
 from app.monitor import monitor
+from app.prompts import SHARED_PROMPT_PREFIX, build_system_prompt
+from app.response_cache import CachedResponse, ResponseCache, make_key
+from app.semantic_cache import SemanticCache, fingerprint
+from core.memory import memory
+from app.stopping import StopMatcher
 
 from app.queue import request_queue, QueueItem
 
@@ -20,6 +41,162 @@ logger = logging.getLogger(__name__)
 BASE_MODEL_ID = "mlx-community/Qwen2.5-14B-Instruct-4bit"
 ADAPTERS_DIR = Path("adapters")
 
+
+class EngineNotReady(RuntimeError):
+    """Raised for inference requests that arrive while the weights are still loading."""
+
+
+class Overloaded(RuntimeError):
+    """Raised when a request is shed at admission: the queue is full or it cannot meet its deadline."""
+
+
+@dataclass
+class Prompt:
+    """A chat-formatted prompt, tokenized once; its ids and count travel with the job."""
+    text: str
+    ids: list[int]
+    # leading tokens covered by the static system prompt (SHARED_PROMPT_PREFIX)
+    shared_tokens: int = 0
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.ids)
+
+
+@dataclass
+class _Prepared:
+    """CPU-side work for a queued job, done on the preparation thread ahead of admission."""
+    messages: list[dict]
+    prompt: Prompt
+    sampler: Callable
+
+
+@dataclass
+class _Sequence:
+    """Per-request decode state for a sequence in the running batch."""
+    job: QueueItem
+    request: Any
+    response_queue: asyncio.Queue
+    prompt: Prompt
+    sampler: Callable
+    detokenizer: Any
+    stopper: StopMatcher | None = None
+    prompt_cache: list[Any] | None = None
+    cached_tokens: int = 0
+    session_id: str | None = None
+    deadline: float | None = None
+    uid: int | None = None
+    start_time: float = 0.0
+    first_token_time: float | None = None
+    last_token_time: float | None = None
+    tokens_generated: int = 0
+    peak_gpu: float = 0.0
+    peak_temp: float = 0.0
+    chunks: list[str] = field(default_factory=list)
+    # "stop" (EOS or a stop string) or "length" (cut at max_tokens) once finished
+    finish_reason: str | None = None
+    # speculative decoding lane (runs outside the batch)
+    speculative: bool = False
+    stream: Any = None
+    draft_accepted: int = 0
+    verify_rounds: int = 0
+    # single-pass tool use: the sequence pauses on a tool tag and resumes on its own KV state
+    tool_runner: Callable | None = None
+    tool_rounds: int = 0
+    tool_task: asyncio.Task | None = None
+    messages: list[dict] = field(default_factory=list)
+    generated_ids: list[int] = field(default_factory=list)
+    # parallel sampling (n > 1): which of the job's choices this is; None for single-sample jobs
+    choice: int | None = None
+
+    @property
+    def context_ids(self) -> list[int]:
+        """Tokens the KV state must cover before decoding continues: prompt plus output so far."""
+        return self.prompt.ids + self.generated_ids
+
+    def emit(self, text: str):
+        # choices are tagged so one response queue can carry all of a job's samples
+        self.response_queue.put_nowait(text if self.choice is None else (self.choice, text))
+
+
+@dataclass
+class _JobError:
+    """Failure marker sent down a job's response queue in place of a token."""
+    error: Exception
+
+
+@dataclass
+class _JobDone:
+    """Sent just before the end-of-stream None with the job's output token count."""
+    tokens_out: int
+
+
+class _Flight:
+    """
+    One generation shared by every caller that submitted the same deterministic request
+    while it was queued or running (single-flight). Stands in for the job's response queue:
+    output is recorded so late joiners replay it from the start, and each caller reads its
+    own queue with its own deadline and cancellation.
+    """
+
+    def __init__(self, key: str, request_id: str, on_close: Callable[["_Flight"], None]):
+        self.key = key
+        self.request_id = request_id  # the job's id (its first caller's)
+        self.history: list[Any] = []
+        self.subscribers: dict[str, asyncio.Queue] = {}
+        self.deadlines: dict[str, float] = {}
+        self._on_close = on_close
+
+    def subscribe(self, request_id: str, deadline: float | None) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in self.history:
+            queue.put_nowait(item)
+        self.subscribers[request_id] = queue
+        if deadline is not None:
+            self.deadlines[request_id] = deadline
+        return queue
+
+    def detach(self, request_id: str, error: Exception | None = None) -> bool:
+        """
+        Ends one caller's stream. Returns True if other callers are still reading.
+        """
+        queue = self.subscribers.pop(request_id, None)
+        self.deadlines.pop(request_id, None)
+        if queue is not None:
+            if error is not None:
+                queue.put_nowait(_JobError(error))
+            queue.put_nowait(None)
+        return bool(self.subscribers)
+
+    def put_nowait(self, item: Any):
+        self.history.append(item)
+        for queue in self.subscribers.values():
+            queue.put_nowait(item)
+        if item is None:
+            self._on_close(self)
+
+    async def put(self, item: Any):
+        self.put_nowait(item)
+
+
+def _choices(item: QueueItem) -> int:
+    """Batch slots a job takes: one per sampled choice."""
+    return getattr(item.payload["request"], "n", 1)
+
+
+def _wants_tool(seq: "_Sequence") -> bool:
+    """A single-pass tool turn that just emitted a complete tool tag."""
+    return seq.tool_runner is not None and seq.stopper is not None and seq.stopper.tool_tag is not None
+
+
+def _finished_cache(response) -> list[Any] | None:
+    """
+    The per-sequence KV cache the batch generator hands back with a finished response.
+    """
+    cache = getattr(response, "prompt_cache", None)
+    return cache() if callable(cache) else cache
+
+
 class ModelEngine:
     """Singleton GPU engine that manages adapters, queues, and inference."""
     _instance = None
@@ -36,24 +213,246 @@ class ModelEngine:
         if self._initialized:
             return
         
-        logger.info("Initializing Engine... Loading Base Model: %s", BASE_MODEL_ID)
+        logger.info("Initializing Engine (weights load in the startup hook).")
         self.model_id = BASE_MODEL_ID
         self.adapter_id = None
+        # set once initialise() has loaded the weights; jobs are refused until then
+        self.ready = False
 
-        init_db()
-
-        # use a Lock to prevent multiple apps from hitting GPU at the same exact time
-        self.lock = asyncio.Lock()
+        # All model work runs on one dedicated inference thread: it serialises GPU access
+        # and keeps decode steps off the event loop.
+        self._gpu = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        # Chat templating, tokenization and sampler setup run ahead of time on their own
+        # thread, overlapped with decoding. One thread keeps templating and encoding serial; the
+        # inference thread shares the same tokenizer, but once serving only to create
+        # per-sequence detokenizers and read its EOS ids, which leave it untouched.
+        self._prep = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prepare")
+        self._prep_stats = {"prefetched": 0, "inline": 0}
+        # GPU idle time between jobs while work was waiting, in ms
+        self.gpu_idle_gap = RollingWindow()
+        self._gpu_idle_since: float | None = None
         self._bg_lock = asyncio.Lock()
         self._worker_task = None
         self._monitor_task = None
+        self._lag_task = None
+        self.loop_lag = LoopLagMonitor()
         self.running = False
         self._monitor_interval = 5
 
-        # load the base model
-        self.model, self.tokenizer = load(self.model_id)
+        # continuous batching state, owned by the worker loop
+        self.config = settings.engine
+        self._batch: BatchGenerator | None = None
+        self._active: dict[int, _Sequence] = {}
+
+        # reusable KV state for the static system prompt, keyed by adapter + token hash
+        self.prefix_cache = PrefixCache(max_bytes=self.config.prefix_cache_max_mb * 1024 * 1024)
+        self._prefix_ids_memo: dict[str, list[int]] = {}
+        # KV state of each active session's last turn
+        self.session_cache = SessionCache(max_bytes=self.config.session_cache_max_mb * 1024 * 1024)
+        # finished answers of deterministic requests, replayed instead of regenerated
+        self.response_cache = ResponseCache(
+            max_entries=self.config.response_cache_max_entries,
+            ttl_sec=self.config.response_cache_ttl_sec,
+            db_path=self.config.response_cache_db,
+        )
+        # near-duplicate prompts, matched on the memory embedder's sentence embeddings
+        self.semantic_cache = SemanticCache(
+            embed=lambda text: memory.embedder.encode(text).tolist(),
+            threshold=self.config.semantic_cache_threshold,
+            max_entries=self.config.semantic_cache_max_entries,
+            ttl_sec=self.config.semantic_cache_ttl_sec,
+        )
+
+        # preemption: batch sequences that gave their slot to more important waiting work
+        self.preemption = settings.preemption
+        self._preempted: list[_Sequence] = []
+        self._preemption_stats = {"preemptions": 0, "resumed": 0, "snapshot": 0, "recompute": 0}
+        # time to first token (from enqueue) of jobs that preempted, and the estimated wait
+        # for the preempted sequence to finish that they skipped, in ms
+        self.preempting_ttft = RollingWindow()
+        self.preemption_wait_avoided = RollingWindow()
+
+        # long prompts prefilled a chunk at a time between decode steps, oldest first
+        self._prefilling: deque[_Sequence] = deque()
+        self._chunked_stats = {"prompts": 0, "chunks": 0, "tokens": 0}
+        # gap between consecutive streamed tokens of the same sequence, in ms
+        self.inter_token_latency = RollingWindow()
+
+        # speculative decoding lane: one sequence at a time, interleaved with batch steps
+        self._speculative: _Sequence | None = None
+        self._speculative_waiting: deque[_Sequence] = deque()
+
+        # filled in by initialise()
+        self.model = None
+        self.tokenizer = None
+        self.draft_model = None
+        self.draft_model_id = self.config.draft_model_id
+        self.adapter_pool: AdapterPool | None = None
+
+        # adapter-affinity scheduling: requests are grouped by adapter and swaps
+        # happen only between groups, when nothing is in flight
+        self.default_adapter = "base"
+        self._adapter_swaps = 0
+        self._swaps_avoided = 0
+        self._adapter_waits: dict[str, dict[str, float]] = {}
+
+        # cancellation: request_id -> (reason, time requested), applied at the next token boundary
+        self._cancel_requests: dict[str, tuple[str, float]] = {}
+        self._cancel_stats = {"queued": 0, "in_flight": 0, "deadline": 0, "tokens_saved": 0}
+        # (deadline, request_id) of queued jobs, so they expire while still waiting
+        self._queued_deadlines: list[tuple[float, str]] = []
+
+        # admission control: batch decode throughput (tokens/sec per step), and the expected
+        # output length per priority class and adapter, used to estimate each job's cost and
+        # whether a request can meet its deadline
+        self.decode_throughput = RollingWindow(256)
+        self.cost_model = CostModel()
+        self._shed_stats = {"deadline": 0, "queue_full": 0}
+        # callers with a deadline whose answer arrived in time / did not
+        self._deadline_stats = {"met": 0, "missed": 0}
+
+        # single-pass tool use: sequences paused on a tool call, and those ready to resume
+        self._paused: dict[str, _Sequence] = {}
+        self._resuming: deque[tuple[_Sequence, str]] = deque()
+        self._resume_ready = asyncio.Event()
+        self._tool_stats = {"calls": 0, "tokens_reused": 0, "tokens_prefilled": 0}
+
+        # single-flight: identical deterministic requests share one generation
+        self._flights: dict[str, _Flight] = {}  # request key -> flight
+        self._flight_of: dict[str, _Flight] = {}  # caller request_id -> flight
+        self._coalesce_stats = {"flights": 0, "joined": 0, "detached": 0}
+        # parallel sampling: jobs with n > 1 and the prompt tokens their shared prefill saved
+        self._parallel_stats = {"jobs": 0, "choices": 0, "prefill_tokens_saved": 0}
+
+        # boot warm-up results, plus the first real request's TTFT to compare against
+        self.warmup_stats: dict[str, Any] = {"enabled": self.config.warmup_enabled}
+        self._first_request_ttft: float | None = None
         self._initialized = True
-        logger.info("Engine Online. Ready for inference.")
+
+    def _load_weights(self):
+        """
+        Inference thread: loads the base model, the optional draft model and preloaded adapters.
+        """
+        init_db()
+        try:
+            logger.info("Seeded job cost estimates from %s logged requests.", self.cost_model.load_history())
+        except Exception:
+            logger.exception("Could not read InferenceLog history; cost estimates start empty.")
+
+        start = time.perf_counter()
+        logger.info("Loading base model: %s", self.model_id)
+        self.model, self.tokenizer = load(self.model_id)
+        logger.info("Base model loaded in %.2fs.", time.perf_counter() - start)
+
+        # optional small draft model (same tokenizer family) for speculative decoding
+        if self.draft_model_id:
+            start = time.perf_counter()
+            logger.info("Loading draft model for speculative decoding: %s", self.draft_model_id)
+            self.draft_model, _ = load(self.draft_model_id)
+            logger.info("Draft model loaded in %.2fs.", time.perf_counter() - start)
+
+        # resident LoRA adapters on top of the single copy of base weights
+        self.adapter_pool = AdapterPool(
+            self.model,
+            max_adapters=self.config.adapter_pool_size,
+            max_bytes=self.config.adapter_pool_max_mb * 1024 * 1024,
+        )
+        start = time.perf_counter()
+        self._preload_adapters()
+        logger.info("Adapters preloaded in %.2fs.", time.perf_counter() - start)
+
+    def _timed_generation(self, tokens: list[int], max_tokens: int) -> float:
+        """
+        Inference thread: runs one prompt through a throwaway batch generator, the same path
+        real jobs take. Returns the time to the first token in seconds; raises if no token
+        comes out, so a warm-up that did nothing is not reported as done.
+        """
+        generator = BatchGenerator(
+            self.model,
+            stop_tokens=set(),
+            completion_batch_size=1,
+            prefill_batch_size=1,
+            prefill_step_size=self.config.prefill_step_size,
+        )
+        start = time.perf_counter()
+        ttft = None
+        try:
+            generator.insert([tokens], max_tokens=[max_tokens])
+            while responses := generator.next_generated():
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                if any(r.finish_reason is not None for r in responses):
+                    break
+        finally:
+            generator.close()
+        if ttft is None:
+            raise RuntimeError(f"Warm-up generation over {len(tokens)} prompt tokens produced no tokens.")
+        return ttft
+
+    def _warm_up(self):
+        """
+        Inference thread: runs representative prefill/decode shapes for the base model and
+        every resident adapter (kernel compilation, lazy weight materialisation) and primes
+        the shared-prefix cache, so the first real request does not pay for it.
+        """
+        cfg = self.config
+        start = time.perf_counter()
+        filler = self.tokenizer.encode("The quick brown fox jumps over the lazy dog. ")
+        shapes = [(filler * (n // len(filler) + 1))[:n] for n in cfg.warmup_prompt_tokens if n > 0]
+        # a prompt shaped like build_system_prompt's, so the primed prefix matches real requests
+        prefix_prompt = [
+            {"role": "system", "content": build_system_prompt()},
+            {"role": "user", "content": "Hello"},
+        ]
+
+        cold_ttft = None
+        adapters = ["base", *self.adapter_pool.stats()["resident"]]
+        # these swaps are not traffic: keep them out of the pool's hit and swap counters
+        with self.adapter_pool.uncounted():
+            for adapter in adapters:
+                self.load_adapter(adapter)
+                for tokens in shapes:
+                    ttft = self._timed_generation(tokens, cfg.warmup_decode_tokens)
+                    cold_ttft = ttft if cold_ttft is None else cold_ttft
+                if cfg.warmup_prime_prefix:
+                    self._prompt_cache_for(self._format_prompt(prefix_prompt))
+            self.unload_adapter()
+
+        # the same first shape again, now warm
+        warm_ttft = self._timed_generation(shapes[0], cfg.warmup_decode_tokens) if shapes else None
+        self.warmup_stats.update(
+            {
+                "seconds": round(time.perf_counter() - start, 3),
+                "adapters": adapters,
+                "prompt_tokens": [len(t) for t in shapes],
+                "cold_ttft_ms": round(cold_ttft * 1000, 1) if cold_ttft is not None else None,
+                "warm_ttft_ms": round(warm_ttft * 1000, 1) if warm_ttft is not None else None,
+            }
+        )
+        logger.info(
+            "Warm-up done in %.2fs | cold ttft=%sms warm ttft=%sms",
+            self.warmup_stats["seconds"],
+            self.warmup_stats["cold_ttft_ms"],
+            self.warmup_stats["warm_ttft_ms"],
+        )
+
+    async def initialise(self):
+        """
+        Loads the weights on the inference thread, then starts the background tasks.
+        Called from the FastAPI startup hook without blocking it, so the server accepts
+        connections (and answers 503 for inference) while this runs.
+        """
+        if not self.ready:
+            await self._on_gpu(self._load_weights)
+            if self.config.warmup_enabled:
+                try:
+                    await self._on_gpu(self._warm_up)
+                except Exception as e:
+                    logger.exception("Warm-up failed; serving cold.")
+                    self.warmup_stats["error"] = str(e)
+            self.ready = True
+            logger.info("Engine Online. Ready for inference.")
+        await self.start_background_tasks()
 
     def _resolve_adapter_path(self, adapter_name: str) -> Path:
         """
@@ -68,6 +467,42 @@ class ModelEngine:
 
         return ADAPTERS_DIR / adapter_name
 
+    def _preload_adapters(self):
+        """
+        Makes the adapters listed in `engine.preload_adapters` resident at startup.
+        """
+        for adapter_name in self.config.preload_adapters:
+            adapter_path = self._resolve_adapter_path(adapter_name)
+            if not adapter_path.exists():
+                logger.warning("Preload adapter %s not found in %s; skipping.", adapter_name, ADAPTERS_DIR)
+                continue
+            try:
+                self.adapter_pool.preload(adapter_name, adapter_path)
+                logger.info("Preloaded adapter %s.", adapter_name)
+            except AdapterLayoutError as e:
+                logger.warning("Cannot preload adapter %s: %s", adapter_name, e)
+
+    def resolve_adapter(self, adapter_name: str | None) -> str:
+        """
+        Normalises a requested adapter name to a scheduling group ("base" or an adapter
+        on disk). None means the default set through /adapters/load.
+        """
+        if adapter_name is None:
+            return self.default_adapter
+        if adapter_name in {"base", "none"}:
+            return "base"
+        if not self._resolve_adapter_path(adapter_name).exists():
+            raise FileNotFoundError(f"Adapter {adapter_name} not found in {ADAPTERS_DIR}")
+        return adapter_name
+
+    def set_default_adapter(self, adapter_name: str):
+        """
+        Selects the adapter used by requests that do not name one. The swap itself is done
+        by the worker between adapter groups, so it never races an in-flight generation.
+        """
+        self.default_adapter = self.resolve_adapter(adapter_name)
+        logger.info("Default adapter set to %s", self.default_adapter)
+
     def load_adapter(self, adapter_name: str):
         """
         Hot-swaps the specialized brain (LoRA) without crashing RAM
@@ -86,10 +521,18 @@ class ModelEngine:
 
         logger.info("Hot-swapping to adapter: %s...", adapter_name)
 
-        # mlx efficient reload, re-fesus the base weights with the new adapter weights
-        self.model, self.tokenizer = load(self.model_id, adapter_path=str(adapter_path))
+        try:
+            # re-point the resident low-rank weights; the base weights stay put
+            elapsed = self.adapter_pool.activate(adapter_name, adapter_path)
+        except AdapterLayoutError as e:
+            # A different LoRA structure cannot be swapped in place: start from fresh base weights.
+            logger.info("%s. Reloading base model.", e)
+            self.model, self.tokenizer = load(self.model_id)
+            self.adapter_pool.reset(self.model)
+            elapsed = self.adapter_pool.activate(adapter_name, adapter_path)
+
         self.adapter_id = adapter_name
-        logger.info("Swapped to %s", adapter_name)
+        logger.info("Swapped to %s in %.3fs", adapter_name, elapsed)
 
     def unload_adapter(self):
         """
@@ -99,9 +542,206 @@ class ModelEngine:
             return
         
         logger.info("Reverting adapter to base")
-        self.model, self.tokenizer = load(self.model_id)
+        self.adapter_pool.deactivate()
         self.adapter_id = None
 
+    def _shared_prefix_tokens(self, prompt: Prompt) -> int:
+        """
+        Number of leading prompt tokens covered by the static system prompt, or 0.
+        """
+        idx = prompt.text.find(SHARED_PROMPT_PREFIX)
+        if idx < 0:
+            return 0
+
+        text = prompt.text[: idx + len(SHARED_PROMPT_PREFIX)]
+        prefix_ids = self._prefix_ids_memo.get(text)
+        if prefix_ids is None:
+            if len(self._prefix_ids_memo) > 16:
+                self._prefix_ids_memo.clear()
+            prefix_ids = self._prefix_ids_memo[text] = self.tokenizer.encode(text)
+
+        # Token merges can differ at the boundary, so only trust the common part.
+        return common_prefix_len(prompt.ids, prefix_ids)
+
+    def _prefill(self, tokens: list[int], cache: list[Any], model=None):
+        """
+        Runs the model (the base model by default) over `tokens` to fill `cache`,
+        in prefill_step_size chunks.
+        """
+        model = model or self.model
+        step = self.config.prefill_step_size
+        for i in range(0, len(tokens), step):
+            model(mx.array(tokens[i : i + step])[None], cache=cache)
+            mx.eval([c.state for c in cache])
+
+    def _use_speculative(self, request) -> bool:
+        """
+        Per-request `speculative` flag, falling back to the global default.
+        """
+        if self.draft_model is None:
+            return False
+        flag = getattr(request, "speculative", None)
+        return self.config.speculative_default if flag is None else flag
+
+    def _with_draft_cache(self, prompt_ids: list[int], cache: list[Any], cached_tokens: int) -> list[Any]:
+        """
+        Appends a draft-model cache covering the same reused prefix, as mlx_lm's speculative
+        generator expects [base layers..., draft layers...]. The draft model is small, so
+        re-prefilling the prefix for it is cheap.
+        """
+        draft_cache = make_prompt_cache(self.draft_model)
+        if cached_tokens:
+            self._prefill(prompt_ids[:cached_tokens], draft_cache, model=self.draft_model)
+        return cache + draft_cache
+
+    def _prompt_cache_for(self, prompt: Prompt, session_id: str | None = None) -> tuple[list[Any], int]:
+        """
+        Returns a private KV cache already holding the longest reusable prefix of the prompt,
+        plus the number of prompt tokens it covers. The session's previous turn is tried first,
+        then the shared-prefix cache. Runs on the inference thread.
+        """
+        adapter = self.adapter_id or "base"
+        prompt_ids = prompt.ids
+        cache, cached = None, 0
+
+        if session_id:
+            cache, cached, held = self.session_cache.take(session_id, adapter, prompt_ids)
+            if cache is not None and held > cached:
+                trim_prompt_cache(cache, held - cached)
+
+        if cache is None:
+            cache, cached = self.prefix_cache.fetch(adapter, prompt_ids)
+
+        if cache is None:
+            cache = make_prompt_cache(self.model)
+            shared = prompt.shared_tokens
+            if shared >= self.config.prefix_cache_min_tokens:
+                self._prefill(prompt_ids[:shared], cache)
+                self.prefix_cache.insert(adapter, prompt_ids[:shared], cache)
+                cache = copy.deepcopy(cache)
+                cached = shared
+
+        # The generator needs at least one prompt token to produce the first logits.
+        if cached >= len(prompt_ids):
+            trim_prompt_cache(cache, cached - len(prompt_ids) + 1)
+            cached = len(prompt_ids) - 1
+
+        return cache, cached
+
+    def _retain_session(self, session_id: str, prompt_ids: list[int], cache: list[Any] | None):
+        """
+        Keeps the prompt part of a finished turn's KV state for the session's next turn.
+        Generated tokens are trimmed: the next prompt re-renders them inside the history block.
+        """
+        if not cache:
+            return
+        held = cache[0].offset
+        if held > len(prompt_ids):
+            trim_prompt_cache(cache, held - len(prompt_ids))
+        self.session_cache.store(
+            session_id, self.adapter_id or "base", prompt_ids[: min(held, len(prompt_ids))], cache
+        )
+
+    def release_session(self, session_id: str):
+        """
+        Frees the retained KV state of a session that has ended.
+        Queued onto the inference thread, which owns the KV caches.
+        """
+        def release():
+            if self.session_cache.evict(session_id):
+                logger.info("Released KV cache for session %s.", session_id)
+
+        self._gpu.submit(release)
+
+    def evict_idle_sessions(self, idle_seconds: float):
+        def evict():
+            evicted = self.session_cache.evict_idle(idle_seconds)
+            if evicted:
+                logger.info("Evicted %s idle session KV cache(s).", evicted)
+
+        self._gpu.submit(evict)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Engine-level counters for monitoring.
+        """
+        return {
+            "ready": self.ready,
+            "adapter": self.adapter_id or "base",
+            "batch_size": len(self._active),
+            "event_loop_lag_ms": self.loop_lag.stats(),
+            "warmup": {
+                **self.warmup_stats,
+                "first_request_ttft_ms": (
+                    round(self._first_request_ttft * 1000, 1) if self._first_request_ttft is not None else None
+                ),
+            },
+            "cancellations": dict(self._cancel_stats),
+            "admission": {
+                "deadline_shedding": self.config.deadline_shedding,
+                "shed": dict(self._shed_stats),
+                **self._deadline_stats,
+                "deadline_miss_rate": (
+                    self._deadline_stats["missed"] / max(sum(self._deadline_stats.values()), 1)
+                ),
+                "decode_tokens_per_sec": round(self.decode_throughput.summary()["mean"], 1),
+            },
+            "preparation": {**self._prep_stats, "prepare_ahead": self.config.prepare_ahead},
+            "gpu_idle_gap_ms": self.gpu_idle_gap.summary(),
+            "inter_token_latency_ms": self.inter_token_latency.summary(),
+            "preemption": {
+                **self._preemption_stats,
+                "enabled": self.preemption.enabled,
+                "policy": dict(self.preemption.policy),
+                "preempted": len(self._preempted),
+                "preempting_ttft_ms": self.preempting_ttft.summary(),
+                "estimated_wait_avoided_ms": self.preemption_wait_avoided.summary(),
+            },
+            "chunked_prefill": {
+                **self._chunked_stats,
+                "chunk_tokens": self.config.prefill_chunk_tokens,
+                "in_progress": len(self._prefilling),
+            },
+            "tool_calls": {
+                **self._tool_stats,
+                "paused": len(self._paused),
+                "max_rounds": self.config.max_tool_rounds,
+            },
+            "speculative": {
+                "draft_model": self.draft_model_id,
+                "default": self.config.speculative_default,
+                "num_draft_tokens": self.config.num_draft_tokens,
+                "active": 1 if self._speculative else 0,
+                "waiting": len(self._speculative_waiting),
+            },
+            "adapter_pool": self.adapter_pool.stats() if self.adapter_pool else None,
+            "adapter_scheduling": {
+                "default_adapter": self.default_adapter,
+                "swaps": self._adapter_swaps,
+                "swaps_avoided": self._swaps_avoided,
+                "max_wait_sec": self.config.adapter_max_wait_sec,
+                "queue_wait": {
+                    name: {
+                        "count": w["count"],
+                        "avg_sec": w["total"] / w["count"] if w["count"] else 0.0,
+                        "max_sec": w["max"],
+                    }
+                    for name, w in self._adapter_waits.items()
+                },
+            },
+            "prefix_cache": self.prefix_cache.stats(),
+            "session_cache": self.session_cache.stats(),
+            "response_cache": self.response_cache.stats(),
+            "cost_model": self.cost_model.stats(),
+            "parallel_sampling": {**self._parallel_stats, "max_n": self.config.max_choices},
+            "coalescing": {
+                "enabled": self.config.coalesce_enabled,
+                "in_flight": len(self._flights),
+                **self._coalesce_stats,
+            },
+            "semantic_cache": {"enabled": self.config.semantic_cache_enabled, **self.semantic_cache.stats()},
+        }
+
     async def start_background_tasks(self):
         """
         Spins up the queue worker and monitor if they are not already running.
@@ -121,13 +761,18 @@ class ModelEngine:
                 self._monitor_task = loop.create_task(self._queue_monitor_loop(), name="queue-monitor")
                 logger.info("Started queue monitor.")
 
+            if not self._lag_task or self._lag_task.done():
+                self._lag_task = loop.create_task(self.loop_lag.run(), name="loop-lag-monitor")
+
     async def shutdown(self):
         """
         Gracefully stop background tasks.
         """
         async with self._bg_lock:
             self.running = False
-            tasks = [t for t in (self._worker_task, self._monitor_task) if t and not t.done()]
+            tasks = [
+                t for t in (self._worker_task, self._monitor_task, self._lag_task) if t and not t.done()
+            ]
             for task in tasks:
                 task.cancel()
 
@@ -147,10 +792,11 @@ class ModelEngine:
                 stats = await request_queue.stats()
                 depth = stats.get("depth", 0)
 
-                if depth != last_depth or depth > 0:
+                if depth != last_depth or depth > 0 or self._active:
                     logger.info(
-                        "Queue status | depth=%s min_prio=%s max_prio=%s oldest_wait=%.2fs",
+                        "Queue status | depth=%s batch=%s min_prio=%s max_prio=%s oldest_wait=%.2fs",
                         depth,
+                        len(self._active),
                         stats.get("min_priority"),
                         stats.get("max_priority"),
                         stats.get("oldest_wait", 0.0),
@@ -164,177 +810,1320 @@ class ModelEngine:
 
             await asyncio.sleep(self._monitor_interval)
 
-    async def _worker_loop(self):
+    def _prepare_job(self, job: QueueItem) -> _Prepared:
+        """
+        Preparation thread: formats and tokenizes a queued job and builds its sampler.
+        """
+        req = job.payload["request"]
+        messages = self._messages_for(req)
+
+        sampler = make_sampler(
+            temp=getattr(req, "temp", 0.7),
+            top_p=1.0,
+            min_p=0.0,
+            min_tokens_to_keep=1,
+        )
+        return _Prepared(messages=messages, prompt=self._format_prompt(messages), sampler=sampler)
+
+    def _messages_for(self, req) -> list[dict]:
+        messages = []
+        if getattr(req, "system_prompt", None):
+            messages.append({"role": "system", "content": req.system_prompt})
+        messages.append({"role": "user", "content": req.prompt})
+        return messages
+
+    def _response_cache_key(self, req, adapter: str, tools: bool) -> str:
+        """
+        Preparation thread: the exact-match cache key, over the rendered prompt and
+        everything else that shapes the answer.
+        """
+        text = self.tokenizer.apply_chat_template(self._messages_for(req), tokenize=False, add_generation_prompt=True)
+        return make_key(
+            model=self.model_id,
+            adapter=adapter,
+            prompt=hashlib.sha256(text.encode()).hexdigest(),
+            temp=getattr(req, "temp", 0.7),
+            top_p=1.0,
+            max_tokens=req.max_tokens,
+            stop=getattr(req, "stop", None),
+            stop_on_tool_tag=getattr(req, "stop_on_tool_tag", False),
+            n=getattr(req, "n", 1),
+            tools=tools,
+        )
+
+    def _use_response_cache(self, req) -> bool:
+        """
+        Only (near-)deterministic requests are cached: a replayed sample would otherwise
+        hide the variety the caller asked for.
+        """
+        enabled = getattr(req, "cache", None)
+        if enabled is None:
+            enabled = self.config.response_cache_default
+        return (
+            bool(enabled)
+            and getattr(req, "n", 1) == 1
+            and getattr(req, "temp", 0.7) <= self.config.response_cache_max_temp
+        )
+
+    def _can_coalesce(self, req, tool_runner: Callable | None) -> bool:
+        """
+        Only deterministic requests can share an answer; tool turns call back into their
+        own client, so they always run alone.
+        """
+        return (
+            self.config.coalesce_enabled
+            and tool_runner is None
+            and getattr(req, "temp", 0.7) <= self.config.coalesce_max_temp
+        )
+
+    def _close_flight(self, flight: _Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        for request_id in flight.subscribers:
+            self._flight_of.pop(request_id, None)
+
+    def _use_semantic_cache(self, req, tool_runner: Callable | None) -> bool:
         """
-        The Consumer: Pulls from the queue and runs GPU inference.
+        A near-duplicate's answer is only safe when nothing outside the prompt feeds in:
+        no live search (tool turns) and no injected session history. Memory must already
+        be loaded; a lookup never waits for the embedder. In practice this is the HTTP
+        path: WebSocket chat turns search and carry a per-turn (timestamped) system prompt.
         """
-        logger.info("Queue worker loop running.")
+        if not self.config.semantic_cache_enabled or tool_runner is not None or not memory.ready:
+            return False
+        return not (getattr(req, "session_id", None) and getattr(req, "include_history", False))
+
+    def _semantic_lookup(self, req, adapter: str):
+        """
+        Worker thread: embeds the prompt and looks it up within its adapter/system-prompt scope.
+        Returns (scope, vector, hit or None).
+        """
+        start = time.perf_counter()
+        vector = self.semantic_cache.embed_prompt(req.prompt)
+        # stop settings decide where an answer is cut, so they must match exactly
+        stop = make_key(stop=getattr(req, "stop", None), stop_on_tool_tag=getattr(req, "stop_on_tool_tag", False))
+        scope = (adapter, fingerprint(getattr(req, "system_prompt", None)), stop)
+        hit = self.semantic_cache.lookup(scope, vector, req.max_tokens, time.perf_counter() - start)
+        return scope, vector, hit
+
+    def _prepare_sequence(self, job: QueueItem, prepared: _Prepared) -> "_Sequence":
+        """
+        Inference thread: attaches the reusable KV state to a prepared job so it can join
+        the decode batch (after `_fork_choices`).
+        """
+        req = job.payload["request"]
+        prompt = prepared.prompt
+        n = getattr(req, "n", 1)
+
+        tool_runner = job.payload.get("tool_runner")
+        session_id = getattr(req, "session_id", None)
+        prompt_cache, cached_tokens = self._prompt_cache_for(prompt, session_id)
+        # tool turns pause and resume inside the batch, so they skip the speculative lane
+        speculative = self._use_speculative(req) and tool_runner is None and n == 1
+        if speculative:
+            prompt_cache = self._with_draft_cache(prompt.ids, prompt_cache, cached_tokens)
+        if n > 1:
+            self._parallel_stats["jobs"] += 1
+            self._parallel_stats["choices"] += n
+            self._parallel_stats["prefill_tokens_saved"] += (n - 1) * (prompt.num_tokens - 1 - cached_tokens)
+
+        return _Sequence(
+            job=job,
+            request=req,
+            response_queue=job.payload["response_queue"],
+            prompt=prompt,
+            sampler=prepared.sampler,
+            detokenizer=self.tokenizer.detokenizer,
+            stopper=self._stopper_for(req, tool_runner),
+            prompt_cache=prompt_cache,
+            cached_tokens=cached_tokens,
+            session_id=session_id,
+            deadline=job.payload.get("deadline"),
+            speculative=speculative,
+            tool_runner=tool_runner,
+            messages=prepared.messages,
+        )
+
+    def _fork_choices(self, seq: "_Sequence") -> list["_Sequence"]:
+        """
+        Inference thread: a job asking for `n` samples becomes `n` sequences. The prompt is
+        prefilled once and each choice starts from its own copy of that KV state.
+        """
+        n = getattr(seq.request, "n", 1) if seq.tool_rounds == 0 else 1
+        seq.job.payload["choices_left"] = n
+        if n == 1:
+            return [seq]
+
+        # everything but the last token, which each choice feeds to get its first logits
+        self._prefill(seq.prompt.ids[seq.cached_tokens : -1], seq.prompt_cache)
+        seq.cached_tokens = seq.prompt.num_tokens - 1
+        seq.choice = 0
+        forks = [
+            dataclasses.replace(
+                seq,
+                prompt_cache=copy.deepcopy(seq.prompt_cache),
+                detokenizer=self.tokenizer.detokenizer,
+                stopper=self._stopper_for(seq.request),
+                # only the first choice hands its KV state back to the session
+                session_id=None,
+                chunks=[],
+                generated_ids=[],
+                choice=index,
+            )
+            for index in range(1, n)
+        ]
+        return [seq] + forks
+
+    def _needs_chunked_prefill(self, seq: "_Sequence") -> bool:
+        chunk = self.config.prefill_chunk_tokens
+        return not seq.speculative and chunk > 0 and len(seq.context_ids) - seq.cached_tokens > chunk
+
+    def _prefill_chunk(self, seq: "_Sequence") -> bool:
+        """
+        Inference thread: prefills the next `prefill_chunk_tokens` of a long prompt.
+        Returns True once only the last prompt token is left for the batch.
+        """
+        ids = seq.context_ids
+        end = min(seq.cached_tokens + self.config.prefill_chunk_tokens, len(ids) - 1)
+        self._prefill(ids[seq.cached_tokens : end], seq.prompt_cache)
+        self._chunked_stats["chunks"] += 1
+        self._chunked_stats["tokens"] += end - seq.cached_tokens
+        seq.cached_tokens = end
+        return end >= len(ids) - 1
+
+    def _format_prompt(self, messages: list[dict]) -> Prompt:
+        """
+        Renders the chat template and tokenizes it; the only tokenization a job's prompt gets.
+        """
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        prompt = Prompt(text=text, ids=self.tokenizer.encode(text))
+        prompt.shared_tokens = self._shared_prefix_tokens(prompt)
+        return prompt
+
+    def _stopper_for(self, req, tool_runner: Callable | None = None, tool_rounds: int = 0) -> StopMatcher | None:
+        stop = getattr(req, "stop", None)
+        if tool_runner is not None and tool_rounds < self.config.max_tool_rounds:
+            # tags are hidden from the client; the tool runner reports progress instead
+            return StopMatcher(stop, tool_tags=True, hide_tool_tags=True)
+        tool_tags = getattr(req, "stop_on_tool_tag", False)
+        return StopMatcher(stop, tool_tags=tool_tags) if stop or tool_tags else None
+
+    def _format_continuation(self, seq: "_Sequence", tool_result: str) -> tuple[list[dict], Prompt]:
+        """
+        Preparation thread: the paused sequence's conversation with the tool result appended.
+        """
+        messages = seq.messages + [
+            {"role": "assistant", "content": self.tokenizer.decode(seq.generated_ids)},
+            # tool output goes back as a user turn so it works with any chat template
+            {"role": "user", "content": tool_result},
+        ]
+        return messages, self._format_prompt(messages)
+
+    def _continue_sequence(self, seq: "_Sequence", messages: list[dict], prompt: Prompt):
+        """
+        Inference thread: lines a paused sequence's KV cache up with its continued prompt,
+        so only the tokens after the common prefix (the tool turn) are prefilled when it
+        rejoins the batch.
+        """
+        fed = seq.context_ids
+        prompt_ids = prompt.ids
+
+        cache = seq.prompt_cache
+        if cache:
+            held = cache[0].offset
+            keep = min(common_prefix_len(fed, prompt_ids), held, len(prompt_ids) - 1)
+            if held > keep:
+                trim_prompt_cache(cache, held - keep)
+        else:
+            # the batch could not hand the cache back; the shared prefix is still cached
+            cache, keep = self._prompt_cache_for(prompt)
+
+        self._tool_stats["tokens_reused"] += keep
+        self._tool_stats["tokens_prefilled"] += len(prompt_ids) - keep
+        seq.messages = messages
+        seq.prompt = prompt
+        seq.cached_tokens = keep
+        seq.prompt_cache = cache
+        seq.generated_ids = []
+        seq.stopper = self._stopper_for(seq.request, seq.tool_runner, seq.tool_rounds)
+
+    async def _on_gpu(self, fn, *args):
+        """
+        Runs `fn` on the inference thread and awaits its result without blocking the loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._gpu, fn, *args)
+
+    async def _switch_adapter_for(self, job: QueueItem) -> bool:
+        """
+        Swaps to the job's adapter group. Only called when nothing is in flight.
+        Returns False (and fails the job) if the swap is impossible.
+        """
+        group = job.group or "base"
+        if group == (self.adapter_id or "base"):
+            return True
         try:
-            while self.running:
-                job: QueueItem = await request_queue.dequeue()
+            await self._on_gpu(self.load_adapter, group)
+            self._adapter_swaps += 1
+            return True
+        except Exception as e:
+            logger.exception("Adapter swap to %s failed for job %s: %s", group, job.request_id, e)
+            await self._fail_job(job.payload["response_queue"], job.request_id, e)
+            return False
 
-                if not self.running:
-                    break
+    def _record_adapter_wait(self, job: QueueItem):
+        wait = time.time() - job.entry_time
+        stats = self._adapter_waits.setdefault(job.group or "base", {"count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += wait
+        stats["max"] = max(stats["max"], wait)
 
-                try:
-                    req = job.payload["request"]
-                    response_queue = job.payload["response_queue"]
+    async def _admit(self, jobs: list[QueueItem]):
+        """
+        Inserts new jobs into the running batch. They are prefilled on the next step
+        and decode alongside the sequences that are already in flight.
+        Speculative jobs go to the speculative lane instead.
+        """
+        sequences = []
+        for job in jobs:
+            self._record_adapter_wait(job)
+            deadline = job.payload.get("deadline")
+            if deadline is not None and time.time() >= deadline:
+                # expired since the last reap: skip the prefill entirely
+                await self._expire_queued(job)
+                continue
+            try:
+                prepared = await self._prepared(job)
+                self._record_idle_gap(job)
+                # may prefill the shared prefix on a cache miss
+                seq = await self._on_gpu(self._prepare_sequence, job, prepared)
+                if seq.speculative:
+                    self._speculative_waiting.append(seq)
+                elif self._needs_chunked_prefill(seq):
+                    self._start_chunked_prefill(seq)
+                else:
+                    sequences += await self._on_gpu(self._fork_choices, seq)
+            except Exception as e:
+                logger.exception("Error preparing job %s: %s", job.request_id, e)
+                await self._fail_job(job.payload["response_queue"], job.request_id, e)
+                continue
 
-                    # Prepare prompt
-                    messages = []
-                    if getattr(req, "system_prompt", None):
-                        messages.append({"role": "system", "content": req.system_prompt})
-                    messages.append({"role": "user", "content": req.prompt})
+        if not sequences:
+            return
 
-                    prompt_formatted = self.tokenizer.apply_chat_template(
-                        messages, tokenize=False, add_generation_prompt=True
-                    )
+        await self._insert(sequences)
+        logger.info("Admitted %s job(s). Batch size: %s", len(sequences), len(self._active))
 
-                    sampler = make_sampler(
-                        temp=getattr(req, "temp", 0.7),
-                        top_p=1.0,
-                        min_p=0.0,
-                        min_tokens_to_keep=1,
-                    )
+    async def _on_prep(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._prep, fn, *args)
 
-                    async with self.lock:
-                        start_time = time.time()
-                        tokens_generated = 0
-                        peak_gpu = 0.0
-                        peak_temp = 0.0
-                        response_text = ""
-                        prompt_tokens = len(self.tokenizer.encode(prompt_formatted))
-
-                        for response in stream_generate(
-                            self.model,
-                            self.tokenizer,
-                            prompt=prompt_formatted,
-                            max_tokens=req.max_tokens,
-                            sampler=sampler,
-                        ):
-                            tokens_generated += 1
-
-                            stats = monitor.get_snapshot()
-                            if stats:
-                                peak_gpu = max(peak_gpu, stats.get("gpu_usage", 0))
-                                peak_temp = max(peak_temp, stats.get("gpu_temp", 0))
-
-                            chunk = response.text or ""
-                            if chunk:
-                                # stream_generate can emit cumulative text; keep the latest full response.
-                                if response_text and chunk.startswith(response_text):
-                                    response_text = chunk
-                                else:
-                                    response_text += chunk
-
-                            # Send token back to the specific client waiting
-                            await response_queue.put(response.text)
-
-                        duration = time.time() - start_time
-                        final_stats = monitor.get_snapshot()
-
-                    await response_queue.put(None)  # Signal completion
-
-                    log_entry = InferenceLog(
-                        request_id=job.request_id,
-                        adapter_name=self.adapter_id or "base",
-                        prompt=req.prompt,
-                        system_prompt=getattr(req, "system_prompt", None),
-                        response_text=response_text,
-                        tokens_in=prompt_tokens,
-                        tokens_out=tokens_generated,
-                        total_time_sec=duration,
-                        tokens_per_sec=tokens_generated / duration if duration > 0 else 0,
-                        model_name=self.model_id,
-                        temp=getattr(req, "temp", 0.7),
-                        gpu_usage_pct=peak_gpu,
-                        cpu_usage_pct=final_stats.get("cpu_usage", 0),
-                        gpu_temp_c=peak_temp,
-                        ram_usage_pct=final_stats.get("ram_usage", 0),
-                        wattage=final_stats.get("gpu_power", 0),
-                    )
+    async def _prefetch(self):
+        """
+        Starts preparing the next `prepare_ahead` queued jobs so they are tokenized by the
+        time a slot frees up.
+        """
+        for job in await request_queue.peek(self.config.prepare_ahead):
+            if "prepared" not in job.payload:
+                job.payload["prepared"] = self._prep.submit(self._prepare_job, job)
 
-                    asyncio.create_task(asyncio.to_thread(log_stats, log_entry))
+    async def _prepared(self, job: QueueItem) -> _Prepared:
+        future = job.payload.pop("prepared", None)
+        if future is None:
+            self._prep_stats["inline"] += 1
+            return await self._on_prep(self._prepare_job, job)
+        self._prep_stats["prefetched"] += 1
+        return await asyncio.wrap_future(future)
 
-                except asyncio.CancelledError:
-                    raise
-                except Exception as e:
-                    logger.exception("Error in job %s: %s", job.request_id, e)
-                    try:
-                        await job.payload["response_queue"].put(f"[ERROR: {e}]")
-                        await job.payload["response_queue"].put(None)
-                    except Exception:
-                        logger.exception("Failed to notify client for job %s", job.request_id)
-        except asyncio.CancelledError:
-            logger.info("Queue worker cancelled.")
-            raise
-        except Exception:
-            logger.exception("Queue worker crashed")
-        finally:
-            self.running = False
+    def _record_idle_gap(self, job: QueueItem):
+        """
+        Records how long the GPU sat idle before this job's work started, counting only
+        time the job was already waiting.
+        """
+        if self._gpu_idle_since is None:
+            return
+        gap = time.time() - max(self._gpu_idle_since, job.entry_time)
+        self._gpu_idle_since = None
+        self.gpu_idle_gap.add(max(gap, 0.0) * 1000)
+
+    async def _insert(self, sequences: list["_Sequence"]):
+        uids = await self._on_gpu(self._insert_into_batch, sequences)
+        now = time.time()
+        for uid, seq in zip(uids, sequences):
+            seq.uid = uid
+            seq.start_time = seq.start_time or now
+            seq.prompt_cache = None  # owned by the batch now
+            self._active[uid] = seq
+
+    async def _resume(self):
+        """
+        Puts sequences whose tool call returned back into the batch.
+        """
+        ready = list(self._resuming)
+        self._resuming.clear()
+        self._resume_ready.clear()
+
+        sequences = []
+        for seq, tool_result in ready:
+            try:
+                messages, prompt = await self._on_prep(self._format_continuation, seq, tool_result)
+                await self._on_gpu(self._continue_sequence, seq, messages, prompt)
+            except Exception as e:
+                logger.exception("Error resuming job %s: %s", seq.job.request_id, e)
+                await self._retire(seq, error=e)
+                continue
+            # search results can be tens of thousands of tokens
+            if self._needs_chunked_prefill(seq):
+                self._start_chunked_prefill(seq)
+            else:
+                sequences.append(seq)
+
+        if sequences:
+            await self._insert(sequences)
+            logger.info("Resumed %s job(s) after tool calls. Batch size: %s", len(sequences), len(self._active))
+
+    def _start_chunked_prefill(self, seq: "_Sequence"):
+        self._prefilling.append(seq)
+        self._chunked_stats["prompts"] += 1
+        logger.info(
+            "Job %s: prefilling %s prompt tokens in chunks of %s between decode steps.",
+            seq.job.request_id,
+            len(seq.context_ids) - seq.cached_tokens,
+            self.config.prefill_chunk_tokens,
+        )
+
+    async def _prefill_step(self):
+        """
+        Advances the oldest long prompt by one chunk. Run once per worker iteration, so a
+        long prefill costs the running streams one chunk of latency per token instead of
+        stalling them until it completes. The sequence joins the batch after its last chunk.
+        """
+        seq = self._prefilling[0]
+        seq.start_time = seq.start_time or time.time()
+        try:
+            done = await self._on_gpu(self._prefill_chunk, seq)
+            if not done:
+                return
+            self._prefilling.popleft()
+            sequences = await self._on_gpu(self._fork_choices, seq)
+        except Exception as e:
+            logger.exception("Chunked prefill for job %s failed: %s", seq.job.request_id, e)
+            if self._prefilling and self._prefilling[0] is seq:
+                self._prefilling.popleft()
+            seq.prompt_cache = None
+            await self._retire(seq, error=e)
+            return
+        await self._insert(sequences)
+
+    def _preemption_victim(self, priority: int) -> "_Sequence | None":
+        """
+        The running batch sequence to give up its slot for a job at `priority`: the least
+        important one whose class allows preemption, the one with most left to generate on ties.
+        """
+        candidates = [
+            seq
+            for seq in self._active.values()
+            if seq.job.original_priority - priority >= self.preemption.min_priority_gap
+            and self.preemption.policy_for(seq.job.original_priority, settings.priorities) != "never"
+        ]
+        return max(
+            candidates,
+            key=lambda seq: (seq.job.original_priority, seq.request.max_tokens - seq.tokens_generated),
+            default=None,
+        )
+
+    async def _preempt_for_waiting(self):
+        """
+        Frees a batch slot for the best waiting job when the batch is full and a running
+        sequence's priority class allows it to be preempted. One sequence per step.
+        """
+        if self._in_flight() < self.config.max_batch_size:
+            return
+        waiting = await request_queue.peek(1)
+        if not waiting:
+            return
+        job = waiting[0]
+        if job.group != (self.adapter_id or "base") or _choices(job) > 1:
+            return
+        # original priority: a job that only aged up in the queue does not preempt
+        victim = self._preemption_victim(job.original_priority)
+        if victim is None:
+            return
 
-    async def generate_text(self, request):
+        policy = self.preemption.policy_for(victim.job.original_priority, settings.priorities)
+        if policy == "snapshot":
+            caches = await self._on_gpu(self._remove_keeping_caches, [victim.uid])
+            victim.prompt_cache = caches.get(victim.uid)
+        else:
+            await self._on_gpu(self._batch.remove, [victim.uid])
+            victim.prompt_cache = None
+        self._active.pop(victim.uid, None)
+        victim.uid = None
+        self._preempted.append(victim)
+        await self._close_batch_if_idle()
+        job.payload["preempted"] = True
+
+        remaining = max(victim.request.max_tokens - victim.tokens_generated, 0)
+        self.preemption_wait_avoided.add(remaining * self.inter_token_latency.summary()["p50"])
+        self._preemption_stats["preemptions"] += 1
+        self._preemption_stats[policy] += 1
+        logger.info(
+            "Preempted job %s (priority %s, %s tokens in, %s) for job %s (priority %s).",
+            victim.job.request_id,
+            victim.job.original_priority,
+            victim.tokens_generated,
+            policy,
+            job.request_id,
+            job.original_priority,
+        )
+
+    def _restore_preempted(self, seq: "_Sequence"):
+        """
+        Inference thread: lines a preempted sequence's KV state up with its prompt plus the
+        tokens it generated so far. Without a snapshot, those are prefilled again past the
+        shared prefix.
         """
-        The main inference method
-        Protected by a lock to ensure serial processing.
+        fed = seq.context_ids
+        cache = seq.prompt_cache
+        if cache:
+            held = cache[0].offset
+            keep = min(held, len(fed) - 1)
+            if held > keep:
+                trim_prompt_cache(cache, held - keep)
+        else:
+            cache, keep = self._prompt_cache_for(seq.prompt)
+        seq.prompt_cache = cache
+        seq.cached_tokens = keep
+
+    async def _resume_preempted(self, slots: int):
+        """
+        Puts preempted sequences back into the batch, most important first.
         """
-        async with self.lock:
-            start_time = time.time()
+        self._preempted.sort(key=lambda seq: seq.job.original_priority)
+        ready, self._preempted = self._preempted[:slots], self._preempted[slots:]
 
-            # format prompt
-            messages = []
-            if request.system_prompt:
-                messages.append({"role": "system", "content": request.system_prompt})
+        sequences = []
+        for seq in ready:
+            try:
+                await self._on_gpu(self._restore_preempted, seq)
+            except Exception as e:
+                logger.exception("Error resuming preempted job %s: %s", seq.job.request_id, e)
+                await self._retire(seq, error=e)
+                continue
+            self._preemption_stats["resumed"] += 1
+            if self._needs_chunked_prefill(seq):
+                self._start_chunked_prefill(seq)
+            else:
+                sequences.append(seq)
 
-            messages.append({"role": "user", "content": request.prompt})
+        if sequences:
+            await self._insert(sequences)
+            logger.info("Resumed %s preempted job(s). Batch size: %s", len(sequences), len(self._active))
 
-            prompt_formatted = self.tokenizer.apply_chat_template(
-                messages, tokenize=False, add_generation_prompt=True
+    def _insert_into_batch(self, sequences: list["_Sequence"]) -> list[int]:
+        """
+        Inference thread: adds prepared sequences to the batch generator.
+        """
+        if self._batch is None:
+            cfg = self.config
+            self._batch = BatchGenerator(
+                self.model,
+                stop_tokens=set(self.tokenizer.eos_token_ids),
+                completion_batch_size=cfg.max_batch_size,
+                prefill_batch_size=cfg.prefill_batch_size,
+                prefill_step_size=cfg.prefill_step_size,
             )
 
-            response_text = generate(
+        return self._batch.insert(
+            [seq.context_ids[seq.cached_tokens :] for seq in sequences],
+            max_tokens=[max(seq.request.max_tokens - seq.tokens_generated, 1) for seq in sequences],
+            caches=[seq.prompt_cache for seq in sequences],
+            samplers=[seq.sampler for seq in sequences],
+        )
+
+    def _decode_step_sync(self, active: dict[int, "_Sequence"]) -> list[tuple["_Sequence", str, bool]]:
+        """
+        Inference thread: one token step for the whole batch, detokenized per sequence.
+        Returns (sequence, new text, finished) for every sequence that produced output.
+        Sequences that hit a stop string or tool tag are removed from the batch here.
+        """
+        events = []
+        stopped = []
+        paused = []
+        now = time.time()
+        # prompt-processing progress is not needed, only the sampled tokens
+        for response in self._batch.next_generated():
+            seq = active.get(response.uid)
+            if seq is None:
+                continue
+
+            finished = response.finish_reason is not None
+            if seq.first_token_time is None:
+                seq.first_token_time = now
+            # The stop (EOS) token is not part of the visible answer.
+            if response.finish_reason != "stop":
+                seq.detokenizer.add_token(response.token)
+                seq.generated_ids.append(response.token)
+                seq.tokens_generated += 1
+            if finished:
+                seq.finish_reason = response.finish_reason
+                seq.detokenizer.finalize()
+                if seq.session_id:
+                    self._retain_session(seq.session_id, seq.prompt.ids, _finished_cache(response))
+
+            segment = seq.detokenizer.last_segment
+            if seq.stopper is not None:
+                segment = seq.stopper.feed(segment)
+                if finished:
+                    segment += seq.stopper.flush()
+                elif seq.stopper.stopped:
+                    (paused if _wants_tool(seq) else stopped).append(response.uid)
+                    seq.finish_reason = "stop"
+                    finished = True
+            events.append((seq, segment, finished))
+
+        if stopped:
+            self._batch.remove(stopped)
+        if paused:
+            caches = self._remove_keeping_caches(paused)
+            for uid in paused:
+                active[uid].prompt_cache = caches.get(uid)
+        return events
+
+    def _remove_keeping_caches(self, uids: list[int]) -> dict[int, list[Any]]:
+        """
+        Inference thread: takes sequences out of the batch along with their KV caches.
+        """
+        removed = self._batch.remove(uids, return_prompt_caches=True)
+        # each entry is (cache, tokens); the tokens are already tracked on the sequence
+        return {uid: cache for uid, (cache, _tokens) in removed.items()}
+
+    async def _decode_step(self):
+        """
+        Runs one token step for every sequence in the batch on the inference thread and
+        streams the new text to each sequence's own response queue. Finished sequences
+        are retired.
+        """
+        start = time.perf_counter()
+        events = await self._on_gpu(self._decode_step_sync, dict(self._active))
+        elapsed = time.perf_counter() - start
+        if events and elapsed > 0:
+            self.decode_throughput.add(len(events) / elapsed)
+
+        stats = monitor.get_snapshot()
+        for seq in self._active.values():
+            if stats:
+                seq.peak_gpu = max(seq.peak_gpu, stats.get("gpu_usage", 0))
+                seq.peak_temp = max(seq.peak_temp, stats.get("gpu_temp", 0))
+
+        now = time.time()
+        for seq, segment, finished in events:
+            if seq.last_token_time is not None:
+                self.inter_token_latency.add((now - seq.last_token_time) * 1000)
+            elif seq.job.payload.get("preempted"):
+                self.preempting_ttft.add((now - seq.job.entry_time) * 1000)
+            seq.last_token_time = now
+            if segment:
+                seq.chunks.append(segment)
+                # Send token back to the specific client waiting
+                seq.emit(segment)
+
+            if finished:
+                if _wants_tool(seq):
+                    await self._pause(seq)
+                else:
+                    await self._retire(seq)
+
+    async def _pause(self, seq: "_Sequence"):
+        """
+        Parks a sequence that emitted a tool tag while its tool runs off the worker loop.
+        """
+        self._active.pop(seq.uid, None)
+        seq.uid = None
+        await self._close_batch_if_idle()
+
+        seq.tool_rounds += 1
+        self._tool_stats["calls"] += 1
+        self._paused[seq.job.request_id] = seq
+        logger.info(
+            "Job %s paused for %s (round %s).", seq.job.request_id, seq.stopper.tool_tag, seq.tool_rounds
+        )
+        seq.tool_task = asyncio.create_task(self._run_tool(seq))
+
+    async def _run_tool(self, seq: "_Sequence"):
+        try:
+            result = await seq.tool_runner(seq.stopper.tool_tag)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Tool call for job %s failed: %s", seq.job.request_id, e)
+            result = f"[Tool error: {e}]"
+
+        if self._paused.pop(seq.job.request_id, None) is None:
+            return  # cancelled meanwhile
+        self._resuming.append((seq, result or "[Tool returned no results]"))
+        self._resume_ready.set()
+
+    async def _speculative_step(self):
+        """
+        Advances the speculative lane by one streamed token. The draft model proposes
+        `num_draft_tokens` tokens and the base model verifies them in one forward pass;
+        mlx_lm streams accepted tokens individually, flagged with `from_draft`.
+        """
+        seq = self._speculative
+        if seq is None:
+            seq = self._speculative = self._speculative_waiting.popleft()
+            seq.start_time = time.time()
+            seq.stream = stream_generate(
                 self.model,
                 self.tokenizer,
-                prompt=prompt_formatted,
-                max_tokens=request.max_tokens,
-                verbose=False
+                prompt=seq.prompt.ids[seq.cached_tokens :],
+                max_tokens=seq.request.max_tokens,
+                sampler=seq.sampler,
+                prompt_cache=seq.prompt_cache,
+                draft_model=self.draft_model,
+                num_draft_tokens=self.config.num_draft_tokens,
             )
-            
-            end_time = time.time()
 
-            return {
-                "text": response_text,
-                "token_count": len(self.tokenizer.encode(response_text)),
-                "processing_time": end_time - start_time
-            }
+        try:
+            response = await self._on_gpu(next, seq.stream, None)
+        except Exception as e:
+            logger.exception("Speculative job %s failed: %s", seq.job.request_id, e)
+            self._speculative = None
+            await self._fail_job(seq.response_queue, seq.job.request_id, e)
+            return
+
+        if response is not None:
+            if seq.first_token_time is None:
+                seq.first_token_time = time.time()
+            seq.tokens_generated += 1
+            if getattr(response, "from_draft", False):
+                seq.draft_accepted += 1
+            else:
+                # every verification round ends with one token sampled by the base model
+                seq.verify_rounds += 1
+
+            text = response.text
+            if seq.stopper is not None:
+                text = seq.stopper.feed(text)
+                if response.finish_reason is not None:
+                    text += seq.stopper.flush()
+            if text:
+                seq.chunks.append(text)
+                seq.emit(text)
+            seq.finish_reason = response.finish_reason
+
+        stopped = seq.stopper is not None and seq.stopper.stopped
+        if stopped:
+            seq.finish_reason = "stop"
+            await self._on_gpu(seq.stream.close)
 
-    async def generate_stream(self, request) -> AsyncGenerator[str, None]:
+        if response is None or response.finish_reason is not None or stopped:
+            self._speculative = None
+            if seq.session_id:
+                await self._on_gpu(
+                    self._retain_session,
+                    seq.session_id,
+                    seq.prompt.ids,
+                    seq.prompt_cache[: len(self.model.layers)],
+                )
+            seq.prompt_cache = None
+            await self._retire(seq)
+
+    async def cancel(self, request_id: str, reason: str = "client disconnected") -> bool:
         """
-        The Producer: pushes a request into the queue and yields streamed tokens.
+        Cancels a job. Queued jobs are removed before dispatch; in-flight ones stop at the
+        next token boundary. Returns True if the job was still queued.
+
+        A caller sharing a coalesced job only detaches; the job stops once nobody reads it.
+        """
+        flight = self._flight_of.pop(request_id, None)
+        if flight is not None:
+            if flight.detach(request_id):
+                self._coalesce_stats["detached"] += 1
+                logger.info("Caller %s detached from shared job %s (%s).", request_id, flight.request_id, reason)
+                return False
+            self._close_flight(flight)
+            request_id = flight.request_id
+
+        item = await request_queue.remove(request_id)
+        if item is not None:
+            saved = item.payload["request"].max_tokens
+            self._cancel_stats["queued"] += 1
+            self._cancel_stats["tokens_saved"] += saved
+            logger.info("Cancelled queued job %s (%s); saved up to %s tokens.", request_id, reason, saved)
+            item.payload["response_queue"].put_nowait(None)
+            return True
+
+        self._cancel_requests[request_id] = (reason, time.time())
+        return False
+
+    async def _reap_cancelled(self):
+        """
+        Stops in-flight sequences that were cancelled or ran past their deadline.
         """
+        now = time.time()
+        running = list(self._active.values()) + list(self._speculative_waiting) + list(self._paused.values())
+        running += [seq for seq, _ in self._resuming] + list(self._prefilling) + self._preempted
+        if self._speculative:
+            running.append(self._speculative)
+
+        stopped: list[tuple[_Sequence, str]] = []
+        for seq in running:
+            # not popped yet: every choice of a parallel-sampling job must see it
+            cancel = self._cancel_requests.get(seq.job.request_id)
+            if cancel is not None:
+                stopped.append((seq, cancel[0]))
+            elif seq.deadline is not None and now >= seq.deadline:
+                stopped.append((seq, "deadline"))
+        for seq, _ in stopped:
+            self._cancel_requests.pop(seq.job.request_id, None)
+
+        # forget cancels for jobs that finished (or never get admitted) in the meantime
+        for request_id, (_, requested) in list(self._cancel_requests.items()):
+            if now - requested > 60:
+                del self._cancel_requests[request_id]
+
+        await self._reap_flight_deadlines(now)
+        await self._reap_queued_deadlines(now)
+
+        if not stopped:
+            return
+
+        batch_uids = [seq.uid for seq, _ in stopped if seq.uid in self._active]
+        if batch_uids:
+            await self._on_gpu(self._batch.remove, batch_uids)
+
+        for seq, reason in stopped:
+            if seq is self._speculative:
+                self._speculative = None
+                await self._on_gpu(seq.stream.close)
+            elif seq in self._speculative_waiting:
+                self._speculative_waiting.remove(seq)
+            elif seq in self._prefilling:
+                self._prefilling.remove(seq)
+            elif seq in self._preempted:
+                self._preempted.remove(seq)
+            elif self._paused.pop(seq.job.request_id, None) is not None:
+                seq.tool_task.cancel()
+            else:
+                self._resuming = deque(item for item in self._resuming if item[0] is not seq)
+            seq.prompt_cache = None
+            seq.job.payload["stopped"] = reason
+            # never cache a partial answer
+            seq.job.payload.pop("cache_key", None)
+            seq.job.payload.pop("semantic", None)
+
+            saved = max(seq.request.max_tokens - seq.tokens_generated, 0)
+            self._cancel_stats["deadline" if reason == "deadline" else "in_flight"] += 1
+            self._cancel_stats["tokens_saved"] += saved
+            logger.info(
+                "Stopped job %s (%s) after %s tokens; saved up to %s tokens.",
+                seq.job.request_id,
+                reason,
+                seq.tokens_generated,
+                saved,
+            )
+            error = TimeoutError("Deadline exceeded") if reason == "deadline" else None
+            await self._retire(seq, error=error)
+
+    async def _reap_queued_deadlines(self, now: float):
+        """
+        Fails queued jobs whose deadline passed, so their callers hear back now rather than
+        when the job reaches the head of the queue, and their queue slots free up.
+        """
+        while self._queued_deadlines and self._queued_deadlines[0][0] <= now:
+            _, request_id = heapq.heappop(self._queued_deadlines)
+            job = await request_queue.remove(request_id)
+            if job is not None:  # None: already dispatched or cancelled
+                await self._expire_queued(job)
+
+    async def _expire_queued(self, job: QueueItem):
+        self._cancel_stats["deadline"] += 1
+        self._cancel_stats["tokens_saved"] += job.payload["request"].max_tokens
+        self._deadline_stats["missed"] += 1
+        logger.info("Dropped job %s: deadline passed while queued.", job.request_id)
+        await self._fail_job(job.payload["response_queue"], job.request_id, TimeoutError("Deadline exceeded"))
+
+    async def _reap_flight_deadlines(self, now: float):
+        """
+        Times out individual callers of shared jobs; the job itself stops with its last caller.
+        """
+        for flight in list(self._flights.values()):
+            for request_id, deadline in list(flight.deadlines.items()):
+                if now < deadline:
+                    continue
+                self._flight_of.pop(request_id, None)
+                self._deadline_stats["missed"] += 1
+                if not flight.detach(request_id, TimeoutError("Deadline exceeded")):
+                    self._close_flight(flight)
+                    await self.cancel(flight.request_id, reason="deadline")
+
+    def _record_outcome(self, seq: "_Sequence", payload: dict[str, Any]):
+        """
+        Feeds a finished job into the admission estimates and deadline counters.
+        """
+        error = payload.get("error")
+        if error is None and "stopped" not in payload:
+            self.cost_model.observe(
+                settings.priorities.class_of(seq.job.original_priority),
+                seq.job.group,
+                payload["tokens_out"] // getattr(seq.request, "n", 1),
+            )
+        # a shared job counts its callers still waiting; those that timed out were counted then
+        if isinstance(seq.response_queue, _Flight):
+            callers = len(seq.response_queue.deadlines)
+        else:
+            callers = int(seq.deadline is not None)
+        if isinstance(error, TimeoutError):
+            self._deadline_stats["missed"] += callers
+        elif error is None and "stopped" not in payload:
+            self._deadline_stats["met"] += callers
+
+    def _estimated_finish(self, request, priority: int, adapter: str) -> float | None:
+        """
+        When a request admitted now would roughly finish: the work queued ahead of it and
+        left in the batch, plus its own, at the recent batch throughput. Queued jobs count
+        at the cost they were enqueued with, running ones at the expected answer for their
+        class and adapter less what they have generated. None until there are enough samples.
+        """
+        if self.decode_throughput.total_count < self.config.shed_min_samples:
+            return None
+        throughput = self.decode_throughput.summary()["mean"]
+        if throughput <= 0:
+            return None
+        work = request_queue.backlog(priority)
+        for seq in self._active.values():
+            expected = self.cost_model.expected_output(
+                seq.request.max_tokens, settings.priorities.class_of(seq.job.original_priority), seq.job.group
+            )
+            work += max(expected - seq.tokens_generated, 0)
+        work += self.cost_model.estimate(request, settings.priorities.class_of(priority), adapter)
+        return time.time() + work / throughput
+
+    async def _retire(self, seq: "_Sequence", error: Exception | None = None):
+        """
+        Removes a finished sequence from the batch, closes its stream and logs its stats.
+        """
+        self._active.pop(seq.uid, None)
+        await self._close_batch_if_idle()
+
+        # a parallel-sampling job ends with its last choice
+        payload = seq.job.payload
+        payload["choices_left"] = payload.get("choices_left", 1) - 1
+        payload["tokens_out"] = payload.get("tokens_out", 0) + seq.tokens_generated
+        request_queue.record_served(seq.job.client, seq.tokens_generated)
+        if error is not None:
+            payload.setdefault("error", error)
+        if payload["choices_left"] <= 0:
+            if "error" in payload:
+                seq.response_queue.put_nowait(_JobError(payload["error"]))
+            seq.response_queue.put_nowait(_JobDone(payload["tokens_out"]))
+            self._record_outcome(seq, payload)
+            seq.response_queue.put_nowait(None)  # Signal completion
+
+        duration = time.time() - seq.start_time
+        final_stats = monitor.get_snapshot()
+        req = seq.request
+
+        # decode-only throughput, excluding queueing/prefill before the first token
+        decode_time = time.time() - (seq.first_token_time or time.time())
+        effective_tps = max(seq.tokens_generated - 1, 0) / decode_time if decode_time > 0 else 0.0
+        ttft = (seq.first_token_time or time.time()) - seq.start_time
+        if self._first_request_ttft is None and seq.first_token_time is not None:
+            self._first_request_ttft = ttft
+        acceptance_rate = None
+        if seq.speculative and seq.verify_rounds:
+            proposed = seq.verify_rounds * self.config.num_draft_tokens
+            acceptance_rate = min(1.0, seq.draft_accepted / proposed)
+        logger.info(
+            "Finished %s | tokens_in=%s cached=%s tokens_out=%s ttft=%.3fs stop=%r",
+            seq.job.request_id,
+            seq.prompt.num_tokens,
+            seq.cached_tokens,
+            seq.tokens_generated,
+            ttft,
+            seq.stopper.reason if seq.stopper else None,
+        )
+        log_entry = InferenceLog(
+            request_id=seq.job.request_id,
+            adapter_name=self.adapter_id or "base",
+            prompt=req.prompt,
+            system_prompt=getattr(req, "system_prompt", None),
+            response_text="".join(seq.chunks),
+            tokens_in=seq.prompt.num_tokens,
+            tokens_out=seq.tokens_generated,
+            total_time_sec=duration,
+            tokens_per_sec=seq.tokens_generated / duration if duration > 0 else 0,
+            model_name=self.model_id,
+            temp=getattr(req, "temp", 0.7),
+            gpu_usage_pct=seq.peak_gpu,
+            cpu_usage_pct=final_stats.get("cpu_usage", 0),
+            gpu_temp_c=seq.peak_temp,
+            ram_usage_pct=final_stats.get("ram_usage", 0),
+            wattage=final_stats.get("gpu_power", 0),
+            draft_model_name=self.draft_model_id if seq.speculative else None,
+            draft_acceptance_rate=acceptance_rate,
+            effective_tokens_per_sec=effective_tps,
+        )
+
+        asyncio.create_task(asyncio.to_thread(log_stats, log_entry))
+
+        # answers that used a tool depend on live results, so only tool-free ones are kept
+        if error is None and seq.tool_rounds == 0 and seq.choice is None:
+            self._cache_response(seq, duration)
+
+    def _cache_response(self, seq: "_Sequence", duration: float):
+        cache_key = seq.job.payload.get("cache_key")
+        semantic = seq.job.payload.get("semantic")
+        if cache_key is None and semantic is None:
+            return
+        entry = CachedResponse(
+            chunks=list(seq.chunks), tokens_out=seq.tokens_generated, gpu_seconds=duration, created=time.time()
+        )
+        if cache_key is not None:
+            asyncio.create_task(asyncio.to_thread(self.response_cache.put, cache_key, entry))
+        if semantic is not None:
+            scope, vector = semantic
+            self.semantic_cache.put(
+                scope, seq.request.prompt, vector, entry, seq.request.max_tokens, seq.finish_reason
+            )
+
+    async def _close_batch_if_idle(self):
+        if not self._active and self._batch is not None:
+            # Drop the generator between bursts so adapter swaps apply to the next batch.
+            batch, self._batch = self._batch, None
+            await self._on_gpu(batch.close)
+
+    async def _fail_job(self, response_queue: asyncio.Queue, request_id: str, error: Exception):
+        try:
+            await response_queue.put(_JobError(error))
+            await response_queue.put(None)
+        except Exception:
+            logger.exception("Failed to notify client for job %s", request_id)
+
+    async def _fail_batch(self, error: Exception):
+        """
+        A failed step leaves the batch state unusable, so every in-flight job is errored out,
+        once however many of its choices were in the batch.
+        """
+        jobs = {seq.job.request_id: seq for seq in self._active.values()}
+        self._active.clear()
+        self._batch = None
+        for request_id, seq in jobs.items():
+            await self._fail_job(seq.response_queue, request_id, error)
+
+    def _in_flight(self) -> int:
+        sequences = [
+            *self._active.values(),
+            *self._speculative_waiting,
+            *self._paused.values(),
+            *(seq for seq, _ in self._resuming),
+            *self._prefilling,
+        ]
+        if self._speculative:
+            sequences.append(self._speculative)
+        return len(sequences)
+
+    def _has_work(self) -> bool:
+        # preempted sequences hold no slot but still have to finish
+        return self._in_flight() > 0 or bool(self._preempted)
+
+    def _runnable(self) -> bool:
+        """
+        True if there is GPU work right now (as opposed to only sequences waiting on tools).
+        """
+        return bool(
+            self._active
+            or self._speculative
+            or self._speculative_waiting
+            or self._resuming
+            or self._prefilling
+            or self._preempted
+        )
+
+    async def _worker_loop(self):
+        """
+        The Consumer: a continuous-batching scheduler.
+
+        New jobs are admitted from the queue at token boundaries (up to `max_batch_size`),
+        every active sequence advances one token per step, and finished sequences are
+        retired without waiting for the rest of the batch. Long prompts are prefilled one
+        chunk per iteration, between decode steps, and join the batch when done.
+
+        The batch shares one set of weights, so only jobs for the active adapter are admitted.
+        Other adapters' jobs wait for the batch to drain; once the best of them has waited
+        `adapter_max_wait_sec`, admission stops so the swap happens promptly.
+        """
+        logger.info("Queue worker loop running (max batch size %s).", self.config.max_batch_size)
+        try:
+            while self.running:
+                if not self._has_work():
+                    # Idle: block until there is work, then set the GPU up for its adapter.
+                    job = await request_queue.dequeue()
+                    jobs = [job] if await self._switch_adapter_for(job) else []
+                else:
+                    jobs = []
+                    if not self._runnable():
+                        # only tool calls outstanding: wait for one, polling for same-adapter jobs
+                        with contextlib.suppress(asyncio.TimeoutError):
+                            await asyncio.wait_for(self._resume_ready.wait(), timeout=0.05)
+
+                if self._active and len(request_queue):
+                    await self._preempt_for_waiting()
+
+                # Fill free slots with jobs for the active adapter without waiting.
+                group = self.adapter_id or "base"
+                while self._in_flight() + sum(map(_choices, jobs)) < self.config.max_batch_size:
+                    job, passed_over = await request_queue.dequeue_affine(group, self.config.adapter_max_wait_sec)
+                    if job is None:
+                        break
+                    if passed_over:
+                        self._swaps_avoided += 1
+                    jobs.append(job)
+
+                if not self.running:
+                    break
+
+                # slots nobody queued could use go back to preempted sequences
+                free = self.config.max_batch_size - self._in_flight() - sum(map(_choices, jobs))
+                if self._preempted and free > 0:
+                    await self._resume_preempted(free)
+
+                if self._resuming:
+                    await self._resume()
+
+                if jobs:
+                    await self._admit(jobs)
+
+                if len(request_queue):
+                    await self._prefetch()
+
+                if self._prefilling:
+                    await self._prefill_step()
+
+                if self._active:
+                    try:
+                        await self._decode_step()
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.exception("Batch step failed: %s", e)
+                        await self._fail_batch(e)
+
+                if self._speculative or self._speculative_waiting:
+                    await self._speculative_step()
+
+                await self._reap_cancelled()
+
+                if not self._runnable() and self._gpu_idle_since is None:
+                    self._gpu_idle_since = time.time()
+
+                # Give the event loop a chance to flush tokens to clients.
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            logger.info("Queue worker cancelled.")
+            raise
+        except Exception:
+            logger.exception("Queue worker crashed")
+        finally:
+            self.running = False
+
+    async def _submit(
+        self,
+        request,
+        job_class: str = "stream",
+        priority: int | None = None,
+        tool_runner: Callable[[str], Awaitable[str]] | None = None,
+    ) -> tuple[str, asyncio.Queue]:
+        """
+        Single admission path: every generation becomes a job in `request_queue`.
+        Returns the job's request id and response queue.
+        """
+        if not self.ready:
+            raise EngineNotReady("Model is still loading. Please retry shortly.")
+        n = getattr(request, "n", 1)
+        if n > self.config.max_choices:
+            raise ValueError(f"n={n} exceeds the limit of {self.config.max_choices} choices per request.")
+        if n > 1 and tool_runner is not None:
+            raise ValueError("Parallel sampling (n > 1) cannot be combined with tool calls.")
         await self.start_background_tasks()
 
         # Each request has its own response queue to stream tokens back to the caller.
-        response_queue: asyncio.Queue[str | None] = asyncio.Queue()
+        response_queue: asyncio.Queue = asyncio.Queue()
         request_id = str(uuid.uuid4())
+        adapter = self.resolve_adapter(getattr(request, "adapter", None))
+        if priority is None:
+            priority = getattr(request, "priority", None)
+        if priority is None:
+            priority = request_queue.config.default_priority
+        timeout_sec = getattr(request, "timeout_sec", None)
+        deadlines = [getattr(request, "deadline", None), time.time() + timeout_sec if timeout_sec else None]
+        deadline = min((d for d in deadlines if d is not None), default=None)
+
+        use_cache = self._use_response_cache(request)
+        coalesce = self._can_coalesce(request, tool_runner)
+        key = None
+        if use_cache or coalesce:
+            key = await self._on_prep(self._response_cache_key, request, adapter, tool_runner is not None)
+
+        cache_key = key if use_cache else None
+        semantic = None
+        if use_cache:
+            cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+            if cached is None and self._use_semantic_cache(request, tool_runner):
+                scope, vector, hit = await asyncio.to_thread(self._semantic_lookup, request, adapter)
+                semantic = (scope, vector)
+                if hit is not None:
+                    cached, similarity, matched = hit
+                    logger.info("Semantic cache hit for %s (%.3f similar to %r).", request_id, similarity, matched[:60])
+            if cached is not None:
+                # replayed through the same queue protocol as a live generation
+                logger.info("Response cache hit for %s (%s tokens).", request_id, cached.tokens_out)
+                for chunk in cached.chunks:
+                    response_queue.put_nowait(chunk)
+                response_queue.put_nowait(_JobDone(cached.tokens_out))
+                response_queue.put_nowait(None)
+                return request_id, response_queue
+
+        flight = None
+        # shed up front what cannot finish in time, rather than serving an answer nobody reads
+        # (joining a running identical job costs nothing, so it is never shed)
+        if deadline is not None and self.config.deadline_shedding and not (coalesce and key in self._flights):
+            finish = self._estimated_finish(request, priority, adapter)
+            if finish is not None and finish > deadline:
+                self._shed_stats["deadline"] += 1
+                logger.info(
+                    "Shed request %s: estimated to finish %.1fs past its deadline.", request_id, finish - deadline
+                )
+                raise Overloaded(
+                    f"Request cannot finish before its deadline (estimated {finish - time.time():.1f}s, "
+                    f"{max(deadline - time.time(), 0):.1f}s left). Please retry later."
+                )
+
+        if coalesce:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._coalesce_stats["joined"] += 1
+                self._flight_of[request_id] = flight
+                logger.info("Request %s joined identical in-flight job %s.", request_id, flight.request_id)
+                # a more important or more urgent caller must not wait at the shared job's position
+                await request_queue.reprioritise(flight.request_id, priority, deadline)
+                return request_id, flight.subscribe(request_id, deadline)
+            flight = _Flight(key, request_id, on_close=self._close_flight)
+            response_queue = flight.subscribe(request_id, deadline)
+            self._flights[key] = flight
+            self._flight_of[request_id] = flight
+            self._coalesce_stats["flights"] += 1
+            # each caller's deadline is enforced on its own (_reap_flight_deadlines); the
+            # queue only orders the shared job by the earliest of them
+            deadline = None
 
         try:
             await request_queue.enqueue(
                 request_id=request_id,
-                priority=getattr(request, "priority", None),
+                priority=priority,
+                group=adapter,
+                job_class=job_class,
+                client=getattr(request, "client_id", None),
+                # estimated tokens: what fair queuing charges the client, SJF orders by and
+                # max_queued_tokens caps
+                cost=self.cost_model.estimate(request, settings.priorities.class_of(priority), adapter),
+                deadline=min(flight.deadlines.values(), default=None) if flight is not None else deadline,
                 payload={
                     "request": request,
-                    "response_queue": response_queue,
+                    # a shared job writes to its flight, which fans out to every caller
+                    "response_queue": flight or response_queue,
+                    "deadline": deadline,
+                    "tool_runner": tool_runner,
+                    "cache_key": cache_key,
+                    "semantic": semantic,
                 },
             )
-        except BufferError:
-            raise RuntimeError("Request queue is full. Please retry shortly.")
-
-        while True:
-            token = await response_queue.get()
-            if token is None:
-                break
-            yield token
+        except BufferError as e:
+            if flight is not None:
+                self._close_flight(flight)
+            self._shed_stats["queue_full"] += 1
+            raise Overloaded(f"{e} Please retry shortly.")
+
+        if deadline is not None:
+            heapq.heappush(self._queued_deadlines, (deadline, request_id))
+
+        return request_id, response_queue
+
+    async def generate_text(self, request, job_class: str = "blocking", priority: int | None = None):
+        """
+        Non-streaming inference: queued like every other job, with tokens collected server-side.
+        With `n` > 1 every sampled choice is returned under "choices" ("text" is the first).
+        """
+        start_time = time.time()
+        request_id, response_queue = await self._submit(request, job_class=job_class, priority=priority)
+
+        chunks: list[str] = []
+        choices: dict[int, list[str]] = {}
+        token_count = 0
+        finished = False
+        try:
+            while True:
+                token = await response_queue.get()
+                if token is None:
+                    finished = True
+                    break
+                if isinstance(token, _JobDone):
+                    token_count = token.tokens_out
+                    continue
+                if isinstance(token, _JobError):
+                    finished = True
+                    raise token.error
+                if isinstance(token, tuple):
+                    index, text = token
+                    choices.setdefault(index, []).append(text)
+                    continue
+                chunks.append(token)
+        finally:
+            if not finished:
+                # caller went away (task cancelled); stop spending GPU on the answer
+                await self.cancel(request_id, reason="caller cancelled")
+
+        n = getattr(request, "n", 1)
+        texts = ["".join(choices.get(index, [])) for index in range(n)] if n > 1 else None
+        return {
+            "text": texts[0] if texts else "".join(chunks),
+            "choices": texts,
+            # counted by the engine as it decoded; no second tokenization
+            "token_count": token_count,
+            "processing_time": time.time() - start_time,
+        }
+
+    async def generate_stream(
+        self, request, tool_runner: Callable[[str], Awaitable[str]] | None = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        The Producer: pushes a request into the queue and yields streamed tokens.
+
+        With `tool_runner`, the turn is generated in a single pass: when the model emits a
+        [SEARCH: ...] / [EXPAND: ...] tag, the sequence pauses, `tool_runner(tag)` is awaited
+        and its result is appended to the sequence's live KV state before decoding resumes.
+
+        With `n` > 1 the choices decode side by side and chunks are yielded as
+        (choice index, text) tuples, interleaved.
+        """
+        request_id, response_queue = await self._submit(request, tool_runner=tool_runner)
+
+        finished = False
+        try:
+            while True:
+                token = await response_queue.get()
+                if token is None:
+                    finished = True
+                    break
+                if isinstance(token, _JobDone):
+                    continue
+                if isinstance(token, _JobError):
+                    token = f"[ERROR: {token.error}]"
+                yield token
+        finally:
+            if not finished:
+                # the consumer stopped reading (e.g. WebSocket disconnect)
+                await self.cancel(request_id)
 
 
 # global instance
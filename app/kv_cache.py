@@ -0,0 +1,241 @@
+import copy
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from app.logging_setup import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def cache_nbytes(cache: list[Any]) -> int:
+    """
+    Bytes held by a per-layer prompt cache (list of mlx_lm KV caches).
+    """
+    total = 0
+    for layer in cache:
+        state = layer.state
+        arrays = state if isinstance(state, (list, tuple)) else [state]
+        total += sum(getattr(a, "nbytes", 0) for a in arrays if a is not None)
+    return total
+
+
+def common_prefix_len(a: list[int], b: list[int]) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+@dataclass
+class _PrefixEntry:
+    tokens: tuple[int, ...]
+    cache: list[Any]
+    nbytes: int
+
+
+class PrefixCache:
+    """
+    LRU store of prefilled KV caches for common token prefixes (e.g. the static system prompt).
+
+    Entries are keyed by (adapter, hash of the token sequence). A lookup finds the longest
+    cached prefix of the incoming prompt and hands back a private copy of its KV state,
+    so only the suffix needs to be prefilled.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple[str, int], _PrefixEntry]" = OrderedDict()
+        # distinct cached prefix lengths per adapter, checked longest first
+        self._lengths: dict[str, set[int]] = {}
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+
+    def _key(self, adapter: str, tokens) -> tuple[str, int]:
+        return adapter, hash(tuple(tokens))
+
+    def fetch(self, adapter: str, tokens: list[int]) -> tuple[Optional[list[Any]], int]:
+        """
+        Returns (copy of the cache, prefix length) for the longest cached prefix of `tokens`,
+        or (None, 0) on a miss.
+        """
+        for length in sorted(self._lengths.get(adapter, ()), reverse=True):
+            if length > len(tokens):
+                continue
+            key = self._key(adapter, tokens[:length])
+            entry = self._entries.get(key)
+            if entry is None or entry.tokens != tuple(tokens[:length]):
+                continue
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.tokens_saved += length
+            return copy.deepcopy(entry.cache), length
+
+        self.misses += 1
+        return None, 0
+
+    def insert(self, adapter: str, tokens: list[int], cache: list[Any]) -> None:
+        """
+        Stores a prefilled cache for `tokens`. The cache must not be mutated afterwards;
+        callers keep decoding on a copy.
+        """
+        key = self._key(adapter, tokens)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        nbytes = cache_nbytes(cache)
+        if nbytes > self.max_bytes:
+            logger.info("Prefix of %s tokens (%s bytes) exceeds cache budget; not cached.", len(tokens), nbytes)
+            return
+
+        self._entries[key] = _PrefixEntry(tokens=tuple(tokens), cache=cache, nbytes=nbytes)
+        self._lengths.setdefault(adapter, set()).add(len(tokens))
+        self.bytes_used += nbytes
+
+        while self.bytes_used > self.max_bytes and self._entries:
+            self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        (adapter, _), entry = self._entries.popitem(last=False)
+        self.bytes_used -= entry.nbytes
+        self.evictions += 1
+        if not any(k[0] == adapter and len(e.tokens) == len(entry.tokens) for k, e in self._entries.items()):
+            self._lengths.get(adapter, set()).discard(len(entry.tokens))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._lengths.clear()
+        self.bytes_used = 0
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+@dataclass
+class _SessionEntry:
+    adapter: str
+    tokens: list[int]
+    cache: list[Any]
+    nbytes: int
+    last_used: float
+
+
+class SessionCache:
+    """
+    Keeps the prompt KV state of each active session's last turn so the next turn only
+    prefills what changed since then.
+
+    Entries are handed out by `take` (no copy; the session owns one cache at a time) and
+    handed back by `store` once the turn finishes. Memory is bounded by `max_bytes` with
+    LRU eviction, and idle sessions are dropped by `evict_idle`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._session_stats: dict[str, dict[str, int]] = {}
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.tokens_saved = 0
+
+    def _count(self, session_id: str, key: str, amount: int = 1) -> None:
+        stats = self._session_stats.setdefault(session_id, {"hits": 0, "misses": 0, "tokens_saved": 0})
+        stats[key] += amount
+
+    def take(self, session_id: str, adapter: str, tokens: list[int]) -> tuple[Optional[list[Any]], int, int]:
+        """
+        Removes the session's cache and returns (cache, reusable tokens, tokens held by the cache).
+        The caller trims the cache down to the reusable length. Returns (None, 0, 0) on a miss.
+        """
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.bytes_used -= entry.nbytes
+
+        matched = common_prefix_len(entry.tokens, tokens) if entry and entry.adapter == adapter else 0
+        if matched == 0:
+            self.misses += 1
+            self._count(session_id, "misses")
+            return None, 0, 0
+
+        self.hits += 1
+        self.tokens_saved += matched
+        self._count(session_id, "hits")
+        self._count(session_id, "tokens_saved", matched)
+        return entry.cache, matched, len(entry.tokens)
+
+    def store(self, session_id: str, adapter: str, tokens: list[int], cache: list[Any]) -> None:
+        """
+        Saves the KV state for `tokens` as the session's latest turn, replacing any older one.
+        """
+        self.evict(session_id, forget_stats=False)
+
+        nbytes = cache_nbytes(cache)
+        if nbytes > self.max_bytes:
+            logger.info("Session %s cache (%s bytes) exceeds budget; not retained.", session_id, nbytes)
+            return
+
+        self._entries[session_id] = _SessionEntry(
+            adapter=adapter, tokens=list(tokens), cache=cache, nbytes=nbytes, last_used=time.time()
+        )
+        self.bytes_used += nbytes
+
+        while self.bytes_used > self.max_bytes and self._entries:
+            oldest, entry = self._entries.popitem(last=False)
+            self.bytes_used -= entry.nbytes
+            self.evictions += 1
+            logger.info("Evicted session cache %s to stay within budget.", oldest)
+
+    def evict(self, session_id: str, forget_stats: bool = True) -> bool:
+        entry = self._entries.pop(session_id, None)
+        if forget_stats:
+            self._session_stats.pop(session_id, None)
+        if entry is None:
+            return False
+        self.bytes_used -= entry.nbytes
+        return True
+
+    def evict_idle(self, idle_seconds: float) -> int:
+        """
+        Drops sessions whose last turn finished more than `idle_seconds` ago.
+        """
+        cutoff = time.time() - idle_seconds
+        stale = [sid for sid, entry in self._entries.items() if entry.last_used < cutoff]
+        for session_id in stale:
+            self.evict(session_id)
+        self.evictions += len(stale)
+        return len(stale)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "tokens_saved": self.tokens_saved,
+            # snapshot first: the inference thread may update entries concurrently
+            "per_session": {sid: dict(stats) for sid, stats in list(self._session_stats.items())},
+        }
@@ -1,12 +1,17 @@
 import asyncio
 
-from fastapi import FastAPI, HTTPException
-from app.engine import engine
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from app.engine import EngineNotReady, Overloaded, engine
+from app.monitor import monitor
+from app.queue import request_queue
 from app.session_manager import start_session_sweeper
+from app.startup import startup
 from app.schemas import GenerateRequest, GenerateResponse, AdapterLoadRequest
-from app.ws_chat import router as ws_router
+from app.ws_chat import client_identity, router as ws_router
 from data.service.history_api import router as history_router
 from data.service.vector_api import router as vector_router
+from core.memory import memory
 
 app = FastAPI(title="HalaAI", version="1.0")
 app.include_router(ws_router)
@@ -15,7 +20,16 @@ app.include_router(vector_router)
 
 @app.on_event("startup")
 async def start_engine_tasks():
-    await engine.start_background_tasks()
+    # Load in the background: the server accepts connections (and answers /ready) meanwhile.
+    app.state.startup = asyncio.create_task(
+        startup.run(
+            {
+                "engine": engine.initialise,
+                "memory": lambda: asyncio.to_thread(memory.initialise),
+                "monitor": lambda: asyncio.to_thread(monitor.start),
+            }
+        )
+    )
     app.state.session_sweeper = asyncio.create_task(start_session_sweeper(engine))
 
 @app.on_event("shutdown")
@@ -27,30 +41,63 @@ async def stop_engine_tasks():
 
 @app.get("/")
 def health_check():
-    return {"status": "online", "current_adapter": engine.adapter_id}
+    return {
+        "status": "online",
+        "current_adapter": engine.adapter_id,
+        "default_adapter": engine.default_adapter,
+    }
+
+@app.get("/ready")
+def readiness_check():
+    """
+    Readiness, separate from `/` liveness: 503 until every subsystem has loaded.
+    """
+    status = startup.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/engine/stats")
+async def engine_stats():
+    return {**engine.stats(), "queue": await request_queue.stats()}
 
 @app.post("/chat", response_model=GenerateResponse)
-async def chat_endpoint(request: GenerateRequest):
+async def chat_endpoint(request: GenerateRequest, http_request: Request):
     """
     Main endpoint for all your apps 
     """
+    if request.client_id is None:
+        request.client_id = client_identity(http_request)
     try:
         result = await engine.generate_text(request)
         return GenerateResponse(
             text=result["text"],
+            choices=result["choices"],
             token_count=result["token_count"],
             processing_time=result["processing_time"]
         )
+    except EngineNotReady as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except FileNotFoundError as e:
+        # unknown per-request adapter
+        raise HTTPException(status_code=404, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/adapters/load")
 def load_adapter(request: AdapterLoadRequest):
     """
-    Call this BEFORE sending a chat request if you need a specific specialist.
+    Sets the adapter used by requests that do not name one in their `adapter` field.
+    The worker swaps to it between adapter groups.
     """
     try:
-        engine.load_adapter(request.adapter_name)
+        engine.set_default_adapter(request.adapter_name)
         return {"status": "success", "loaded": request.adapter_name}
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Adapter not found")
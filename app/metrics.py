@@ -0,0 +1,61 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Iterable
+
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    """
+    Nearest-rank percentile (pct in 0..100). Returns 0.0 for no values.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class RollingWindow:
+    """
+    Keeps the most recent `maxlen` samples and summarises them.
+    """
+
+    def __init__(self, maxlen: int = 1024):
+        self._values: deque[float] = deque(maxlen=maxlen)
+        self.total_count = 0
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+        self.total_count += 1
+
+    def summary(self) -> dict[str, Any]:
+        values = list(self._values)
+        return {
+            "count": self.total_count,
+            "mean": sum(values) / len(values) if values else 0.0,
+            "p50": percentile(values, 50),
+            "p99": percentile(values, 99),
+            "max": max(values, default=0.0),
+        }
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop responsiveness: how late a short sleep wakes up, in milliseconds.
+    Anything that blocks the loop (e.g. a synchronous decode step) shows up as lag.
+    """
+
+    def __init__(self, interval_sec: float = 0.05, window: int = 1200):
+        self.interval_sec = interval_sec
+        self.lag_ms = RollingWindow(window)
+
+    async def run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval_sec)
+            lag = time.perf_counter() - start - self.interval_sec
+            self.lag_ms.add(max(0.0, lag) * 1000)
+
+    def stats(self) -> dict[str, Any]:
+        return self.lag_ms.summary()
@@ -34,9 +34,17 @@ class HardwareMonitor:
             "soc_temp": 0.0
         }
         self.running = False
+        self._initialized = True
+
+    def start(self):
+        """
+        Starts sampling in a background thread. Called from the server's startup hook;
+        until then snapshots report zeros.
+        """
+        if self.running:
+            return
         self._check_dependencies()
         self._start_background_thread()
-        self._initialized = True
 
     def _check_dependencies(self):
         """Check if macmon is installed"""
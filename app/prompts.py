@@ -40,10 +40,24 @@ You have access to a powerful **Deep Search Engine**.
 SAFETY_PROTOCOL = """
 ### OPERATIONAL RULES:
 1. **NO HALLUCINATIONS:** If the Search/Memory yields nothing, admit it.
-2. **TEMPORAL AWARENESS:** Current local date/time is {current_datetime}.
+2. **TEMPORAL AWARENESS:** Use the current local date/time given in the CURRENT DATE/TIME block.
 3. **SOVEREIGNTY:** You run offline on a Mac Studio M4.
 """
 
+TEMPORAL_CONTEXT = """
+### CURRENT DATE/TIME:
+Current local date/time is {current_datetime}.
+"""
+
+# Leading text of every prompt from build_system_prompt() that never changes between requests.
+# The engine keeps its KV cache prefilled.
+SHARED_PROMPT_PREFIX = f"""
+{BASE_IDENTITY}
+
+{TOOL_INSTRUCTIONS}
+
+{SAFETY_PROTOCOL}""".lstrip()
+
 def format_search_results(browse_data: Dict[str, Any], max_chars_per_result: int = 25000) -> str:
     """
     Takes the raw output from brave_browse.py and formats it 
@@ -81,11 +95,24 @@ def format_search_results(browse_data: Dict[str, Any], max_chars_per_result: int
     return formatted_text
 
 
+def history_window(history: list[Dict[str, Any]], max_messages: int = 16) -> list[Dict[str, Any]]:
+    """
+    The recent part of `history` to show the model, at most `max_messages` long. The start
+    moves forward half a window at a time rather than one message per turn, so consecutive
+    turns render the same dialogue prefix (and reuse the session's KV cache) in between.
+    """
+    if not max_messages or len(history) <= max_messages:
+        return history
+    step = max(max_messages // 2, 1)
+    start = -(-(len(history) - max_messages) // step) * step
+    return history[start:]
+
+
 def format_chat_history(history: list[Dict[str, Any]], max_messages: int = 16) -> str:
     if not history:
         return ""
 
-    trimmed = history[-max_messages:] if max_messages else history
+    trimmed = history_window(history, max_messages)
     lines = []
     for msg in trimmed:
         role = str(msg.get("role", "unknown")).upper()
@@ -147,12 +174,14 @@ def build_system_prompt(
     chat_history: list[Dict[str, Any]] | None = None,
     related_summaries: list[Dict[str, Any]] | None = None,
     expanded_transcripts: list[str] | None = None,
+    history_messages: int = 16,
 ) -> str:
     """
     Constructs the final system prompt dynamically.
     Args:
         memories: List of strings from VectorDB
         search_context: Pre-formatted string from format_search_results()
+        history_messages: most messages of `chat_history` to include (see history_window)
     """
     current_datetime = datetime.now().strftime("%A, %B %d, %Y %H:%M:%S")
     
@@ -169,7 +198,7 @@ def build_system_prompt(
         memory_block = ""
 
     # 2. Current dialogue block
-    chat_block = format_chat_history(chat_history or [])
+    chat_block = format_chat_history(chat_history or [], history_messages)
 
     # 3. Related summaries block
     summaries_block = format_session_summaries(related_summaries or [])
@@ -184,17 +213,21 @@ def build_system_prompt(
         web_block = f"\n{search_context}\n"
 
     # Assemble
+    # Order matters for KV reuse: static blocks, then the session's dialogue (which only grows
+    # between turns), then everything that changes per request, starting with the timestamp.
     full_prompt = f"""
 {BASE_IDENTITY}
 
 {TOOL_INSTRUCTIONS}
 
-{SAFETY_PROTOCOL.format(current_datetime=current_datetime)}
-
-{memory_block}
+{SAFETY_PROTOCOL}
 
 {chat_block}
 
+{TEMPORAL_CONTEXT.format(current_datetime=current_datetime)}
+
+{memory_block}
+
 {summaries_block}
 
 {expanded_block}
@@ -1,8 +1,12 @@
 import asyncio
+import dataclasses
 import heapq
+import itertools
+import math
 import time
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional, Union
 from app.config import settings, QueueConfig
 
 import logging
@@ -11,6 +15,8 @@ from app.logging_setup import setup_logging
 setup_logging()
 logger = logging.getLogger(__name__)
 
+ANONYMOUS_CLIENT = "anonymous"
+
 @dataclass(order=True)
 class QueueItem:
     priority: int
@@ -22,23 +28,148 @@ class QueueItem:
     # use this to prevent starvation if configured
     original_priority: int = field(compare=False, default=10)
 
+    # scheduling affinity (the LoRA adapter the request needs)
+    group: Optional[str] = field(compare=False, default=None)
+
+    # kind of job ("stream" or "blocking")
+    job_class: str = field(compare=False, default="stream")
+
+    # who submitted it, for fair sharing between clients at the same priority
+    client: str = field(compare=False, default=ANONYMOUS_CLIENT)
+    # weighted fair queuing tags: virtual time the job starts / finishes being served
+    virtual_start: float = field(compare=False, default=0.0)
+    virtual_finish: float = field(compare=False, default=0.0)
+
+    # absolute time (epoch seconds) after which nobody wants the answer
+    deadline: Optional[float] = field(compare=False, default=None)
+
+    # estimated tokens (prompt + expected output), for shortest-job-first and token caps
+    cost: float = field(compare=False, default=1.0)
+
+
+class _DeadlineLane:
+    """
+    An EDF bucket: its items in deadline order (a heap), plus the same items in arrival
+    order so the oldest and newest are known for aging and stats. Indexing mirrors a
+    bucket deque: [0] is the next item to serve and [-1] the newest arrival. Items taken
+    or removed stay in the arrival order until the queue trims them from either end.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, QueueItem]] = []
+        self._seq = itertools.count()
+        self.arrivals: deque[QueueItem] = deque()
+
+    def insert(self, item: QueueItem) -> None:
+        heapq.heappush(self._heap, (item.deadline, next(self._seq), item))
+        index = len(self.arrivals)
+        while index and self.arrivals[index - 1].entry_time > item.entry_time:
+            index -= 1
+        self.arrivals.insert(index, item)
+
+    def trim(self, is_live: Callable[[QueueItem], bool]) -> None:
+        while self._heap and not is_live(self._heap[0][-1]):
+            heapq.heappop(self._heap)
+        while self.arrivals and not is_live(self.arrivals[0]):
+            self.arrivals.popleft()
+        while self.arrivals and not is_live(self.arrivals[-1]):
+            self.arrivals.pop()
+
+    def popleft(self) -> QueueItem:
+        return heapq.heappop(self._heap)[-1]
+
+    def __getitem__(self, index: int) -> QueueItem:
+        if index == 0:
+            return self._heap[0][-1]
+        return self.arrivals[index]
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __iter__(self):
+        # deadline order without popping: walk the heap from the root, smallest first
+        frontier = [(self._heap[0], 0)] if self._heap else []
+        while frontier:
+            entry, index = heapq.heappop(frontier)
+            yield entry[-1]
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self._heap):
+                    heapq.heappush(frontier, (self._heap[child], child))
+
+
 class Queue:
+    """
+    Pending jobs in priority order, with optional aging against starvation.
+
+    Jobs of equal priority are served in weighted fair order between clients (`scheduling:
+    fair`): each job gets a virtual finish time of max(queue virtual time, the client's last
+    finish) + cost / client weight, and the smallest finish time goes first. A client that
+    floods the queue only pushes its own finish times out. `scheduling: fifo` serves them
+    in arrival order instead, and `scheduling: edf` earliest deadline first (jobs without a
+    deadline last); jobs with a deadline then wait in separate buckets kept in deadline
+    order, so jobs without one stay in arrival order and keep aging. Within a deadline
+    bucket aging only sees the next job, but none waits past its own deadline.
+    `scheduling: sjf` serves the cheapest job (estimated tokens) first, except that a job
+    waiting longer than `sjf_max_wait_sec` goes ahead of every job that has not; buckets are
+    then split by cost band (powers of two), so the comparison stays between bucket heads.
+
+    Items wait in FIFO buckets keyed by (original priority, group, job class, client, cost
+    band, deadline lane). With aging, an item's effective priority drops by one per `aging_interval_sec`
+    waited, computed on demand from its entry time, so within a bucket the oldest item is
+    always the best.
+    Enqueue and remove are O(1). Picking the next item compares every bucket head, so
+    dequeue and stats cost O(number of non-empty buckets), i.e. priority levels x active
+    clients (x cost bands under sjf), whatever the depth.
+    Removed items are dropped lazily when they reach either end of their bucket.
+    """
+
     def __init__(self, config: Optional[QueueConfig] = None):
-        self._heap = []
+        self._buckets: Dict[tuple, Union[deque, _DeadlineLane]] = {}
+        self._bucket_tokens: Dict[tuple, float] = {}  # summed cost of each bucket's live items
+        self._items: Dict[str, QueueItem] = {}  # live items by request id
+        self._depth_by_group: Dict[str, int] = {}
+        self._virtual_time = 0.0
+        self._queued_tokens = 0.0
+        # WFQ state and depth exist only while a client has jobs waiting
+        self._client_finish: Dict[str, float] = {}
+        self._client_depth: Dict[str, int] = {}
+        # cumulative per-client stats, most recently active clients last
+        self._clients: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
         self._event = asyncio.Event()
         self._lock = asyncio.Lock()
         self.config = config or settings.queue
 
-    async def enqueue(self, request_id: str, payload: Any, priority: Optional[int] = None):
+    async def enqueue(
+        self,
+        request_id: str,
+        payload: Any,
+        priority: Optional[int] = None,
+        group: Optional[str] = None,
+        job_class: str = "stream",
+        client: Optional[str] = None,
+        cost: float = 1.0,
+        deadline: Optional[float] = None,
+    ):
         """
         Adds an item to the queue. 
         Lower priority number = Higher importance (0 is VIP).
+        `cost` (e.g. requested tokens) is what fair queuing charges the client for the job.
         """
+        client = client or ANONYMOUS_CLIENT
         async with self._lock:
             # Check limits
-            if len(self._heap) >= self.config.max_size:
+            if len(self._items) >= self.config.max_size:
                 logger.info(f"Queue full! Max size: {self.config.max_size}")
-                raise BufferError()
+                raise BufferError("Request queue is full.")
+            depth = self._client_depth.get(client, 0)
+            if self.config.max_per_client and depth >= self.config.max_per_client:
+                logger.info(f"Client {client} is at its queue cap ({self.config.max_per_client}).")
+                raise BufferError(f"Client {client} already has {self.config.max_per_client} requests queued.")
+            # a job bigger than the whole cap is still admitted into an empty queue
+            cap = self.config.max_queued_tokens
+            if cap and self._items and self._queued_tokens + cost > cap:
+                logger.info(f"Queue full! {int(self._queued_tokens)} of {cap} tokens queued.")
+                raise BufferError(f"Request queue is full ({int(self._queued_tokens)} tokens queued).")
 
             # Use default priority if not provided
             priority_value = priority if priority is not None else self.config.default_priority
@@ -48,12 +179,26 @@ class Queue:
                 original_priority=priority_value,
                 entry_time=time.time(),
                 request_id=request_id,
-                payload=payload
+                payload=payload,
+                group=group,
+                job_class=job_class,
+                client=client,
+                deadline=deadline,
+                cost=cost,
             )
-            
-            heapq.heappush(self._heap, item)
+            item.virtual_start = max(self._virtual_time, self._client_finish.get(client, 0.0))
+            item.virtual_finish = item.virtual_start + max(cost, 1.0) / self.weight(client)
+            self._client_finish[client] = item.virtual_finish
+            self._client_depth[client] = depth + 1
+            self._client(client)
+            self._queued_tokens += cost
+
+            self._insert(item)
+            self._items[request_id] = item
+            group_key = group or "default"
+            self._depth_by_group[group_key] = self._depth_by_group.get(group_key, 0) + 1
             self._event.set() # wake up the worker
-            logger.info(f"Enqueued {request_id} (Priority {priority_value}). Depth: {len(self._heap)}")
+            logger.info(f"Enqueued {request_id} (Priority {priority_value}). Depth: {len(self._items)}")
 
     async def dequeue(self) -> QueueItem:
         """
@@ -64,60 +209,291 @@ class Queue:
             await self._event.wait()
             
             async with self._lock:
-                if not self._heap:
-                    self._event.clear()
+                item = self._pop_locked()
+                if item is None:
                     continue
-                
-                # Starvation Check (Optional Feature)
-                if self.config.starvation_prevention:
-                    self._aging_check()
-
-                # Pop highest priority (lowest number)
-                item = heapq.heappop(self._heap)
-                
-                if not self._heap:
-                    self._event.clear()
-                    
                 return item
 
-    def _aging_check(self):
+    async def dequeue_nowait(self) -> Optional[QueueItem]:
+        """
+        Returns the highest priority item without waiting, or None if the queue is empty.
+        Used by the batching worker to admit new requests at token boundaries.
+        """
+        async with self._lock:
+            return self._pop_locked()
+
+    async def dequeue_affine(
+        self,
+        group: Optional[str],
+        max_wait_sec: float,
+    ) -> tuple[Optional[QueueItem], bool]:
+        """
+        Pops the best item belonging to `group` without waiting, so a worker can keep
+        serving the group it is set up for. Higher-priority items of other groups are only
+        passed over until they have waited `max_wait_sec`; after that (or if the group has
+        nothing queued) None is returned so the worker can drain and switch groups.
+
+        Returns (item, passed_over) where passed_over is True if the item was taken ahead
+        of a better item from another group.
+        """
+        async with self._lock:
+            if not self._items:
+                self._event.clear()
+                return None, False
+
+            now = time.time()
+            head = self._best(now)
+            if head is None:
+                return None, False
+            if head.group != group and now - head.entry_time >= max_wait_sec:
+                return None, False
+
+            if head.group == group:
+                item = head
+            else:
+                item = self._best(now, lambda i: i.group == group)
+                if item is None:
+                    return None, False
+            self._take(item)
+            return item, item is not head
+
+    async def peek(self, count: int) -> list[QueueItem]:
+        """
+        The next `count` items in priority order, left in the queue.
+        """
+        async with self._lock:
+            now = time.time()
+            live = [(i for i in bucket if self._is_live(i)) for bucket in self._buckets.values()]
+            merged = heapq.merge(*live, key=lambda item: self._order(item, now))
+            items = list(itertools.islice(merged, count))
+            for item in items:
+                item.priority = self._effective(item, now)
+            return items
+
+    async def remove(self, request_id: str) -> Optional[QueueItem]:
+        """
+        Removes a waiting item (e.g. a cancelled request) before it is dispatched.
+        Returns the item, or None if it is not queued (already dispatched or unknown).
+        """
+        async with self._lock:
+            item = self._items.get(request_id)
+            if item is None:
+                return None
+            self._forget(item)
+            logger.info(f"Removed {request_id} from queue. Depth: {len(self._items)}")
+            return item
+
+    async def reprioritise(self, request_id: str, priority: int, deadline: Optional[float] = None) -> bool:
+        """
+        Moves a waiting item up to `priority` and/or `deadline` where those are more urgent
+        than its own (e.g. a UI caller joined a shared background job). It keeps its entry
+        time, so its aging and place among equals are unchanged. Returns False if the item
+        is not queued.
+        """
+        async with self._lock:
+            item = self._items.get(request_id)
+            if item is None:
+                return False
+            changes: Dict[str, Any] = {}
+            if priority < item.original_priority:
+                changes.update(priority=priority, original_priority=priority)
+            if deadline is not None and (item.deadline is None or deadline < item.deadline):
+                changes["deadline"] = deadline
+            if not changes:
+                return True
+            # the old copy goes stale in its bucket and is dropped lazily
+            moved = dataclasses.replace(item, **changes)
+            self._items[request_id] = moved
+            self._bucket_tokens[self._key(item)] -= item.cost
+            self._insert(moved)
+            logger.info(f"Moved {request_id} up to priority {moved.original_priority}, deadline {moved.deadline}.")
+            return True
+
+    def _is_live(self, item: QueueItem) -> bool:
+        return self._items.get(item.request_id) is item
+
+    def _effective(self, item: QueueItem, now: float) -> int:
+        """
+        Priority after aging: one level better per `aging_interval_sec` waited, floored at 0.
+        """
+        if not self.config.starvation_prevention:
+            return item.original_priority
+        boost = int((now - item.entry_time) / self.config.aging_interval_sec)
+        return max(0, item.original_priority - boost) if boost else item.original_priority
+
+    def _order(self, item: QueueItem, now: float) -> tuple[int, float]:
+        if self.config.scheduling == "edf":
+            tiebreak = item.deadline if item.deadline is not None else math.inf
+        elif self.config.scheduling == "sjf":
+            waited = now - item.entry_time
+            # past the bound the longest waiter goes first (negative sorts before any cost)
+            tiebreak = item.cost if waited < self.config.sjf_max_wait_sec else -waited
+        elif self.config.scheduling == "fair":
+            tiebreak = item.virtual_finish
+        else:
+            tiebreak = item.entry_time
+        return self._effective(item, now), tiebreak
+
+    def _insert(self, item: QueueItem) -> None:
+        key = self._key(item)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _DeadlineLane() if key[-1] else deque()
+        self._bucket_tokens[key] = self._bucket_tokens.get(key, 0.0) + item.cost
+        if isinstance(bucket, _DeadlineLane):
+            bucket.insert(item)
+            return
+        # arrival order; only a promoted item (see reprioritise) lands short of the tail
+        index = len(bucket)
+        while index and bucket[index - 1].entry_time > item.entry_time:
+            index -= 1
+        bucket.insert(index, item)
+
+    def backlog(self, priority: int) -> float:
         """
-        iterate through heap and boost priority of old items.
-        expensive operation O(N) only run if necessary.
+        About how many estimated tokens (summed job costs) would be served before a new job
+        at `priority`, for admission control. Counts whole buckets by their live head.
         """
         now = time.time()
-        modified = False
-        
-        for item in self._heap:
-            wait_time = now - item.entry_time
-            if wait_time > self.config.aging_interval_sec:
-                # boost priority by 1 for every interval waited
-                boost = int(wait_time / self.config.aging_interval_sec)
-                new_prio = max(0, item.original_priority - boost)
-                
-                if new_prio != item.priority:
-                    item.priority = new_prio
-                    modified = True
-        
-        if modified:
-            heapq.heapify(self._heap)
+        total = 0.0
+        for key in list(self._buckets):
+            head = self._head(key)
+            if head is not None and self._effective(head, now) <= priority:
+                total += self._bucket_tokens[key]
+        return total
+
+    def _key(self, item: QueueItem) -> tuple:
+        band = int(math.log2(max(item.cost, 1.0))) if self.config.scheduling == "sjf" else 0
+        deadline_lane = self.config.scheduling == "edf" and item.deadline is not None
+        return item.original_priority, item.group, item.job_class, item.client, band, deadline_lane
+
+    def weight(self, client: str) -> float:
+        return self.config.client_weights.get(client, self.config.default_client_weight)
+
+    def _client(self, client: str) -> Dict[str, float]:
+        """
+        The client's stats entry, marked as recently used. Client ids are open-ended
+        (addresses, headers), so only the `max_tracked_clients` most recent are kept.
+        """
+        stats = self._clients.setdefault(client, {"dequeued": 0, "total_wait": 0.0, "served_tokens": 0})
+        self._clients.move_to_end(client)
+        while len(self._clients) > self.config.max_tracked_clients:
+            self._clients.popitem(last=False)
+        return stats
+
+    def record_served(self, client: Optional[str], tokens: int) -> None:
+        """
+        Counts tokens generated for a client's job once it finishes (for stats).
+        """
+        self._client(client or ANONYMOUS_CLIENT)["served_tokens"] += tokens
+
+    def _head(self, key: tuple) -> Optional[QueueItem]:
+        bucket = self._buckets[key]
+        if isinstance(bucket, _DeadlineLane):
+            bucket.trim(self._is_live)
+        while bucket and not self._is_live(bucket[0]):
+            bucket.popleft()
+        while bucket and not self._is_live(bucket[-1]):
+            bucket.pop()
+        if not bucket:
+            del self._buckets[key]
+            del self._bucket_tokens[key]
+            return None
+        return bucket[0]
+
+    def _best(self, now: float, keep: Optional[Callable[[QueueItem], bool]] = None) -> Optional[QueueItem]:
+        """
+        The best live item (optionally among those `keep` accepts), comparing bucket heads only.
+        """
+        best, best_order = None, None
+        for key in list(self._buckets):
+            head = self._head(key)
+            if head is None or (keep is not None and not keep(head)):
+                continue
+            order = self._order(head, now)
+            if best_order is None or order < best_order:
+                best, best_order = head, order
+        if best is not None:
+            best.priority = best_order[0]
+        return best
+
+    def _take(self, item: QueueItem) -> None:
+        # `item` is its bucket's head
+        self._buckets[self._key(item)].popleft()
+        stats = self._client(item.client)
+        stats["dequeued"] += 1
+        stats["total_wait"] += time.time() - item.entry_time
+        self._forget(item)
+        # virtual time follows the job in service, so idle clients do not bank credit
+        self._virtual_time = max(self._virtual_time, item.virtual_start)
+
+    def _forget(self, item: QueueItem) -> None:
+        del self._items[item.request_id]
+        depth = self._client_depth.pop(item.client) - 1
+        if depth:
+            self._client_depth[item.client] = depth
+        else:
+            # an idle client restarts at the current virtual time
+            self._client_finish.pop(item.client, None)
+        self._queued_tokens -= item.cost
+        self._bucket_tokens[self._key(item)] -= item.cost
+        group_key = item.group or "default"
+        self._depth_by_group[group_key] -= 1
+        if not self._depth_by_group[group_key]:
+            del self._depth_by_group[group_key]
+        if not self._items:
+            self._event.clear()
+
+    def _pop_locked(self) -> Optional[QueueItem]:
+        if not self._items:
+            self._event.clear()
+            return None
+
+        # Pop highest priority (lowest effective number)
+        item = self._best(time.time())
+        self._take(item)
+        return item
 
     async def stats(self) -> Dict[str, Any]:
         """
-        Snapshot of current queue health for monitoring purposes.
+        Snapshot of current queue health for monitoring purposes. Looks at bucket ends only:
+        the oldest and newest item of each bucket bound its priorities and wait times.
         """
         async with self._lock:
             now = time.time()
-            oldest_wait = max((now - item.entry_time) for item in self._heap) if self._heap else 0.0
-            priorities = [item.priority for item in self._heap]
+            firsts, lasts = [], []
+            for key in list(self._buckets):
+                if self._head(key) is None:
+                    continue
+                bucket = self._buckets[key]
+                # a deadline lane serves by deadline, so its oldest item is not its head
+                arrivals = bucket.arrivals if isinstance(bucket, _DeadlineLane) else bucket
+                firsts.append(arrivals[0])
+                lasts.append(arrivals[-1])
+            oldest: Dict[str, float] = {}
+            for first in firsts:
+                oldest[first.client] = max(oldest.get(first.client, 0.0), now - first.entry_time)
             return {
-                "depth": len(self._heap),
-                "min_priority": min(priorities, default=None),
-                "max_priority": max(priorities, default=None),
-                "oldest_wait": oldest_wait,
+                "depth": len(self._items),
+                "queued_tokens": int(self._queued_tokens),
+                "min_priority": min((self._effective(i, now) for i in firsts), default=None),
+                "max_priority": max((self._effective(i, now) for i in lasts), default=None),
+                "oldest_wait": max((now - item.entry_time for item in firsts), default=0.0),
+                "depth_by_group": dict(self._depth_by_group),
+                "scheduling": self.config.scheduling,
+                "clients": {
+                    client: {
+                        "depth": self._client_depth.get(client, 0),
+                        "weight": self.weight(client),
+                        "oldest_wait": oldest.get(client, 0.0),
+                        "avg_wait": stats["total_wait"] / stats["dequeued"] if stats["dequeued"] else 0.0,
+                        "served_tokens": int(stats["served_tokens"]),
+                    }
+                    for client, stats in self._clients.items()
+                },
             }
 
     def __len__(self) -> int:
-        return len(self._heap)
+        return len(self._items)
 
 request_queue = Queue()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from app.logging_setup import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedResponse:
+    chunks: list[str]  # streamed segments, replayed as-is so clients see the same protocol
+    tokens_out: int
+    gpu_seconds: float  # what generating it cost, i.e. what each hit saves
+    created: float
+
+
+def make_key(**parts: Any) -> str:
+    """
+    Stable hash over the parts that determine a deterministic answer.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match cache of finished answers: an in-memory LRU tier backed by an optional
+    SQLite tier. Entries older than `ttl_sec` are treated as misses in both tiers.
+
+    `get` and `put` may block on SQLite, so the engine calls them off the event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl_sec: float, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.gpu_seconds_saved = 0.0
+        if db_path:
+            self._execute(
+                "create table if not exists response_cache ("
+                "key text primary key, chunks text, tokens_out integer, gpu_seconds real, created real)"
+            )
+
+    def _execute(self, sql: str, params: tuple = ()):
+        # one short-lived connection per call: callers run on arbitrary worker threads
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def _expired(self, created: float) -> bool:
+        return time.time() - created > self.ttl_sec
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry.created):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None and self.db_path:
+            entry = self._disk_get(key)
+            if entry is not None:
+                self.disk_hits += 1
+                self._remember(key, entry)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.gpu_seconds_saved += entry.gpu_seconds
+            return entry
+
+    def put(self, key: str, entry: CachedResponse) -> None:
+        self._remember(key, entry)
+        if self.db_path:
+            self._execute(
+                "insert or replace into response_cache values (?, ?, ?, ?, ?)",
+                (key, json.dumps(entry.chunks), entry.tokens_out, entry.gpu_seconds, entry.created),
+            )
+
+    def _remember(self, key: str, entry: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[CachedResponse]:
+        row = self._execute(
+            "select chunks, tokens_out, gpu_seconds, created from response_cache where key = ?", (key,)
+        )
+        if row is None:
+            return None
+        if self._expired(row[3]):
+            self._execute("delete from response_cache where key = ?", (key,))
+            return None
+        return CachedResponse(chunks=json.loads(row[0]), tokens_out=row[1], gpu_seconds=row[2], created=row[3])
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "disk": self.db_path,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "gpu_seconds_saved": round(self.gpu_seconds_saved, 3),
+        }
@@ -10,9 +10,35 @@ class GenerateRequest(BaseModel):
     session_id: Optional[str] = None
     include_history: Optional[bool] = True
     history_window: Optional[int] = 16
+    # None = use the engine default; only applies when a draft model is configured
+    speculative: Optional[bool] = None
+    # LoRA adapter for this request ("base", "default" or a folder under adapters/);
+    # None uses the adapter selected through /adapters/load
+    adapter: Optional[str] = None
+    # give up (queued or mid-generation) after this many seconds
+    timeout_sec: Optional[float] = None
+    # absolute deadline (epoch seconds); the earlier of this and timeout_sec applies. A request
+    # that cannot finish in time given the current backlog is rejected up front
+    deadline: Optional[float] = None
+    # end generation as soon as one of these strings is produced (not included in the output)
+    stop: Optional[List[str]] = None
+    # end generation after a completed [SEARCH: ...] / [EXPAND: ...] tag (kept in the output)
+    stop_on_tool_tag: bool = False
+    # sampling temperature
+    temp: float = 0.7
+    # reuse a cached answer for an identical request; None uses the engine default.
+    # Only applies at low temperatures (see response_cache_max_temp)
+    cache: Optional[bool] = None
+    # number of sampled continuations; the prompt is prefilled once and shared by all of them
+    n: int = Field(default=1, ge=1)
+    # who is asking (an app, agent or API key); equal-priority jobs are shared fairly
+    # between clients. Defaults to the X-Client-Id header or the caller's address
+    client_id: Optional[str] = None
 
 class GenerateResponse(BaseModel):
     text: str
+    # every sampled continuation when n > 1 (`text` is the first)
+    choices: Optional[List[str]] = None
     token_count: int
     processing_time: float
 
@@ -0,0 +1,149 @@
+import hashlib
+import math
+import operator
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Sequence
+
+from app.response_cache import CachedResponse
+
+
+def fingerprint(text: Optional[str]) -> str:
+    """
+    Short stable id for a system prompt, used to scope semantic matches.
+    """
+    return hashlib.sha256((text or "").encode()).hexdigest()[:16]
+
+
+def _normalise(vector: Sequence[float]) -> tuple[float, ...]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return tuple(x / norm for x in vector)
+
+
+@dataclass
+class _SemanticEntry:
+    scope: tuple[str, ...]
+    prompt: str
+    vector: tuple[float, ...]  # unit length, so a dot product is the cosine similarity
+    response: CachedResponse
+    max_tokens: Optional[int] = None  # the budget the answer was generated under
+    finish_reason: Optional[str] = None  # "length" if it was cut at that budget
+
+
+def _fits(entry: _SemanticEntry, max_tokens: Optional[int]) -> bool:
+    """
+    True if `entry` is the answer a caller allowing `max_tokens` would get: a complete
+    answer within that budget, or one cut at exactly that budget.
+    """
+    if max_tokens is None:
+        return True
+    if entry.finish_reason == "length":
+        return entry.max_tokens == max_tokens
+    return entry.response.tokens_out <= max_tokens
+
+
+class SemanticCache:
+    """
+    Near-duplicate answer cache: a prompt whose embedding is at least `threshold` cosine
+    similar to an earlier prompt in the same scope (adapter, system-prompt fingerprint,
+    stop settings) gets that prompt's answer.
+
+    `embed` is called on the caller's thread and may be slow (a sentence-transformer),
+    so the engine calls `embed_prompt` and `lookup` off the event loop.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], Sequence[float]],
+        threshold: float,
+        max_entries: int,
+        ttl_sec: float,
+    ):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries: "OrderedDict[tuple[tuple[str, ...], str], _SemanticEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self.lookup_seconds = 0.0
+
+    def embed_prompt(self, prompt: str) -> tuple[float, ...]:
+        return _normalise(self.embed(prompt))
+
+    def lookup(
+        self,
+        scope: tuple[str, ...],
+        vector: tuple[float, ...],
+        max_tokens: Optional[int] = None,
+        lookup_seconds: float = 0.0,
+    ) -> Optional[tuple[CachedResponse, float, str]]:
+        """
+        Returns (response, similarity, matched prompt) for the closest earlier prompt in
+        `scope` at or above the threshold, or None. Answers longer than `max_tokens`, and
+        answers cut short by a different `max_tokens`, are skipped. `lookup_seconds`
+        (embedding time) is charged against the latency a hit saves.
+        """
+        start = time.perf_counter()
+        best, best_similarity = None, self.threshold
+        now = time.time()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if now - entry.response.created > self.ttl_sec:
+                    del self._entries[key]
+                    continue
+                if entry.scope != scope or not _fits(entry, max_tokens):
+                    continue
+                similarity = sum(map(operator.mul, vector, entry.vector))
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+
+            lookup_seconds += time.perf_counter() - start
+            self.lookup_seconds += lookup_seconds
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((best.scope, best.prompt))
+            self.hits += 1
+            self.latency_saved += max(best.response.gpu_seconds - lookup_seconds, 0.0)
+            return best.response, best_similarity, best.prompt
+
+    def put(
+        self,
+        scope: tuple[str, ...],
+        prompt: str,
+        vector: tuple[float, ...],
+        response: CachedResponse,
+        max_tokens: Optional[int] = None,
+        finish_reason: Optional[str] = None,
+    ) -> None:
+        with self._lock:
+            key = (scope, prompt)
+            self._entries[key] = _SemanticEntry(
+                scope=scope,
+                prompt=prompt,
+                vector=vector,
+                response=response,
+                max_tokens=max_tokens,
+                finish_reason=finish_reason,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_sec": round(self.latency_saved, 3),
+            "avg_lookup_ms": round(self.lookup_seconds / lookups * 1000, 2) if lookups else 0.0,
+        }
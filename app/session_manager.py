@@ -112,6 +112,9 @@ async def summarise_session(
     engine,
     max_messages: int | None = None,
 ) -> None:
+    # The session is over; its retained KV state is no longer useful.
+    engine.release_session(str(session_id))
+
     session = await asyncio.to_thread(get_session, session_id)
     if not session:
         return
@@ -158,6 +161,8 @@ async def summarise_session(
 
 
 async def sweep_stale_sessions(engine, idle_seconds: int = 600) -> None:
+    engine.evict_idle_sessions(idle_seconds)
+
     cutoff = datetime.utcnow() - timedelta(seconds=idle_seconds)
     stale = await asyncio.to_thread(list_active_sessions_older_than, cutoff)
     if stale:
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from app.logging_setup import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """
+    Initialises the heavy subsystems (model weights, vector memory, hardware monitor)
+    concurrently in the background and tracks their state for the /ready endpoint.
+    """
+
+    def __init__(self):
+        self.components: dict[str, dict[str, Any]] = {}
+        self.total_seconds: float | None = None
+
+    async def run(self, components: dict[str, Callable[[], Awaitable[Any]]]) -> None:
+        """
+        Runs every component's initialiser at once and waits for all of them.
+        A failing component is recorded and logged; the others carry on.
+        """
+        for name in components:
+            self.components[name] = {"status": "pending", "seconds": None, "error": None}
+
+        start = time.perf_counter()
+        await asyncio.gather(*(self._initialise(name, init) for name, init in components.items()))
+        self.total_seconds = round(time.perf_counter() - start, 3)
+        logger.info(
+            "Startup finished in %.2fs (%s).",
+            self.total_seconds,
+            ", ".join(f"{name}={state['seconds']:.2f}s" for name, state in self.components.items()),
+        )
+
+    async def _initialise(self, name: str, init: Callable[[], Awaitable[Any]]) -> None:
+        state = self.components[name]
+        state["status"] = "loading"
+        start = time.perf_counter()
+        try:
+            await init()
+        except Exception as e:
+            state["status"] = "failed"
+            state["error"] = str(e)
+            logger.exception("%s failed to initialise.", name)
+        else:
+            state["status"] = "ready"
+        finally:
+            state["seconds"] = round(time.perf_counter() - start, 3)
+        logger.info("%s %s in %.2fs.", name, state["status"], state["seconds"])
+
+    def is_ready(self) -> bool:
+        return bool(self.components) and all(c["status"] == "ready" for c in self.components.values())
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "ready": self.is_ready(),
+            "total_seconds": self.total_seconds,
+            "components": {name: dict(state) for name, state in self.components.items()},
+        }
+
+
+startup = Startup()
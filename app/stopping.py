@@ -0,0 +1,111 @@
+import re
+from typing import Optional
+
+# A completed tool tag, e.g. [SEARCH: nba finals score] or [EXPAND: 42]
+TOOL_TAG_PATTERN = re.compile(r"\[(?:SEARCH|EXPAND):\s*[^\]\n]+\]", re.IGNORECASE)
+# An open "[" further back than this cannot be a tool tag any more
+MAX_TOOL_TAG_CHARS = 512
+TOOL_TAG_NAMES = ("SEARCH:", "EXPAND:")
+
+
+def _could_be_tool_tag(text: str) -> bool:
+    """
+    True if `text` (starting at "[") may still grow into a complete tool tag.
+    """
+    body = text[1:].upper()
+    for name in TOOL_TAG_NAMES:
+        if name.startswith(body):
+            return True
+        if body.startswith(name) and "]" not in body and "\n" not in body:
+            return True
+    return False
+
+
+class StopMatcher:
+    """
+    Incremental stop detection over streamed text.
+
+    Stop strings are matched across token boundaries and cut from the output; text that
+    could still be the start of a stop string is held back until it is ruled out.
+    With `tool_tags`, a completed [SEARCH: ...] / [EXPAND: ...] tag also ends generation
+    and is reported in `tool_tag`. The tag is kept in the output so the caller can parse
+    it, unless `hide_tool_tags` is set, in which case possible tags are held back and the
+    completed tag is cut like a stop string.
+    """
+
+    def __init__(
+        self,
+        stop: Optional[list[str]] = None,
+        tool_tags: bool = False,
+        hide_tool_tags: bool = False,
+    ):
+        self.stop = [s for s in (stop or []) if s]
+        self.tool_tags = tool_tags
+        self.hide_tool_tags = hide_tool_tags
+        self.stopped = False
+        self.reason: Optional[str] = None
+        self.tool_tag: Optional[str] = None
+        self._pending = ""  # held back: might be the start of a stop string (or hidden tag)
+        self._tag = ""  # text since the last unclosed "[" (tool tags only)
+
+    def feed(self, segment: str) -> str:
+        """
+        Consumes newly generated text and returns the part that is safe to emit.
+        Sets `stopped` once a stop string or tool tag completes.
+        """
+        if self.stopped or not segment:
+            return ""
+
+        text = self._pending + segment
+        cut = None  # output ends at text[:cut]
+        done_at = None  # position in `text` where the match completed
+
+        if self.tool_tags:
+            scan = self._tag + segment
+            match = TOOL_TAG_PATTERN.search(scan)
+            if match:
+                done_at = match.end() - len(scan) + len(text)
+                cut = max(match.start() - len(scan) + len(text), 0) if self.hide_tool_tags else done_at
+                self.reason = self.tool_tag = match.group(0)
+            else:
+                opened = scan.rfind("[")
+                self._tag = scan[opened:] if opened >= 0 and len(scan) - opened <= MAX_TOOL_TAG_CHARS else ""
+
+        for stop in self.stop:
+            index = text.find(stop)
+            if index >= 0 and (done_at is None or index + len(stop) < done_at):
+                cut, done_at = index, index + len(stop)
+                if self.hide_tool_tags:
+                    # a stop inside a hidden tag must not leak the tag's opening
+                    opened = text.rfind("[", 0, index)
+                    if opened >= 0 and _could_be_tool_tag(text[opened:index]):
+                        cut = opened
+                self.reason = stop
+                self.tool_tag = None
+
+        if cut is not None:
+            self.stopped = True
+            self._pending = ""
+            return text[:cut]
+
+        hold = self._held_back(text)
+        if self.hide_tool_tags and self._tag and _could_be_tool_tag(self._tag):
+            hold = max(hold, min(len(self._tag), len(text)))
+        self._pending = text[len(text) - hold :] if hold else ""
+        return text[: len(text) - hold]
+
+    def flush(self) -> str:
+        """
+        Releases held-back text once generation ends without a stop match.
+        """
+        pending, self._pending = self._pending, ""
+        return "" if self.stopped else pending
+
+    def _held_back(self, text: str) -> int:
+        longest = 0
+        for stop in self.stop:
+            for size in range(min(len(stop) - 1, len(text)), longest, -1):
+                if stop.startswith(text[-size:]):
+                    longest = size
+                    break
+        return longest
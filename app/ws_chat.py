@@ -1,13 +1,16 @@
 import asyncio
+import contextlib
+import functools
 import json
 import logging
 import re
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from starlette.requests import HTTPConnection
 
-from app.engine import engine
+from app.engine import Overloaded, engine
 from app.logging_setup import setup_logging
-from app.prompts import build_system_prompt, format_search_results
+from app.prompts import build_system_prompt, format_expanded_transcripts, format_search_results
 from app.schemas import GenerateRequest
 from core import memory
 from core.search.brave_browse import search_and_browse
@@ -29,6 +32,17 @@ SEARCH_PATTERN = re.compile(r"\[SEARCH:\s*(.+?)\]", re.IGNORECASE)
 EXPAND_PATTERN = re.compile(r"\[EXPAND:\s*(.+?)\]", re.IGNORECASE)
 
 
+def client_identity(connection: HTTPConnection) -> str | None:
+    """
+    Who a connection belongs to for fair queuing: the `client_id` query parameter or
+    X-Client-Id header if given, else the peer's address.
+    """
+    explicit = connection.query_params.get("client_id") or connection.headers.get("x-client-id")
+    if explicit:
+        return explicit
+    return connection.client.host if connection.client else None
+
+
 def _extract_search_query(text: str) -> str | None:
     if not text:
         return None
@@ -49,6 +63,46 @@ def _extract_expand_id(text: str) -> str | None:
     return session_id or None
 
 
+SEARCH_ENFORCER = (
+    "\n\n### CRITICAL INSTRUCTION:\n"
+    "If the user asks about a specific Event, Game, Score, News, or recent Fact, "
+    "you MUST output [SEARCH: <query>].\n"
+    "Do NOT answer from your internal knowledge for specific events."
+)
+
+TOOL_RESULT_INSTRUCTION = (
+    "\n\nUse the results above to answer my previous message. "
+    "Do not mention the tool call itself."
+)
+
+
+async def _run_tool(websocket: WebSocket, tag: str) -> str:
+    """
+    Runs the tool named by a [SEARCH: ...] / [EXPAND: ...] tag during a single-pass turn
+    and returns the context block that is fed back to the model.
+    """
+    expand_id = _extract_expand_id(tag)
+    if expand_id:
+        logger.info("Expand requested: %s", expand_id)
+        await websocket.send_json({"type": "status", "content": "Expanding past session..."})
+        expanded_text = await expand_session_transcript(expand_id)
+        if not expanded_text or expanded_text.startswith("[Error:") or expanded_text.startswith("[System Error:"):
+            logger.warning("Expand failed: %s", expanded_text)
+            return f"### SESSION EXPANSION FAILED:\n{expanded_text}{TOOL_RESULT_INSTRUCTION}"
+        return format_expanded_transcripts([expanded_text]) + TOOL_RESULT_INSTRUCTION
+
+    search_query = _extract_search_query(tag)
+    logger.info("Search requested: %s", search_query)
+    await websocket.send_json({"type": "status", "content": "Searching the web..."})
+
+    browse_data = await search_and_browse(search_query)
+    if isinstance(browse_data, dict):
+        logger.info("Search returned %s results.", len(browse_data.get("results", [])))
+    else:
+        logger.warning("Search failed: %s", browse_data)
+    return format_search_results(browse_data) + TOOL_RESULT_INSTRUCTION
+
+
 def _append_user_system_prompt(base_prompt: str, user_prompt: str | None) -> str:
     if not user_prompt:
         return base_prompt
@@ -92,6 +146,7 @@ async def _recall_session_summaries(prompt: str) -> list[dict]:
 @router.websocket("/ws/chat/v2")
 async def websocket_chat(websocket: WebSocket):
     await websocket.accept()
+    client_id = client_identity(websocket)
     try:
         while True:
             # receive JSON from Client (UI or LangChain)
@@ -120,8 +175,16 @@ async def websocket_chat(websocket: WebSocket):
                     await websocket.send_json({"type": "status", "content": "session_closed"})
                     continue
 
+                if not engine.ready:
+                    await websocket.send_json(
+                        {"type": "error", "detail": "Model is still loading. Please retry shortly."}
+                    )
+                    continue
+
                 # convert dict to Pydantic model
                 request = GenerateRequest(**request_data)
+                if request.client_id is None:
+                    request.client_id = client_id
 
                 await websocket.send_json({"type": "status", "content": "Thinking..."})
 
@@ -133,88 +196,47 @@ async def websocket_chat(websocket: WebSocket):
                 memories = await _recall_memories(request.prompt)
                 summaries = await _recall_session_summaries(request.prompt)
 
-                history_window = request.history_window or 16
-                history_for_prompt = history[-history_window:] if request.include_history else []
-
                 base_system = build_system_prompt(
                     memories=memories,
-                    chat_history=history_for_prompt,
+                    chat_history=history,
                     related_summaries=summaries,
+                    history_messages=request.history_window or 16,
                 )
                 base_system = _append_user_system_prompt(base_system, request.system_prompt)
 
-                probe_request = GenerateRequest(**request_data)
-                search_enforcer = (
-                    "\n\n### CRITICAL INSTRUCTION:\n"
-                    "If the user asks about a specific Event, Game, Score, News, or recent Fact, "
-                    "you MUST output [SEARCH: <query>].\n"
-                    "Do NOT answer from your internal knowledge for specific events."
-                )
-                probe_request.system_prompt = base_system + search_enforcer
-                probe_request.max_tokens = min(request.max_tokens, 256)
-
-                logger.info("Running search-intent probe.")
-                probe_result = await engine.generate_text(probe_request)
-                probe_text = probe_result.get("text", "")
-                search_query = _extract_search_query(probe_text)
-                expand_id = _extract_expand_id(probe_text)
+                request.system_prompt = base_system + SEARCH_ENFORCER
 
                 if session_id:
                     await append_session_message(session_id, "user", request.prompt)
 
-                if not search_query and not expand_id:
-                    logger.info("No search/expand requested; responding directly.")
-                    await websocket.send_json({"type": "token", "content": probe_text})
-                    await websocket.send_json({"type": "end", "content": ""})
-                    if session_id:
-                        await append_session_message(session_id, "assistant", probe_text)
-                    continue
-
-                expanded_transcripts = []
-                if expand_id:
-                    logger.info("Expand requested: %s", expand_id)
-                    await websocket.send_json({"type": "status", "content": "Expanding past session..."})
-                    expanded_text = await expand_session_transcript(expand_id)
-                    if expanded_text and not (
-                        expanded_text.startswith("[Error:")
-                        or expanded_text.startswith("[System Error:")
-                    ):
-                        expanded_transcripts.append(expanded_text)
-                    else:
-                        logger.warning("Expand failed: %s", expanded_text)
-
-                search_context = None
-                if search_query:
-                    logger.info("Search requested: %s", search_query)
-                    await websocket.send_json({"type": "status", "content": "Searching the web..."})
-
-                    browse_data = await search_and_browse(search_query)
-                    if isinstance(browse_data, dict):
-                        logger.info("Search returned %s results.", len(browse_data.get("results", [])))
-                    else:
-                        logger.warning("Search failed: %s", browse_data)
-                    search_context = format_search_results(browse_data)
-
-                final_system = build_system_prompt(
-                    memories=memories,
-                    chat_history=history_for_prompt,
-                    related_summaries=summaries,
-                    expanded_transcripts=expanded_transcripts,
-                    search_context=search_context,
-                )
-                final_system = _append_user_system_prompt(final_system, request.system_prompt)
-                request.system_prompt = final_system
-
-                # stream tokens back
-                response_text = ""
-                async for token in engine.generate_stream(request):
-                    response_text += token or ""
-                    await websocket.send_json({"type": "token", "content": token})
+                # stream tokens back in a single pass: a tool tag pauses the generation, the
+                # tool result is appended to its live KV state and decoding resumes
+                chunks: list[str] = []
+                # parallel samples are streamed side by side without tool calls
+                run_tool = functools.partial(_run_tool, websocket) if request.n == 1 else None
+                # aclosing: a disconnect mid-stream cancels the generation right away
+                async with contextlib.aclosing(engine.generate_stream(request, tool_runner=run_tool)) as stream:
+                    async for token in stream:
+                        if isinstance(token, tuple):
+                            index, token = token
+                            if index == 0 and token:
+                                chunks.append(token)  # the first choice goes into the history
+                            await websocket.send_json({"type": "token", "index": index, "content": token})
+                            continue
+                        if token:
+                            chunks.append(token)
+                        await websocket.send_json({"type": "token", "content": token})
 
                 # end of message signal
                 await websocket.send_json({"type": "end", "content": ""})
                 if session_id:
-                    await append_session_message(session_id, "assistant", response_text)
+                    await append_session_message(session_id, "assistant", "".join(chunks))
+            except Overloaded as e:
+                # shed at admission: nothing was generated, the client may retry later
+                await websocket.send_json({"type": "error", "status": 429, "detail": str(e)})
+            except FileNotFoundError as e:
+                # unknown per-request adapter
+                await websocket.send_json({"type": "error", "status": 404, "detail": str(e)})
             except Exception as e:
                 await websocket.send_json({"type": "error", "detail": str(e)})
             
@@ -1,11 +1,9 @@
 import logging
+import threading
 import time
 import uuid
 from pathlib import Path
 
-import chromadb
-from sentence_transformers import SentenceTransformer
-
 from app.logging_setup import setup_logging
 
 class Memory:
@@ -23,14 +21,51 @@ class Memory:
         
         setup_logging()
         self.logger = logging.getLogger(__name__)
-        self.logger.info("Initializing Memory Cortex...")
-        db_path = Path(__file__).resolve().parents[1] / "data" / "vector_db"
-        db_path.mkdir(parents=True, exist_ok=True)
-        self.client = chromadb.PersistentClient(path=str(db_path))
-        self.collection = self.client.get_or_create_collection(name="hala_ai_knowledge")
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
+        self._load_lock = threading.Lock()
+        self._client = None
+        self._collection = None
+        self._embedder = None
         self._initialized = True
-        self.logger.info("Memory Online")
+
+    def initialise(self):
+        """
+        Opens Chroma and loads the embedding model. Run by the server's startup hook;
+        anything that needs them before then triggers it on first use.
+        """
+        with self._load_lock:
+            if self._embedder is not None:
+                return
+
+            # imported here: chromadb and sentence_transformers (torch) are slow to import
+            import chromadb
+            from sentence_transformers import SentenceTransformer
+
+            self.logger.info("Initializing Memory Cortex...")
+            db_path = Path(__file__).resolve().parents[1] / "data" / "vector_db"
+            db_path.mkdir(parents=True, exist_ok=True)
+            self._client = chromadb.PersistentClient(path=str(db_path))
+            self._collection = self._client.get_or_create_collection(name="hala_ai_knowledge")
+            self._embedder = SentenceTransformer('all-MiniLM-L6-v2')
+            self.logger.info("Memory Online")
+
+    @property
+    def ready(self) -> bool:
+        return self._embedder is not None
+
+    @property
+    def client(self):
+        self.initialise()
+        return self._client
+
+    @property
+    def collection(self):
+        self.initialise()
+        return self._collection
+
+    @property
+    def embedder(self):
+        self.initialise()
+        return self._embedder
 
     def memorize(self, text: str, source: str = "user_chat", metadata: dict = None, doc_id: str | None = None) -> str:
         """
@@ -26,6 +26,14 @@ class SovereignHubLLM(LLM):
     adapter: str = "default"
     max_tokens: int = 1024
     priority: int = _env_priority()
+    # None keeps the server default; 0 makes agent steps deterministic, so identical
+    # retries share the generation already running on the server
+    temperature: Optional[float] = None
+    # identifies this agent to the server's fair queuing (see client_weights/max_per_client)
+    client_id: Optional[str] = os.getenv("HALA_CLIENT_ID")
+    # how long to wait for an answer; sent along so the server can drop (or refuse up front)
+    # work that would arrive after we gave up
+    timeout_sec: float = 30
     system_prompt: Optional[str] = (
         "You are a helpful assistant. "
         "When using tools, NEVER produce a final answer in the same message as an action. "
@@ -50,14 +58,19 @@ class SovereignHubLLM(LLM):
             "max_tokens": self.max_tokens,
             "system_prompt": self.system_prompt,
             "priority": self.priority,
+            "timeout_sec": self.timeout_sec,
         }
+        if self.temperature is not None:
+            payload["temp"] = self.temperature
+        if self.client_id:
+            payload["client_id"] = self.client_id
 
         base_url = self.api_url.rstrip("/")
 
         # 2. Hit your Local API (Blocking HTTP for simplicity in Agents)
         # Note: Agents often prefer blocking over streaming for logic steps
         try:
-            response = requests.post(f"{base_url}/chat", json=payload, timeout=30)
+            response = requests.post(f"{base_url}/chat", json=payload, timeout=self.timeout_sec)
             response.raise_for_status()
             result = response.json()
             return result.get("text", "")
@@ -71,4 +84,6 @@ class SovereignHubLLM(LLM):
             "api_url": self.api_url,
             "max_tokens": self.max_tokens,
             "priority": self.priority,
+            "temperature": self.temperature,
+            "client_id": self.client_id,
         }
@@ -0,0 +1,94 @@
+"""
+Queue policy simulation under a mixed workload (no model needed).
+
+Replays one Poisson arrival stream of short chats, medium requests and long deep-search
+prompts through the real `Queue` with each scheduling policy, serving one job at a time
+in simulated time (prefill and decode at fixed rates). Jobs carry the same cost estimate
+the engine gives them (prompt tokens + expected output for their kind), while the actual
+output length varies. Reports mean and p95 queue wait per policy, overall and per kind.
+
+The SJF wait bound (`sjf_max_wait_sec`) and aging run on wall-clock time, so they do not
+kick in here; the `long p95` column shows what SJF costs the big jobs without them.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.config import QueueConfig  # noqa: E402
+from app.metrics import percentile  # noqa: E402
+from app.queue import Queue  # noqa: E402
+
+PREFILL_TOKENS_PER_SEC = 800
+DECODE_TOKENS_PER_SEC = 25
+# kind: (share of arrivals, prompt tokens, mean output tokens)
+KINDS = {
+    "short": (0.7, 40, 60),
+    "medium": (0.2, 1500, 300),
+    "long": (0.1, 19000, 1200),
+}
+
+
+def workload(jobs: int, load: float, seed: int) -> list[tuple[float, str, int, int]]:
+    """(arrival time, kind, prompt tokens, actual output tokens), arriving at `load` utilisation"""
+    rng = random.Random(seed)
+    mean_service = sum(
+        share * (prompt / PREFILL_TOKENS_PER_SEC + out / DECODE_TOKENS_PER_SEC)
+        for share, prompt, out in KINDS.values()
+    )
+    clock, result = 0.0, []
+    for _ in range(jobs):
+        clock += rng.expovariate(load / mean_service)
+        kind = rng.choices(list(KINDS), weights=[k[0] for k in KINDS.values()])[0]
+        _, prompt, out = KINDS[kind]
+        result.append((clock, kind, prompt, max(1, int(rng.expovariate(1 / out)))))
+    return result
+
+
+async def simulate(policy: str, jobs: list[tuple[float, str, int, int]]) -> dict[str, list[float]]:
+    queue = Queue(
+        QueueConfig(max_size=len(jobs), starvation_prevention=False, scheduling=policy, sjf_max_wait_sec=1e9)
+    )
+    waits: dict[str, list[float]] = {kind: [] for kind in KINDS}
+    clock, index = 0.0, 0
+    while index < len(jobs) or len(queue):
+        if not len(queue) and jobs[index][0] > clock:
+            clock = jobs[index][0]  # idle until the next arrival
+        while index < len(jobs) and jobs[index][0] <= clock:
+            arrival, kind, prompt, out = jobs[index]
+            cost = prompt + KINDS[kind][2]
+            await queue.enqueue(str(index), payload=(arrival, kind, prompt, out), priority=10, cost=cost)
+            index += 1
+        item = await queue.dequeue_nowait()
+        arrival, kind, prompt, out = item.payload
+        waits[kind].append(clock - arrival)
+        clock += prompt / PREFILL_TOKENS_PER_SEC + out / DECODE_TOKENS_PER_SEC
+    return waits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue wait per scheduling policy, mixed workload")
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--load", type=float, default=0.85)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.getLogger("app.queue").setLevel(logging.WARNING)
+
+    jobs = workload(args.jobs, args.load, args.seed)
+    print(f"{'policy':>7} {'mean s':>8} {'p95 s':>8} {'short p95':>10} {'long p95':>9}")
+    for policy in ("fifo", "sjf"):
+        waits = asyncio.run(simulate(policy, jobs))
+        every = [w for kind in waits.values() for w in kind]
+        print(
+            f"{policy:>7} {sum(every) / len(every):>8.1f} {percentile(every, 95):>8.1f} "
+            f"{percentile(waits['short'], 95):>10.1f} {percentile(waits['long'], 95):>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -236,10 +236,11 @@ async def _concurrency_test(args: argparse.Namespace) -> None:
     total_out = sum(tokens_out)
     avg_tps = statistics.mean(tps) if tps else 0.0
     print(
-        "  completed={count} total_tokens_out={total} wall_time={wall:.2f}s avg_tps={avg:.2f} max_tps={mx:.2f} min_tps={mn:.2f}".format(
+        "  completed={count} total_tokens_out={total} wall_time={wall:.2f}s agg_tps={agg:.2f} avg_tps={avg:.2f} max_tps={mx:.2f} min_tps={mn:.2f}".format(
             count=len(rows),
             total=total_out,
             wall=wall_time,
+            agg=total_out / wall_time if wall_time > 0 else 0.0,
             avg=avg_tps,
             mx=max(tps) if tps else 0.0,
             mn=min(tps) if tps else 0.0,
@@ -0,0 +1,82 @@
+"""
+Micro-benchmark for the per-token bookkeeping around decoding (no model needed).
+
+Streams synthetic tokens through the engine's hot path (StopMatcher + list-backed
+buffers + the response queue) and through a naive path that grows one string and
+rescans it for tool tags every token. Reports the cost of the last `--window` tokens
+at each output length: the engine path should stay flat, the naive one grows with it.
+"""
+
+import argparse
+import asyncio
+import re
+import time
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.stopping import StopMatcher  # noqa: E402
+
+SEARCH_PATTERN = re.compile(r"\[SEARCH:\s*(.+?)\]", re.IGNORECASE)
+WORDS = ["The", " match", " ended", " 2", "-", "1", ",", " with", " a", " late", " [", "goal", "]", ".\n"]
+
+
+def _tokens(n: int):
+    for i in range(n):
+        yield WORDS[i % len(WORDS)]
+
+
+def engine_path(n: int, window: int) -> dict[int, float]:
+    """list buffers, incremental stop matching, per-token queue hand-off"""
+    stopper = StopMatcher(stop=["</answer>"], tool_tags=True, hide_tool_tags=True)
+    queue: asyncio.Queue = asyncio.Queue()
+    server_chunks: list[str] = []
+    client_chunks: list[str] = []
+    marks = {}
+    start = time.perf_counter()
+    for i, token in enumerate(_tokens(n), 1):
+        segment = stopper.feed(token)
+        if segment:
+            server_chunks.append(segment)
+            queue.put_nowait(segment)
+            client_chunks.append(queue.get_nowait())
+        if i % window == 0:
+            now = time.perf_counter()
+            marks[i] = (now - start) / window
+            start = now
+    "".join(client_chunks)
+    return marks
+
+
+def naive_path(n: int, window: int) -> dict[int, float]:
+    """one growing string, rescanned for a tool tag every token"""
+    response_text = ""
+    marks = {}
+    start = time.perf_counter()
+    for i, token in enumerate(_tokens(n), 1):
+        response_text += token
+        SEARCH_PATTERN.search(response_text)
+        if i % window == 0:
+            now = time.perf_counter()
+            marks[i] = (now - start) / window
+            start = now
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-token overhead vs. output length")
+    parser.add_argument("--tokens", type=int, default=32000)
+    parser.add_argument("--window", type=int, default=4000)
+    args = parser.parse_args()
+
+    engine = engine_path(args.tokens, args.window)
+    naive = naive_path(args.tokens, args.window)
+
+    print(f"{'tokens':>8} {'engine us/tok':>14} {'naive us/tok':>13}")
+    for length in sorted(engine):
+        print(f"{length:>8} {engine[length] * 1e6:>14.2f} {naive[length] * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
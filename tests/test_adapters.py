@@ -0,0 +1,110 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import mlx.core as mx
+from mlx.utils import tree_flatten
+from mlx_lm.models import llama
+from mlx_lm.tuner.utils import linear_to_lora_layers
+
+from app.adapters import AdapterPool
+
+LORA_PARAMETERS = {"rank": 4, "scale": 10.0, "dropout": 0.0}
+
+
+def _tiny_model() -> llama.Model:
+    mx.random.seed(0)
+    args = llama.ModelArgs(
+        model_type="llama",
+        hidden_size=32,
+        num_hidden_layers=2,
+        intermediate_size=64,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        rms_norm_eps=1e-5,
+        vocab_size=128,
+    )
+    model = llama.Model(args)
+    mx.eval(model.parameters())
+    return model
+
+
+def _write_adapter(path: Path, fine_tune_type: str = "lora", seed: int = 1) -> Path:
+    """A trained-looking adapter for _tiny_model: random deltas (and magnitudes for DoRA)."""
+    model = _tiny_model()
+    linear_to_lora_layers(model, 2, LORA_PARAMETERS, use_dora=fine_tune_type == "dora")
+    mx.random.seed(seed)
+    weights = {}
+    for k, v in tree_flatten(model.parameters()):
+        if k.endswith("lora_b"):
+            weights[k] = mx.random.normal(v.shape) * 0.1
+        elif k.endswith(".m"):
+            weights[k] = v * 1.5
+        elif "lora_" in k:
+            weights[k] = v
+    path.mkdir()
+    mx.save_safetensors(str(path / "adapters.safetensors"), weights)
+    config = {"fine_tune_type": fine_tune_type, "num_layers": 2, "lora_parameters": LORA_PARAMETERS}
+    (path / "adapter_config.json").write_text(json.dumps(config))
+    return path
+
+
+class AdapterPoolTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.model = _tiny_model()
+        self.tokens = mx.array([[1, 2, 3, 4]])
+        self.base = self.model(self.tokens)
+
+    def _pool(self, max_adapters: int = 4) -> AdapterPool:
+        return AdapterPool(self.model, max_adapters=max_adapters, max_bytes=1 << 30)
+
+    def assertServesBase(self, expected: bool = True):
+        self.assertEqual(mx.allclose(self.model(self.tokens), self.base, atol=1e-4).item(), expected)
+
+    def test_activate_and_deactivate_lora(self):
+        pool = self._pool()
+        path = _write_adapter(self.dir / "sports")
+
+        pool.activate("sports", path)
+        self.assertServesBase(False)
+        pool.deactivate()
+        self.assertServesBase()
+        self.assertEqual(pool.stats()["active"], "base")
+
+    def test_deactivate_restores_dora_magnitudes(self):
+        pool = self._pool()
+        # converting alone leaves the base model's output unchanged
+        pool.preload("sports", _write_adapter(self.dir / "sports", "dora"))
+        self.assertServesBase()
+
+        pool.activate("sports", self.dir / "sports")
+        self.assertServesBase(False)
+        pool.deactivate()
+        self.assertServesBase()
+
+    def test_eviction_keeps_the_adapter_being_loaded(self):
+        pool = self._pool(max_adapters=1)
+        pool.activate("sports", _write_adapter(self.dir / "sports"))
+        pool.activate("news", _write_adapter(self.dir / "news", seed=2))
+
+        self.assertEqual(pool.stats()["resident"], ["news"])
+        self.assertEqual(pool.stats()["active"], "news")
+        self.assertEqual(pool.evictions, 1)
+        # served from the pool, not reloaded
+        pool.activate("news", self.dir / "news")
+        self.assertEqual((pool.hits, pool.misses), (1, 2))
+
+    def test_eviction_drops_least_recently_used(self):
+        pool = self._pool(max_adapters=2)
+        for name, seed in (("sports", 1), ("news", 2), ("music", 3)):
+            pool.preload(name, _write_adapter(self.dir / name, seed=seed))
+
+        self.assertEqual(pool.stats()["resident"], ["news", "music"])
+
+
+if __name__ == "__main__":
+    unittest.main()
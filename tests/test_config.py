@@ -0,0 +1,27 @@
+import unittest
+
+from app.config import PreemptionConfig, Priorities
+
+
+class PriorityClassTests(unittest.TestCase):
+    def test_class_of_maps_levels_to_the_nearest_class_below(self):
+        priorities = Priorities()
+        self.assertEqual(priorities.class_of(0), "ui")
+        self.assertEqual(priorities.class_of(5), "critical")
+        self.assertEqual(priorities.class_of(15), "standard")
+        self.assertEqual(priorities.class_of(40), "background")
+        self.assertEqual(priorities.class_of(-3), "ui")
+
+    def test_preemption_policy_per_class(self):
+        priorities = Priorities()
+        config = PreemptionConfig(policy={"background": "snapshot", "standard": "recompute"})
+        self.assertEqual(config.policy_for(20, priorities), "snapshot")
+        self.assertEqual(config.policy_for(12, priorities), "recompute")
+        self.assertEqual(config.policy_for(0, priorities), "never")
+
+        config.enabled = False
+        self.assertEqual(config.policy_for(20, priorities), "never")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from app.cost_model import CostModel, estimate_prompt_tokens
+from app.schemas import GenerateRequest
+
+
+class CostModelTests(unittest.TestCase):
+    def test_unknown_jobs_cost_their_max_tokens(self):
+        model = CostModel(min_samples=2)
+        request = GenerateRequest(prompt="hi", max_tokens=256)
+
+        self.assertEqual(model.expected_output(256), 256)
+        self.assertEqual(model.estimate(request), estimate_prompt_tokens(request) + 256)
+
+    def test_learns_per_class_and_adapter_with_fallback(self):
+        model = CostModel(min_samples=2)
+        for tokens in (20, 40):
+            model.observe("ui", "base", tokens)
+        for tokens in (900, 1100):
+            model.observe("background", "base", tokens)
+
+        self.assertEqual(model.expected_output(4096, "ui", "base"), 30)
+        self.assertEqual(model.expected_output(4096, "background", "base"), 1000)
+        # no samples for this class: falls back to everything seen for the adapter
+        self.assertEqual(model.expected_output(4096, "agent", "base"), 515)
+        # never above what the request allows
+        self.assertEqual(model.expected_output(100, "background", "base"), 100)
+
+    def test_long_prompts_cost_more(self):
+        model = CostModel()
+        short = GenerateRequest(prompt="hi", max_tokens=64)
+        long = GenerateRequest(prompt="x" * 75_000, max_tokens=64)
+
+        self.assertGreater(model.estimate(long) - model.estimate(short), 18_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,617 @@
+import asyncio
+import math
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable
+from unittest import mock
+
+import mlx.core as mx
+from mlx_lm.models import llama
+
+from app.adapters import AdapterPool
+from app.config import QueueConfig
+from app.engine import ModelEngine, Overloaded, _JobDone, _JobError
+from app.prompts import build_system_prompt
+from app.queue import Queue
+from app.response_cache import CachedResponse
+from app.schemas import GenerateRequest
+from tests.test_adapters import _write_adapter
+
+
+def _fresh_engine() -> ModelEngine:
+    """A private engine instance; the module-level singleton stays untouched."""
+    singleton = ModelEngine._instance
+    ModelEngine._instance = None
+    try:
+        return ModelEngine()
+    finally:
+        ModelEngine._instance = singleton
+
+
+def _tiny_model() -> llama.Model:
+    """A randomly initialised two-layer llama, small enough for the CPU backend."""
+    mx.random.seed(0)
+    args = llama.ModelArgs(
+        model_type="llama",
+        hidden_size=32,
+        num_hidden_layers=2,
+        intermediate_size=64,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        rms_norm_eps=1e-5,
+        vocab_size=128,
+    )
+    model = llama.Model(args)
+    mx.eval(model.parameters())
+    return model
+
+
+class _FakeModel:
+    """Just enough of a model for make_prompt_cache and prefill; it keeps no KV state."""
+
+    def make_cache(self):
+        return []
+
+    def __call__(self, tokens, cache=None):
+        return None
+
+
+class _FakeKVCache:
+    """Counts the tokens a KVCache would hold; trimmable like one."""
+
+    def __init__(self, offset: int):
+        self.offset = offset
+
+    def is_trimmable(self) -> bool:
+        return True
+
+    def trim(self, n: int) -> int:
+        n = min(self.offset, n)
+        self.offset -= n
+        return n
+
+
+def _token_text(token: int, texts: dict[int, str]) -> str:
+    return texts.get(token, f"t{token} ")
+
+
+class _FakeDetokenizer:
+    def __init__(self, texts: dict[int, str]):
+        self._texts = texts
+        self._pending = ""
+
+    def add_token(self, token: int):
+        self._pending += _token_text(token, self._texts)
+
+    def finalize(self):
+        pass
+
+    @property
+    def last_segment(self) -> str:
+        segment, self._pending = self._pending, ""
+        return segment
+
+
+class _FakeTokenizer:
+    """Token t decodes to "t<t> " unless `texts` maps it to something else."""
+
+    eos_token_ids = [0]
+
+    def __init__(self, texts: dict[int, str] | None = None):
+        self.texts = texts or {}
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        return " ".join(message["content"] for message in messages)
+
+    def encode(self, text: str) -> list[int]:
+        return [ord(c) % 128 for c in text]
+
+    def decode(self, ids: list[int]) -> str:
+        return "".join(_token_text(i, self.texts) for i in ids)
+
+    @property
+    def detokenizer(self) -> _FakeDetokenizer:
+        return _FakeDetokenizer(self.texts)
+
+
+class _FakeBatchGenerator:
+    """
+    The mlx_lm 0.32 BatchGenerator contract: every sequence emits token uid + 1 each step
+    until it reaches its max_tokens. Removed sequences hand back a cache holding what they fed.
+    """
+
+    def __init__(self, model, **kwargs):
+        self._left: dict[int, int] = {}
+        self._fed: dict[int, int] = {}
+        self._uids = iter(range(1_000_000))
+
+    def insert(self, prompts, max_tokens, caches=None, samplers=None) -> list[int]:
+        uids = [next(self._uids) for _ in prompts]
+        self._left.update(zip(uids, max_tokens))
+        for uid, prompt, cache in zip(uids, prompts, caches or [None] * len(prompts)):
+            # the last prompt token is fed by the first step
+            self._fed[uid] = (cache[0].offset if cache else 0) + len(prompt) - 1
+        return uids
+
+    def next_generated(self):
+        responses = []
+        for uid in list(self._left):
+            self._left[uid] -= 1
+            self._fed[uid] += 1
+            done = self._left[uid] <= 0
+            if done:
+                del self._left[uid], self._fed[uid]
+            finish_reason = "length" if done else None
+            responses.append(SimpleNamespace(uid=uid, token=uid + 1, finish_reason=finish_reason, prompt_cache=None))
+        return responses
+
+    def remove(self, uids, return_prompt_caches=False):
+        caches = {}
+        for uid in uids:
+            self._left.pop(uid, None)
+            fed = self._fed.pop(uid, None)
+            if return_prompt_caches and fed is not None:
+                caches[uid] = ([_FakeKVCache(fed)], [])
+        return caches
+
+    def close(self):
+        pass
+
+
+class EngineTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.queue = Queue(QueueConfig(max_size=10, starvation_prevention=False))
+        patcher = mock.patch("app.engine.request_queue", self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.engine = _fresh_engine()
+        # tests tune the engine config; the settings object is shared
+        self.engine.config = self.engine.config.model_copy(deep=True)
+        self.engine.ready = True
+        self.addAsyncCleanup(self.engine.shutdown)
+
+    async def _drain(self, response_queue: asyncio.Queue) -> list:
+        items = []
+        while True:
+            item = await asyncio.wait_for(response_queue.get(), timeout=5)
+            if item is None:
+                return items
+            items.append(item)
+
+
+class FakeModelEngineTestCase(EngineTestCase):
+    """Runs jobs through the real worker loop against a fake model and batch generator."""
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        fakes = {"app.engine.BatchGenerator": _FakeBatchGenerator, "app.engine.log_stats": mock.Mock()}
+        for target, value in fakes.items():
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.engine.model = _FakeModel()
+        self.engine.tokenizer = _FakeTokenizer()
+
+
+class CompletedJobTests(FakeModelEngineTestCase):
+    async def test_job_runs_to_completion_and_feeds_the_estimates(self):
+        request = GenerateRequest(prompt="hi", max_tokens=3, timeout_sec=30, cache=False)
+        _, response_queue = await self.engine._submit(request)
+        items = await self._drain(response_queue)
+
+        self.assertEqual(items, ["t1 ", "t1 ", "t1 ", _JobDone(3)])
+        self.assertEqual(self.engine.stats()["admission"]["met"], 1)
+        self.assertEqual(self.engine.cost_model.stats()["standard/base"]["samples"], 1)
+
+    async def test_parallel_choices_count_per_choice(self):
+        request = GenerateRequest(prompt="hi", max_tokens=2, n=2, cache=False)
+        _, response_queue = await self.engine._submit(request)
+        items = await self._drain(response_queue)
+
+        self.assertEqual(items[-1], _JobDone(4))
+        self.assertEqual(self.engine.cost_model.stats()["standard/base"]["mean_tokens_out"], 2)
+
+
+class _FailingBatchGenerator(_FakeBatchGenerator):
+    """Fails on its second step."""
+
+    def next_generated(self):
+        if getattr(self, "_stepped", False):
+            raise RuntimeError("Metal command buffer failed")
+        self._stepped = True
+        return super().next_generated()
+
+
+class _SilentBatchGenerator(_FakeBatchGenerator):
+    """Takes prompts but never produces a token."""
+
+    def next_generated(self):
+        return []
+
+
+class ParallelSamplingTests(FakeModelEngineTestCase):
+    async def _run(self, **fields) -> list:
+        request = GenerateRequest(prompt="hi", n=2, cache=False, **fields)
+        return await self._drain((await self.engine._submit(request))[1])
+
+    async def test_each_choice_streams_as_index_and_token(self):
+        items = await self._run(max_tokens=2)
+        self.assertEqual(items, [(0, "t1 "), (1, "t2 "), (0, "t1 "), (1, "t2 "), _JobDone(4)])
+
+    async def test_stopping_one_choice_leaves_the_others_running(self):
+        # only the first choice's tokens contain the stop string
+        items = await self._run(max_tokens=3, stop=["t1"])
+
+        text = {0: "", 1: ""}
+        for index, chunk in items[:-1]:
+            text[index] += chunk
+        self.assertEqual(text, {0: "", 1: "t2 t2 t2 "})
+        self.assertEqual(items[-1], _JobDone(4))
+
+    async def test_tool_calls_are_off(self):
+        async def run_tool(tag: str) -> str:
+            return "results"
+
+        request = GenerateRequest(prompt="hi", n=2, cache=False)
+        with self.assertRaises(ValueError):
+            await self.engine._submit(request, tool_runner=run_tool)
+
+    async def test_failed_step_errors_the_request_once(self):
+        with mock.patch("app.engine.BatchGenerator", _FailingBatchGenerator):
+            _, response_queue = await self.engine._submit(GenerateRequest(prompt="hi", n=2, max_tokens=5, cache=False))
+            items = await self._drain(response_queue)
+
+        self.assertEqual(items[:2], [(0, "t1 "), (1, "t2 ")])
+        self.assertEqual([type(item) for item in items[2:]], [_JobError])
+        await asyncio.sleep(0.05)
+        self.assertTrue(response_queue.empty())
+
+
+class _CountingModel(_FakeModel):
+    """Records each prefill call: its token count and `progress()` at the time."""
+
+    def __init__(self, progress: Callable[[], int]):
+        self.progress = progress
+        self.calls: list[tuple[int, int]] = []
+
+    def __call__(self, tokens, cache=None):
+        self.calls.append((tokens.size, self.progress()))
+
+
+class ChunkedPrefillTests(FakeModelEngineTestCase):
+    async def test_long_prompt_is_prefilled_between_decode_steps(self):
+        self.engine.config.prefill_chunk_tokens = 8
+        running = GenerateRequest(prompt="hi", max_tokens=500, cache=False)
+        _, running_queue = await self.engine._submit(running)
+        await asyncio.wait_for(running_queue.get(), timeout=5)
+
+        # progress: how many tokens the running job has streamed so far
+        model = self.engine.model = _CountingModel(running_queue.qsize)
+        long = GenerateRequest(prompt="x" * 100, max_tokens=2, cache=False)
+        _, long_queue = await self.engine._submit(long)
+        self.assertEqual(len(await self._drain(long_queue)), 3)
+
+        prefilled = self.engine._chunked_stats["tokens"]
+        self.assertGreater(len(model.calls), 2)
+        self.assertEqual(len(model.calls), math.ceil(prefilled / 8))
+        self.assertEqual(sum(size for size, _ in model.calls), prefilled)
+        # the running job took a decode step between every two chunks
+        progress = [streamed for _, streamed in model.calls]
+        self.assertTrue(all(before < after for before, after in zip(progress, progress[1:])))
+        self.assertEqual((await self._drain(running_queue))[-1], _JobDone(500))
+
+
+class SpeculativeLaneTests(FakeModelEngineTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.batches = mock.Mock(side_effect=_FakeBatchGenerator)
+        self.stream_generate = mock.Mock(side_effect=self._fake_stream)
+        spies = {"app.engine.BatchGenerator": self.batches, "app.engine.stream_generate": self.stream_generate}
+        for target, value in spies.items():
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _fake_stream(model, tokenizer, prompt, max_tokens, **kwargs):
+        # every other token comes from the draft model
+        for i in range(max_tokens):
+            finish_reason = "length" if i == max_tokens - 1 else None
+            yield SimpleNamespace(text=f"s{i} ", from_draft=bool(i % 2), finish_reason=finish_reason)
+
+    async def _run(self, **fields) -> list:
+        request = GenerateRequest(prompt="hi", max_tokens=3, cache=False, **fields)
+        return await self._drain((await self.engine._submit(request))[1])
+
+    async def test_speculative_job_runs_in_its_own_lane(self):
+        self.engine.draft_model = _FakeModel()
+
+        self.assertEqual(await self._run(speculative=True), ["s0 ", "s1 ", "s2 ", _JobDone(3)])
+        self.batches.assert_not_called()
+        kwargs = self.stream_generate.call_args.kwargs
+        self.assertIs(kwargs["draft_model"], self.engine.draft_model)
+        self.assertEqual(kwargs["num_draft_tokens"], self.engine.config.num_draft_tokens)
+
+    async def test_batch_is_used_without_a_draft_model_or_the_flag(self):
+        self.assertIsNone(self.engine.draft_model)
+        self.assertEqual(await self._run(speculative=True), ["t1 ", "t1 ", "t1 ", _JobDone(3)])
+
+        # a draft model alone does not opt a request in (speculative_default is off)
+        self.engine.draft_model = _FakeModel()
+        self.assertEqual((await self._run())[-1], _JobDone(3))
+        # nor can a parallel-sampling request use the single-sequence lane
+        self.assertEqual((await self._run(speculative=True, n=2))[-1], _JobDone(6))
+        self.stream_generate.assert_not_called()
+        self.assertEqual(self.batches.call_count, 3)
+
+
+class ToolCallTests(FakeModelEngineTestCase):
+    async def test_paused_sequence_resumes_on_its_own_kv_cache(self):
+        # the first token is a tool tag, until the tool has run
+        self.engine.tokenizer = tokenizer = _FakeTokenizer({1: "[SEARCH: rain]"})
+        tags = []
+
+        async def run_tool(tag: str) -> str:
+            tags.append(tag)
+            tokenizer.texts.clear()
+            return "sunny"
+
+        request = GenerateRequest(prompt="hi", max_tokens=3, cache=False)
+        with mock.patch.object(self.engine, "_prompt_cache_for", wraps=self.engine._prompt_cache_for) as fetch:
+            _, response_queue = await self.engine._submit(request, tool_runner=run_tool)
+            items = await self._drain(response_queue)
+
+        self.assertEqual(tags, ["[SEARCH: rain]"])
+        self.assertEqual(items[-3:], ["t1 ", "t1 ", _JobDone(3)])
+        # resuming trimmed the cache the batch handed back instead of rebuilding one
+        self.assertEqual(fetch.call_count, 1)
+        first_prompt = fetch.call_args.args[0]
+        self.assertEqual(self.engine._tool_stats["tokens_reused"], first_prompt.num_tokens)
+
+
+class PreemptionTests(FakeModelEngineTestCase):
+    async def test_preempted_sequence_resumes_from_its_snapshot(self):
+        self.engine.config.max_batch_size = 1
+        background = GenerateRequest(prompt="hi", max_tokens=200, priority=20, cache=False)
+        urgent = GenerateRequest(prompt="now", max_tokens=2, priority=0, cache=False)
+
+        with mock.patch.object(self.engine, "_prompt_cache_for", wraps=self.engine._prompt_cache_for) as fetch:
+            _, background_queue = await self.engine._submit(background)
+            first = await asyncio.wait_for(background_queue.get(), timeout=5)
+            _, urgent_queue = await self.engine._submit(urgent)
+            urgent_items = await self._drain(urgent_queue)
+            background_items = [first] + await self._drain(background_queue)
+
+        self.assertEqual(urgent_items[-1], _JobDone(2))
+        self.assertEqual(background_items[-1], _JobDone(200))
+        self.assertEqual(len("".join(background_items[:-1]).split()), 200)
+        stats = self.engine._preemption_stats
+        self.assertEqual((stats["preemptions"], stats["snapshot"], stats["resumed"]), (1, 1, 1))
+        # one cache lookup per admission; the resume used the snapshot
+        self.assertEqual(fetch.call_count, 2)
+
+
+class RealBatchGeneratorTests(EngineTestCase):
+    """The installed mlx_lm BatchGenerator with a tiny random model, so API changes surface here."""
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        patcher = mock.patch("app.engine.log_stats", mock.Mock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine.model = _tiny_model()
+        self.engine.tokenizer = _FakeTokenizer()
+
+    async def test_jobs_decode_side_by_side(self):
+        queues = [
+            (await self.engine._submit(GenerateRequest(prompt=prompt, max_tokens=6, cache=False)))[1]
+            for prompt in ("hello there", "hi")
+        ]
+        for response_queue in queues:
+            items = await self._drain(response_queue)
+            self.assertFalse([item for item in items if isinstance(item, _JobError)])
+            done = items[-1]
+            self.assertIsInstance(done, _JobDone)
+            # one chunk per visible token; an early EOS is not emitted
+            self.assertTrue(1 <= done.tokens_out <= 6)
+            self.assertEqual(len(items) - 1, done.tokens_out)
+
+    async def test_next_turn_of_a_session_reuses_its_dialogue(self):
+        history = [{"role": ("user", "assistant")[i % 2], "content": f"message {i}"} for i in range(20)]
+
+        async def turn(history: list[dict]):
+            system_prompt = build_system_prompt(chat_history=history)
+            request = GenerateRequest(
+                prompt="and now?", system_prompt=system_prompt, session_id="s1", max_tokens=2, cache=False
+            )
+            await self._drain((await self.engine._submit(request))[1])
+            return system_prompt
+
+        first = await turn(history)
+        await turn(history + [{"role": "user", "content": "and now?"}, {"role": "assistant", "content": "ok"}])
+
+        # the fake tokenizer is one token per character: the whole dialogue block was reused
+        dialogue_end = first.index("message 19") + len("message 19")
+        self.assertEqual(self.engine.session_cache.hits, 1)
+        self.assertGreaterEqual(self.engine.session_cache.tokens_saved, dialogue_end)
+
+    def test_timed_generation_produces_tokens(self):
+        self.assertGreater(self.engine._timed_generation([1, 2, 3, 4], 4), 0)
+
+    def test_warm_up_leaves_the_adapter_pool_stats_alone(self):
+        self.engine.config.warmup_prompt_tokens = [16]
+        pool = self.engine.adapter_pool = AdapterPool(self.engine.model, max_adapters=4, max_bytes=1 << 30)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = _write_adapter(Path(tmp) / "sports")
+            pool.preload("sports", path)
+            before = pool.stats()
+            with mock.patch.object(self.engine, "_resolve_adapter_path", return_value=path):
+                self.engine._warm_up()
+
+        self.assertEqual(self.engine.warmup_stats["adapters"], ["base", "sports"])
+        self.assertEqual(pool.stats(), before)
+
+
+class WarmUpTests(FakeModelEngineTestCase):
+    def test_warm_up_that_produces_no_tokens_fails(self):
+        self.engine.adapter_pool = AdapterPool(self.engine.model, max_adapters=4, max_bytes=1 << 30)
+        with mock.patch("app.engine.BatchGenerator", _SilentBatchGenerator):
+            with self.assertRaisesRegex(RuntimeError, "produced no tokens"):
+                self.engine._warm_up()
+        self.assertNotIn("seconds", self.engine.warmup_stats)
+
+
+class CoalescedJobTests(FakeModelEngineTestCase):
+    async def test_shared_job_is_queued_by_its_most_urgent_caller(self):
+        # no worker: the shared job stays queued
+        self.engine.start_background_tasks = mock.AsyncMock()
+        now = time.time()
+
+        def request(deadline: float) -> GenerateRequest:
+            return GenerateRequest(prompt="hi", temp=0, cache=False, deadline=deadline)
+
+        first, _ = await self.engine._submit(request(now + 60), priority=20)
+        queued = self.queue._items[first]
+        # each caller still expires on its own; the queue just orders by the earliest
+        self.assertEqual((queued.deadline, queued.payload["deadline"]), (now + 60, None))
+
+        await self.engine._submit(request(now + 120), priority=20)
+        self.assertEqual(self.queue._items[first].deadline, now + 60)
+        await self.engine._submit(request(now + 30), priority=0)
+        queued = self.queue._items[first]
+        self.assertEqual((queued.original_priority, queued.deadline), (0, now + 30))
+        self.assertEqual(len(self.queue), 1)
+
+    async def test_a_leaving_caller_detaches_only_itself(self):
+        # the worker starts once all three callers share the queued job
+        self.engine.start_background_tasks = mock.AsyncMock()
+        now = time.time()
+        request = GenerateRequest(prompt="hi", max_tokens=3, temp=0, cache=False)
+        _, reader = await self.engine._submit(request)
+        leaver, leaver_queue = await self.engine._submit(request)
+        _, late_queue = await self.engine._submit(request.model_copy(update={"deadline": now + 30}))
+
+        self.assertFalse(await self.engine.cancel(leaver))
+        await self.engine._reap_flight_deadlines(now + 60)
+        self.assertEqual(await self._drain(leaver_queue), [])
+        late = await self._drain(late_queue)
+        self.assertIsInstance(late[0].error, TimeoutError)
+        self.assertEqual(len(self.queue), 1)
+
+        del self.engine.start_background_tasks
+        await self.engine.start_background_tasks()
+        self.assertEqual(await self._drain(reader), ["t1 ", "t1 ", "t1 ", _JobDone(3)])
+        self.assertEqual(self.engine._coalesce_stats["detached"], 1)
+        self.assertEqual(self.engine._deadline_stats["missed"], 1)
+
+    async def test_last_caller_leaving_cancels_the_job(self):
+        request = GenerateRequest(prompt="hi", max_tokens=100_000, temp=0, cache=False)
+        callers = [await self.engine._submit(request) for _ in range(2)]
+        for _, response_queue in callers:
+            await asyncio.wait_for(response_queue.get(), timeout=5)
+
+        for request_id, response_queue in callers:
+            await self.engine.cancel(request_id)
+            await self._drain(response_queue)
+        for _ in range(100):
+            if not self.engine._active:
+                break
+            await asyncio.sleep(0.05)
+
+        self.assertEqual(self.engine._active, {})
+        self.assertEqual(self.engine._cancel_stats["in_flight"], 1)
+        self.assertEqual(self.engine._flights, {})
+
+
+class EstimatedFinishTests(EngineTestCase):
+    async def test_counts_every_choice_of_the_request(self):
+        self.assertIsNone(self.engine._estimated_finish(GenerateRequest(prompt="hi"), 10, "base"))
+        for _ in range(self.engine.config.shed_min_samples):
+            self.engine.decode_throughput.add(100.0)
+
+        now = time.time()
+        one = self.engine._estimated_finish(GenerateRequest(prompt="hi", max_tokens=50), 10, "base")
+        three = self.engine._estimated_finish(GenerateRequest(prompt="hi", max_tokens=50, n=3), 10, "base")
+        self.assertAlmostEqual(one - now, 0.5, places=1)
+        self.assertAlmostEqual(three - now, 1.5, places=1)
+
+
+class DeadlineSheddingTests(EngineTestCase):
+    async def test_short_request_is_shed_behind_a_long_backlog(self):
+        self.engine.start_background_tasks = mock.AsyncMock()
+        for _ in range(self.engine.config.shed_min_samples):
+            self.engine.decode_throughput.add(100.0)
+        await self.queue.enqueue("deep-search", payload={}, priority=10, cost=5000)
+
+        # ~50s of work ahead, however little this request asks for
+        with self.assertRaises(Overloaded):
+            await self.engine._submit(GenerateRequest(prompt="hi", max_tokens=16, timeout_sec=5))
+        # ahead of the backlog it fits
+        await self.engine._submit(GenerateRequest(prompt="hi", max_tokens=16, timeout_sec=5), priority=0)
+        self.assertEqual(self.engine.stats()["admission"]["shed"]["deadline"], 1)
+
+
+class QueuedDeadlineTests(EngineTestCase):
+    async def test_queued_job_expires_without_reaching_the_head(self):
+        # no worker: the job just sits in the queue
+        self.engine.start_background_tasks = mock.AsyncMock()
+        request = GenerateRequest(prompt="hi", timeout_sec=0.05)
+        _, response_queue = await self.engine._submit(request)
+        self.assertEqual(len(self.queue), 1)
+
+        await asyncio.sleep(0.1)
+        await self.engine._reap_cancelled()
+
+        self.assertEqual(len(self.queue), 0)
+        items = await self._drain(response_queue)
+        self.assertIsInstance(items[0], _JobError)
+        self.assertIsInstance(items[0].error, TimeoutError)
+        self.assertEqual(self.engine.stats()["cancellations"]["deadline"], 1)
+
+
+class SemanticScopeTests(EngineTestCase):
+    async def test_stop_settings_are_part_of_the_scope(self):
+        self.engine.semantic_cache.embed = lambda text: [1.0, 0.0]
+        plain = GenerateRequest(prompt="what was the score", temp=0)
+        scope, vector, hit = self.engine._semantic_lookup(plain, "base")
+        self.assertIsNone(hit)
+        answer = CachedResponse(chunks=["It ended 2-1. Late goal."], tokens_out=8, gpu_seconds=1.0, created=time.time())
+        self.engine.semantic_cache.put(scope, plain.prompt, vector, answer)
+
+        self.assertIsNotNone(self.engine._semantic_lookup(plain, "base")[2])
+        # the cached answer runs past this caller's stop string
+        stopped = GenerateRequest(prompt="what was the score", temp=0, stop=["."])
+        self.assertIsNone(self.engine._semantic_lookup(stopped, "base")[2])
+
+
+
+class SemanticCacheTests(FakeModelEngineTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        patcher = mock.patch("app.engine.memory", SimpleNamespace(ready=True))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine.config.semantic_cache_enabled = True
+        # every prompt is a near-duplicate of every other
+        self.engine.semantic_cache.embed = lambda text: [1.0, 0.0]
+
+    async def _run(self, prompt: str, max_tokens: int) -> list:
+        request = GenerateRequest(prompt=prompt, max_tokens=max_tokens, temp=0, cache=True)
+        return await self._drain((await self.engine._submit(request))[1])
+
+    async def test_answer_cut_at_max_tokens_only_serves_that_budget(self):
+        self.assertEqual(await self._run("what was the score", 2), ["t1 ", "t1 ", _JobDone(2)])
+        # a bigger budget would get a longer answer: generated, not replayed
+        self.assertEqual(len(await self._run("what's the score", 8)), 9)
+        self.assertEqual(await self._run("the score?", 2), ["t1 ", "t1 ", _JobDone(2)])
+
+        stats = self.engine.semantic_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from app.kv_cache import PrefixCache, SessionCache, cache_nbytes, common_prefix_len
+
+
+class _FakeArray:
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+
+
+class _FakeLayerCache:
+    def __init__(self, nbytes: int):
+        self.state = (_FakeArray(nbytes // 2), _FakeArray(nbytes // 2))
+
+
+def _fake_cache(nbytes: int = 100, layers: int = 2):
+    return [_FakeLayerCache(nbytes // layers) for _ in range(layers)]
+
+
+class PrefixCacheTests(unittest.TestCase):
+    def test_fetch_returns_longest_cached_prefix(self):
+        cache = PrefixCache(max_bytes=10_000)
+        cache.insert("base", [1, 2], _fake_cache())
+        cache.insert("base", [1, 2, 3, 4], _fake_cache())
+
+        hit, length = cache.fetch("base", [1, 2, 3, 4, 5, 6])
+        self.assertIsNotNone(hit)
+        self.assertEqual(length, 4)
+
+        hit, length = cache.fetch("base", [1, 2, 9])
+        self.assertEqual(length, 2)
+
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["tokens_saved"], 6)
+
+    def test_fetch_is_scoped_by_adapter_and_returns_a_copy(self):
+        cache = PrefixCache(max_bytes=10_000)
+        stored = _fake_cache()
+        cache.insert("base", [1, 2, 3], stored)
+
+        miss, length = cache.fetch("sports", [1, 2, 3, 4])
+        self.assertIsNone(miss)
+        self.assertEqual(length, 0)
+
+        hit, _ = cache.fetch("base", [1, 2, 3, 4])
+        self.assertIsNot(hit, stored)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_lru_eviction_respects_byte_budget(self):
+        cache = PrefixCache(max_bytes=250)
+        cache.insert("base", [1], _fake_cache(100))
+        cache.insert("base", [2], _fake_cache(100))
+        cache.fetch("base", [1, 5])  # touch [1] so [2] is least recently used
+        cache.insert("base", [3], _fake_cache(100))
+
+        self.assertEqual(cache.fetch("base", [2, 5])[1], 0)
+        self.assertEqual(cache.fetch("base", [1, 5])[1], 1)
+        self.assertEqual(cache.fetch("base", [3, 5])[1], 1)
+        self.assertLessEqual(cache.stats()["bytes_used"], 250)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_session_cache_reuses_common_prefix_of_last_turn(self):
+        cache = SessionCache(max_bytes=10_000)
+        stored = _fake_cache()
+        cache.store("s1", "base", [1, 2, 3, 4], stored)
+
+        hit, matched, held = cache.take("s1", "base", [1, 2, 3, 9, 9])
+        self.assertIs(hit, stored)
+        self.assertEqual((matched, held), (3, 4))
+
+        # taken entries are owned by the caller until stored again
+        self.assertEqual(cache.take("s1", "base", [1, 2, 3])[0], None)
+        self.assertEqual(cache.stats()["per_session"]["s1"], {"hits": 1, "misses": 1, "tokens_saved": 3})
+
+        cache.store("s1", "base", [1, 2, 3], _fake_cache())
+        self.assertIsNone(cache.take("s1", "sports", [1, 2, 3])[0])
+
+    def test_session_cache_budget_and_idle_eviction(self):
+        cache = SessionCache(max_bytes=250)
+        cache.store("a", "base", [1], _fake_cache(100))
+        cache.store("b", "base", [1], _fake_cache(100))
+        cache.store("c", "base", [1], _fake_cache(100))
+
+        self.assertEqual(cache.stats()["sessions"], 2)
+        self.assertLessEqual(cache.stats()["bytes_used"], 250)
+        self.assertIsNone(cache.take("a", "base", [1])[0])
+
+        self.assertEqual(cache.evict_idle(idle_seconds=-1), 2)
+        self.assertEqual(cache.stats()["bytes_used"], 0)
+
+    def test_helpers(self):
+        self.assertEqual(cache_nbytes(_fake_cache(100)), 100)
+        self.assertEqual(common_prefix_len([1, 2, 3], [1, 2, 4]), 2)
+        self.assertEqual(common_prefix_len([1, 2], [1, 2, 3]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
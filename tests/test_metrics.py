@@ -0,0 +1,37 @@
+import asyncio
+import time
+import unittest
+
+from app.metrics import LoopLagMonitor, RollingWindow, percentile
+
+
+class MetricsTests(unittest.IsolatedAsyncioTestCase):
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_rolling_window_keeps_recent_samples(self):
+        window = RollingWindow(maxlen=3)
+        for value in (100.0, 1.0, 2.0, 3.0):
+            window.add(value)
+
+        summary = window.summary()
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["max"], 3.0)
+
+    async def test_loop_lag_monitor_detects_blocking_call(self):
+        monitor = LoopLagMonitor(interval_sec=0.01)
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0.05)
+        time.sleep(0.1)  # block the event loop
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        self.assertGreaterEqual(monitor.stats()["max"], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
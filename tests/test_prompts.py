@@ -0,0 +1,39 @@
+import unittest
+
+from app.prompts import SHARED_PROMPT_PREFIX, build_system_prompt, history_window
+
+
+class PromptTests(unittest.TestCase):
+    def test_system_prompt_starts_with_shared_prefix(self):
+        bare = build_system_prompt()
+        loaded = build_system_prompt(
+            memories=["Supports Arsenal"],
+            search_context="### SEARCH RESULTS:\nNo relevant results found.",
+            chat_history=[{"role": "user", "content": "hi"}],
+        )
+
+        self.assertTrue(bare.startswith(SHARED_PROMPT_PREFIX))
+        self.assertTrue(loaded.startswith(SHARED_PROMPT_PREFIX))
+
+    def test_dialogue_precedes_per_request_blocks(self):
+        history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+        first = build_system_prompt(chat_history=history, memories=["Supports Arsenal"])
+        second = build_system_prompt(chat_history=history, search_context="### SEARCH RESULTS:")
+
+        dialogue_end = first.index("ASSISTANT: hello") + len("ASSISTANT: hello")
+        self.assertEqual(first[:dialogue_end], second[:dialogue_end])
+        self.assertLess(dialogue_end, first.index("### CURRENT DATE/TIME:"))
+
+    def test_history_window_moves_in_steps(self):
+        history = [{"role": "user", "content": str(i)} for i in range(40)]
+
+        self.assertEqual(history_window(history[:16], 16), history[:16])
+        # 17 to 24 messages share one start, so their dialogue blocks extend each other
+        starts = {history_window(history[:n], 16)[0]["content"] for n in range(17, 25)}
+        self.assertEqual(starts, {"8"})
+        self.assertEqual(history_window(history[:25], 16)[0]["content"], "16")
+        self.assertTrue(all(len(history_window(history[:n], 16)) <= 16 for n in range(40)))
+
+
+if __name__ == "__main__":
+    unittest.main()
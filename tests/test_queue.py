@@ -1,4 +1,5 @@
 import asyncio
+import time
 import unittest
 
 from app.config import QueueConfig
@@ -74,6 +75,110 @@ class QueueTests(unittest.IsolatedAsyncioTestCase):
         job = await asyncio.wait_for(dequeue_task, timeout=0.5)
         self.assertEqual(job.request_id, "late")
 
+    async def test_dequeue_nowait_returns_none_when_empty(self):
+        queue = Queue(
+            QueueConfig(
+                max_size=10,
+                starvation_prevention=False,
+                aging_interval_sec=60,
+                default_priority=10,
+            )
+        )
+
+        self.assertIsNone(await queue.dequeue_nowait())
+
+        await queue.enqueue("standard", payload={}, priority=10)
+        await queue.enqueue("vip", payload={}, priority=1)
+
+        first = await queue.dequeue_nowait()
+        second = await queue.dequeue_nowait()
+        self.assertEqual(first.request_id, "vip")
+        self.assertEqual(second.request_id, "standard")
+        self.assertIsNone(await queue.dequeue_nowait())
+
+        # A drained queue must block dequeue() again.
+        dequeue_task = asyncio.create_task(queue.dequeue())
+        await asyncio.sleep(0.05)
+        self.assertFalse(dequeue_task.done())
+        dequeue_task.cancel()
+
+    async def test_dequeue_affine_prefers_group_until_max_wait(self):
+        queue = Queue(
+            QueueConfig(
+                max_size=10,
+                starvation_prevention=False,
+                aging_interval_sec=60,
+                default_priority=10,
+            )
+        )
+
+        await queue.enqueue("sports-vip", payload={}, priority=1, group="sports")
+        await queue.enqueue("base-std", payload={}, priority=10, group="base")
+
+        job, passed_over = await queue.dequeue_affine("base", max_wait_sec=60)
+        self.assertEqual(job.request_id, "base-std")
+        self.assertTrue(passed_over)
+
+        # nothing left for the active group
+        job, _ = await queue.dequeue_affine("base", max_wait_sec=60)
+        self.assertIsNone(job)
+
+        # once the other group's head has waited long enough, stop admitting
+        await queue.enqueue("base-late", payload={}, priority=10, group="base")
+        job, _ = await queue.dequeue_affine("base", max_wait_sec=0)
+        self.assertIsNone(job)
+
+        job, passed_over = await queue.dequeue_affine("sports", max_wait_sec=0)
+        self.assertEqual(job.request_id, "sports-vip")
+        self.assertFalse(passed_over)
+        self.assertEqual((await queue.stats())["depth_by_group"], {"base": 1})
+
+    async def test_remove_drops_queued_item(self):
+        queue = Queue(
+            QueueConfig(
+                max_size=10,
+                starvation_prevention=False,
+                aging_interval_sec=60,
+                default_priority=10,
+            )
+        )
+
+        await queue.enqueue("keep", payload={}, priority=10)
+        await queue.enqueue("cancelled", payload={}, priority=1)
+
+        removed = await queue.remove("cancelled")
+        self.assertEqual(removed.request_id, "cancelled")
+        self.assertIsNone(await queue.remove("cancelled"))
+        self.assertEqual(len(queue), 1)
+        self.assertEqual((await queue.dequeue()).request_id, "keep")
+
+        # removing the last item leaves dequeue() blocking
+        await queue.enqueue("only", payload={}, priority=10)
+        await queue.remove("only")
+        dequeue_task = asyncio.create_task(queue.dequeue())
+        await asyncio.sleep(0.05)
+        self.assertFalse(dequeue_task.done())
+        dequeue_task.cancel()
+
+    async def test_peek_returns_next_items_without_removing(self):
+        queue = Queue(
+            QueueConfig(
+                max_size=10,
+                starvation_prevention=False,
+                aging_interval_sec=60,
+                default_priority=10,
+            )
+        )
+
+        await queue.enqueue("low", payload={}, priority=20)
+        await queue.enqueue("high", payload={}, priority=1)
+        await queue.enqueue("mid", payload={}, priority=10)
+
+        peeked = await queue.peek(2)
+        self.assertEqual([item.request_id for item in peeked], ["high", "mid"])
+        self.assertEqual(len(queue), 3)
+        self.assertEqual((await queue.dequeue()).request_id, "high")
+
     async def test_stats_reports_depth_and_priority_bounds(self):
         queue = Queue(
             QueueConfig(
@@ -94,6 +199,193 @@ class QueueTests(unittest.IsolatedAsyncioTestCase):
         self.assertGreaterEqual(stats["oldest_wait"], 0.0)
         self.assertEqual(len(queue), 2)
 
+    async def test_fair_scheduling_interleaves_clients(self):
+        queue = Queue(QueueConfig(max_size=20, starvation_prevention=False, client_weights={"ui": 2}))
+
+        for i in range(6):
+            await queue.enqueue(f"agent-{i}", payload={}, priority=10, client="agent")
+        for i in range(4):
+            await queue.enqueue(f"ui-{i}", payload={}, priority=10, client="ui")
+
+        order = [(await queue.dequeue_nowait()).request_id for _ in range(6)]
+        # the flooding client does not hold the queue; the weight-2 client gets twice its share
+        self.assertEqual(order, ["ui-0", "agent-0", "ui-1", "ui-2", "agent-1", "ui-3"])
+
+        queue.record_served("agent", 42)
+        queue.record_served("ui", 42)
+        clients = (await queue.stats())["clients"]
+        self.assertEqual(clients["agent"]["depth"], 4)
+        self.assertEqual(clients["agent"]["served_tokens"], 42)
+        self.assertEqual(clients["agent"]["weight"], 1)
+        # a client with nothing queued keeps its stats but not its scheduling state
+        self.assertEqual(clients["ui"]["depth"], 0)
+        self.assertEqual(clients["ui"]["served_tokens"], 42)
+        self.assertNotIn("ui", queue._client_finish)
+
+    async def test_drained_client_keeps_its_served_tokens(self):
+        queue = Queue(QueueConfig(max_size=20))
+
+        await queue.enqueue("job", payload={}, priority=10, client="agent")
+        await queue.dequeue_nowait()
+        # the job finishes after the client's last queued job has left the queue
+        queue.record_served("agent", 128)
+        queue.record_served("agent", 64)
+
+        agent = (await queue.stats())["clients"]["agent"]
+        self.assertEqual((agent["depth"], agent["served_tokens"]), (0, 192))
+
+    async def test_idle_clients_are_bounded(self):
+        queue = Queue(QueueConfig(max_size=2, max_tracked_clients=4))
+
+        for i in range(50):
+            await queue.enqueue(f"job-{i}", payload={}, priority=10, client=f"10.0.0.{i}")
+            if i % 2:
+                await queue.remove(f"job-{i}")
+            else:
+                await queue.dequeue_nowait()
+        # a rejected enqueue leaves nothing behind either
+        await queue.enqueue("a", payload={}, priority=10, client="a")
+        await queue.enqueue("b", payload={}, priority=10, client="b")
+        with self.assertRaises(BufferError):
+            await queue.enqueue("c", payload={}, priority=10, client="c")
+
+        # stats for the most recent clients only; scheduling state for waiting ones only
+        self.assertEqual(set((await queue.stats())["clients"]), {"10.0.0.48", "10.0.0.49", "a", "b"})
+        self.assertEqual(set(queue._client_finish), {"a", "b"})
+        self.assertEqual(queue._client_depth, {"a": 1, "b": 1})
+
+    async def test_fifo_scheduling_keeps_arrival_order(self):
+        queue = Queue(QueueConfig(max_size=20, starvation_prevention=False, scheduling="fifo"))
+
+        await queue.enqueue("agent-0", payload={}, priority=10, client="agent")
+        await queue.enqueue("agent-1", payload={}, priority=10, client="agent")
+        await queue.enqueue("ui-0", payload={}, priority=10, client="ui")
+
+        order = [(await queue.dequeue_nowait()).request_id for _ in range(3)]
+        self.assertEqual(order, ["agent-0", "agent-1", "ui-0"])
+
+    async def test_per_client_cap_raises_buffer_error(self):
+        queue = Queue(QueueConfig(max_size=20, max_per_client=2))
+
+        await queue.enqueue("a", payload={}, priority=10, client="agent")
+        await queue.enqueue("b", payload={}, priority=10, client="agent")
+        with self.assertRaises(BufferError):
+            await queue.enqueue("c", payload={}, priority=10, client="agent")
+        # other clients are unaffected, and a dequeue frees the capped client's slot
+        await queue.enqueue("d", payload={}, priority=10, client="ui")
+        (await queue.dequeue_nowait())
+        await queue.enqueue("c", payload={}, priority=10, client="agent")
+
+    async def test_edf_scheduling_serves_earliest_deadline_first(self):
+        queue = Queue(QueueConfig(max_size=20, starvation_prevention=False, scheduling="edf"))
+
+        await queue.enqueue("no-deadline", payload={}, priority=10)
+        await queue.enqueue("late", payload={}, priority=10, deadline=200.0)
+        await queue.enqueue("early", payload={}, priority=10, deadline=100.0)
+        await queue.enqueue("vip", payload={}, priority=1, deadline=300.0)
+
+        order = [(await queue.dequeue_nowait()).request_id for _ in range(4)]
+        # priority still comes first; within it the earliest deadline, then jobs without one
+        self.assertEqual(order, ["vip", "early", "late", "no-deadline"])
+
+    async def test_edf_keeps_aging_jobs_without_a_deadline(self):
+        queue = Queue(QueueConfig(max_size=20, starvation_prevention=True, scheduling="edf"))
+        queue.config.aging_interval_sec = 0.05
+
+        await queue.enqueue("old-no-deadline", payload={}, priority=10)
+        await queue.enqueue("late", payload={}, priority=10, deadline=time.time() + 300)
+        await asyncio.sleep(0.12)
+        for i in range(3):
+            await queue.enqueue(f"urgent-{i}", payload={}, priority=10, deadline=time.time() + 10 + i)
+
+        # the old job has aged past the stream of fresh deadline jobs from the same client
+        self.assertEqual([item.request_id for item in await queue.peek(3)], ["old-no-deadline", "urgent-0", "urgent-1"])
+        self.assertEqual((await queue.dequeue_nowait()).request_id, "old-no-deadline")
+
+        # the late job is the oldest and most aged, the urgent ones the newest
+        stats = await queue.stats()
+        self.assertGreaterEqual(stats["oldest_wait"], 0.12)
+        self.assertEqual(stats["min_priority"], 8)
+        self.assertEqual(stats["max_priority"], 10)
+
+    async def test_backlog_sums_the_cost_of_jobs_ahead(self):
+        queue = Queue(QueueConfig(max_size=20, starvation_prevention=False))
+
+        await queue.enqueue("vip", payload={}, priority=1, cost=100)
+        await queue.enqueue("standard", payload={}, priority=10, cost=2000)
+        await queue.enqueue("cancelled", payload={}, priority=10, cost=500)
+        await queue.enqueue("background", payload={}, priority=20, cost=30)
+        await queue.remove("cancelled")
+
+        self.assertEqual(queue.backlog(0), 0)
+        self.assertEqual(queue.backlog(10), 2100)
+        self.assertEqual(queue.backlog(20), 2130)
+        # a promoted job counts at its new priority
+        await queue.reprioritise("background", 1)
+        self.assertEqual(queue.backlog(1), 130)
+
+    async def test_backlog_skips_the_stale_copy_of_a_promoted_deadline_job(self):
+        queue = Queue(QueueConfig(max_size=20, scheduling="edf", aging_interval_sec=60))
+        now = time.time()
+
+        await queue.enqueue("shared", payload={}, priority=20, cost=10, deadline=now + 10)
+        await queue.enqueue("report", payload={}, priority=20, cost=1000, deadline=now + 600)
+        # waited ten aging intervals: it now ranks at 10, the fresh report job still at 20
+        queue._items["shared"].entry_time -= 600
+        await queue.reprioritise("shared", 0)
+
+        self.assertEqual(queue.backlog(10), 10)
+        self.assertEqual(queue.backlog(20), 1010)
+
+    async def test_sjf_scheduling_prefers_cheap_jobs_until_max_wait(self):
+        queue = Queue(QueueConfig(max_size=20, starvation_prevention=False, scheduling="sjf", sjf_max_wait_sec=60))
+
+        await queue.enqueue("deep-search", payload={}, priority=10, cost=20_000)
+        await queue.enqueue("hi", payload={}, priority=10, cost=30)
+        await queue.enqueue("summary", payload={}, priority=10, cost=900)
+
+        order = [(await queue.dequeue_nowait()).request_id for _ in range(3)]
+        self.assertEqual(order, ["hi", "summary", "deep-search"])
+
+        # once over the bound, a long job goes ahead of any cheaper one
+        queue.config.sjf_max_wait_sec = 0
+        await queue.enqueue("deep-search", payload={}, priority=10, cost=20_000)
+        await asyncio.sleep(0.01)
+        await queue.enqueue("hi", payload={}, priority=10, cost=30)
+        self.assertEqual((await queue.dequeue_nowait()).request_id, "deep-search")
+
+    async def test_reprioritise_moves_item_ahead_keeping_entry_time(self):
+        queue = Queue(QueueConfig(max_size=20, starvation_prevention=False))
+
+        await queue.enqueue("shared", payload={}, priority=20)
+        await queue.enqueue("standard", payload={}, priority=10)
+        await queue.enqueue("newer", payload={}, priority=0)
+
+        self.assertTrue(await queue.reprioritise("shared", 0))
+        # a less important joiner never demotes it
+        self.assertTrue(await queue.reprioritise("shared", 30))
+        self.assertFalse(await queue.reprioritise("missing", 0))
+        self.assertEqual(len(queue), 3)
+
+        order = [(await queue.dequeue_nowait()).request_id for _ in range(3)]
+        self.assertEqual(order, ["shared", "newer", "standard"])
+        self.assertIsNone(await queue.dequeue_nowait())
+
+    async def test_queued_token_cap_raises_buffer_error(self):
+        queue = Queue(QueueConfig(max_size=20, max_queued_tokens=1000))
+
+        # a job over the whole cap still gets into an empty queue
+        await queue.enqueue("huge", payload={}, priority=10, cost=5000)
+        with self.assertRaises(BufferError):
+            await queue.enqueue("small", payload={}, priority=10, cost=10)
+        await queue.dequeue_nowait()
+
+        await queue.enqueue("a", payload={}, priority=10, cost=600)
+        with self.assertRaises(BufferError):
+            await queue.enqueue("b", payload={}, priority=10, cost=600)
+        await queue.enqueue("c", payload={}, priority=10, cost=400)
+        self.assertEqual((await queue.stats())["queued_tokens"], 1000)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,83 @@
+import logging
+import time
+import unittest
+
+from app.config import QueueConfig
+from app.queue import Queue
+
+DEEP = 100_000
+SHALLOW = 1_000
+SAMPLE = 1_000
+
+
+def _queue(max_size: int) -> Queue:
+    # aging on, with an interval short enough that effective priorities actually move
+    return Queue(QueueConfig(max_size=max_size, starvation_prevention=True, aging_interval_sec=1, default_priority=10))
+
+
+async def _fill(queue: Queue, count: int) -> None:
+    for i in range(count):
+        await queue.enqueue(f"job-{i}", payload=None, priority=i % 21, group=("base", "sports")[i % 2])
+
+
+async def _per_op(operation, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await operation()
+    return (time.perf_counter() - start) / repeat
+
+
+class QueueComplexityBenchmark(unittest.IsolatedAsyncioTestCase):
+    """
+    Pushes 100k items and checks that enqueue, dequeue, affine dequeue, stats and remove cost
+    about the same at 100k deep as at 1k deep. A full-heap scan per call would be ~100x slower.
+    Only the ratio between the two queues is asserted, never wall-clock time, so a slow or
+    busy machine does not fail it.
+    """
+
+    async def asyncSetUp(self):
+        # per-item INFO logs would dominate the timings
+        queue_logger = logging.getLogger("app.queue")
+        self.addCleanup(queue_logger.setLevel, queue_logger.level)
+        queue_logger.setLevel(logging.WARNING)
+
+        self.deep = _queue(DEEP)
+        self.shallow = _queue(SHALLOW + SAMPLE)
+        start = time.perf_counter()
+        await _fill(self.deep, DEEP)
+        self.deep_fill = (time.perf_counter() - start) / DEEP
+        start = time.perf_counter()
+        await _fill(self.shallow, SHALLOW + SAMPLE)
+        self.shallow_fill = (time.perf_counter() - start) / (SHALLOW + SAMPLE)
+
+    def assertFlat(self, deep: float, shallow: float, name: str):
+        # generous bound: O(n) would be ~100x, timer noise rarely exceeds 2-3x
+        self.assertLess(deep, shallow * 10, f"{name}: {deep * 1e6:.1f}us at {DEEP} vs {shallow * 1e6:.1f}us at {SHALLOW}")
+
+    async def test_operations_do_not_scale_with_depth(self):
+        self.assertEqual(len(self.deep), DEEP)
+        # a per-enqueue scan would make filling quadratic
+        self.assertFlat(self.deep_fill, self.shallow_fill, "enqueue")
+
+        deep = await _per_op(self.deep.dequeue_nowait, SAMPLE)
+        shallow = await _per_op(self.shallow.dequeue_nowait, SAMPLE)
+        self.assertFlat(deep, shallow, "dequeue")
+
+        deep = await _per_op(lambda: self.deep.dequeue_affine("sports", max_wait_sec=60), SAMPLE)
+        shallow = await _per_op(lambda: self.shallow.dequeue_affine("sports", max_wait_sec=60), SAMPLE // 2)
+        self.assertFlat(deep, shallow, "dequeue_affine")
+
+        deep = await _per_op(self.deep.stats, 200)
+        shallow = await _per_op(self.shallow.stats, 200)
+        self.assertFlat(deep, shallow, "stats")
+
+        ids = iter(range(DEEP - 1, DEEP - 1 - SAMPLE, -1))
+        deep = await _per_op(lambda: self.deep.remove(f"job-{next(ids)}"), SAMPLE)
+        ids = iter(range(SHALLOW + SAMPLE - 1, SHALLOW + SAMPLE - 1 - SAMPLE // 4, -1))
+        shallow = await _per_op(lambda: self.shallow.remove(f"job-{next(ids)}"), SAMPLE // 4)
+        self.assertFlat(deep, shallow, "remove")
+        self.assertEqual(len(self.deep), DEEP - 3 * SAMPLE)
+
+
+if __name__ == "__main__":
+    unittest.main()
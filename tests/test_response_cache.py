@@ -0,0 +1,58 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from app.response_cache import CachedResponse, ResponseCache, make_key
+
+
+def _entry(text: str, gpu_seconds: float = 1.5, created: float | None = None) -> CachedResponse:
+    return CachedResponse(
+        chunks=list(text), tokens_out=len(text), gpu_seconds=gpu_seconds, created=created or time.time()
+    )
+
+
+class ResponseCacheTests(unittest.TestCase):
+    def test_key_depends_on_every_part(self):
+        base = dict(model="m", adapter="base", prompt="p", temp=0.0, max_tokens=64)
+        self.assertEqual(make_key(**base), make_key(**dict(reversed(list(base.items())))))
+        self.assertNotEqual(make_key(**base), make_key(**{**base, "adapter": "sports"}))
+        self.assertNotEqual(make_key(**base), make_key(**{**base, "max_tokens": 65}))
+
+    def test_hits_replay_chunks_and_count_saved_gpu_time(self):
+        cache = ResponseCache(max_entries=4, ttl_sec=60)
+        self.assertIsNone(cache.get("k"))
+        cache.put("k", _entry("hey", gpu_seconds=2.0))
+
+        hit = cache.get("k")
+        self.assertEqual(hit.chunks, ["h", "e", "y"])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["gpu_seconds_saved"], 2.0)
+
+    def test_lru_and_ttl(self):
+        cache = ResponseCache(max_entries=2, ttl_sec=60)
+        cache.put("a", _entry("a"))
+        cache.put("b", _entry("b"))
+        cache.get("a")
+        cache.put("c", _entry("c"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+        cache.put("old", _entry("old", created=time.time() - 120))
+        self.assertIsNone(cache.get("old"))
+
+    def test_disk_tier_survives_restart_and_expires(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = str(Path(tmp) / "cache.db")
+            ResponseCache(max_entries=4, ttl_sec=60, db_path=db).put("k", _entry("hi"))
+            ResponseCache(max_entries=4, ttl_sec=60, db_path=db).put("stale", _entry("x", created=time.time() - 120))
+
+            cache = ResponseCache(max_entries=4, ttl_sec=60, db_path=db)
+            self.assertEqual(cache.get("k").chunks, ["h", "i"])
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            self.assertIsNone(cache.get("stale"))
+
+
+if __name__ == "__main__":
+    unittest.main()
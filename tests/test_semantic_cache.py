@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from app.response_cache import CachedResponse
+from app.semantic_cache import SemanticCache, fingerprint
+
+VOCAB = ["favourite", "team", "support", "which", "what", "weather", "today"]
+
+
+def _embed(text: str) -> list[float]:
+    words = text.lower().replace("?", "").split()
+    return [float(words.count(term)) for term in VOCAB]
+
+
+def _response(text: str, gpu_seconds: float = 2.0, created: float | None = None) -> CachedResponse:
+    return CachedResponse(chunks=[text], tokens_out=5, gpu_seconds=gpu_seconds, created=created or time.time())
+
+
+class SemanticCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = SemanticCache(embed=_embed, threshold=0.6, max_entries=8, ttl_sec=60)
+        self.scope = ("base", fingerprint("You are Hala."))
+        prompt = "what favourite team"
+        self.cache.put(self.scope, prompt, self.cache.embed_prompt(prompt), _response("Arsenal"))
+
+    def test_near_duplicate_hits_within_scope(self):
+        hit = self.cache.lookup(self.scope, self.cache.embed_prompt("which team favourite"))
+        self.assertIsNotNone(hit)
+        response, similarity, matched = hit
+        self.assertEqual(response.chunks, ["Arsenal"])
+        self.assertGreaterEqual(similarity, 0.6)
+        self.assertEqual(matched, "what favourite team")
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertGreater(stats["latency_saved_sec"], 0)
+
+    def test_unrelated_prompt_other_scope_or_longer_answer_misses(self):
+        vector = self.cache.embed_prompt("what favourite team")
+        self.assertIsNone(self.cache.lookup(self.scope, self.cache.embed_prompt("weather today")))
+        self.assertIsNone(self.cache.lookup(("sports", self.scope[1]), vector))
+        self.assertIsNone(self.cache.lookup(("base", fingerprint("Other prompt.")), vector))
+        self.assertIsNone(self.cache.lookup(self.scope, vector, max_tokens=4))
+        self.assertEqual(self.cache.stats()["misses"], 4)
+
+    def test_truncated_answer_is_reused_for_the_same_budget_only(self):
+        prompt = "weather today"
+        vector = self.cache.embed_prompt(prompt)
+        self.cache.put(self.scope, prompt, vector, _response("Sunny with"), max_tokens=5, finish_reason="length")
+
+        self.assertIsNone(self.cache.lookup(self.scope, vector, max_tokens=64))
+        self.assertEqual(self.cache.lookup(self.scope, vector, max_tokens=5)[0].chunks, ["Sunny with"])
+        # a complete answer serves any budget it fits in
+        self.cache.put(self.scope, prompt, vector, _response("Sunny."), max_tokens=5, finish_reason="stop")
+        self.assertEqual(self.cache.lookup(self.scope, vector, max_tokens=64)[0].chunks, ["Sunny."])
+
+    def test_expired_entries_are_dropped(self):
+        prompt = "weather today"
+        self.cache.put(self.scope, prompt, self.cache.embed_prompt(prompt), _response("Sunny", created=time.time() - 120))
+        self.assertIsNone(self.cache.lookup(self.scope, self.cache.embed_prompt(prompt)))
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
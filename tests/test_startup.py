@@ -0,0 +1,51 @@
+import asyncio
+import time
+import unittest
+
+from app.startup import Startup
+
+
+class StartupTests(unittest.IsolatedAsyncioTestCase):
+    async def test_components_initialise_concurrently(self):
+        startup = Startup()
+
+        async def slow():
+            await asyncio.sleep(0.1)
+
+        begin = time.perf_counter()
+        await startup.run({"engine": slow, "memory": slow, "monitor": slow})
+        elapsed = time.perf_counter() - begin
+
+        self.assertLess(elapsed, 0.25)
+        self.assertTrue(startup.is_ready())
+        status = startup.status()
+        self.assertEqual(set(status["components"]), {"engine", "memory", "monitor"})
+        self.assertGreaterEqual(status["components"]["engine"]["seconds"], 0.1)
+
+    async def test_not_ready_while_loading_or_after_failure(self):
+        startup = Startup()
+        self.assertFalse(startup.is_ready())
+
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+
+        async def broken():
+            raise RuntimeError("weights missing")
+
+        task = asyncio.create_task(startup.run({"engine": blocked, "memory": broken}))
+        await asyncio.sleep(0.01)
+        self.assertEqual(startup.components["engine"]["status"], "loading")
+        self.assertFalse(startup.is_ready())
+
+        release.set()
+        await task
+        self.assertEqual(startup.components["engine"]["status"], "ready")
+        self.assertEqual(startup.components["memory"]["status"], "failed")
+        self.assertEqual(startup.components["memory"]["error"], "weights missing")
+        self.assertFalse(startup.is_ready())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+from app.stopping import StopMatcher
+
+
+def _run(matcher, segments):
+    out = "".join(matcher.feed(seg) for seg in segments)
+    return out + matcher.flush()
+
+
+class StopMatcherTests(unittest.TestCase):
+    def test_stop_string_across_token_boundaries(self):
+        matcher = StopMatcher(stop=["</answer>"])
+        out = _run(matcher, ["The score ", "was 3-1.</an", "swer>", " trailing"])
+        self.assertEqual(out, "The score was 3-1.")
+        self.assertTrue(matcher.stopped)
+        self.assertEqual(matcher.reason, "</answer>")
+
+    def test_partial_stop_prefix_is_released(self):
+        matcher = StopMatcher(stop=["\n\nUser:"])
+        self.assertEqual(matcher.feed("Hello\n"), "Hello")
+        self.assertEqual(matcher.feed("\nUs"), "")
+        self.assertEqual(matcher.feed("ually"), "\n\nUsually")
+        self.assertEqual(matcher.flush(), "")
+        self.assertFalse(matcher.stopped)
+
+    def test_tool_tag_stops_after_closing_bracket(self):
+        matcher = StopMatcher(tool_tags=True)
+        out = _run(matcher, ["Let me check. [SEA", "RCH: lakers ", "score]", " The Lakers"])
+        self.assertEqual(out, "Let me check. [SEARCH: lakers score]")
+        self.assertTrue(matcher.stopped)
+
+        matcher = StopMatcher(tool_tags=True)
+        self.assertEqual(_run(matcher, ["[expand: 1f2c]rest"]), "[expand: 1f2c]")
+
+    def test_hidden_tool_tag_is_cut_from_output(self):
+        matcher = StopMatcher(tool_tags=True, hide_tool_tags=True)
+        self.assertEqual(matcher.feed("Checking [1] and "), "Checking [1] and ")
+        self.assertEqual(matcher.feed("[SEA"), "")
+        self.assertEqual(matcher.feed("RCH: rain in "), "")
+        self.assertEqual(matcher.feed("Leeds] ok"), "")
+        self.assertEqual(matcher.tool_tag, "[SEARCH: rain in Leeds]")
+
+        matcher = StopMatcher(tool_tags=True, hide_tool_tags=True)
+        self.assertEqual(_run(matcher, ["[SEA", "SON 2]"]), "[SEASON 2]")
+        self.assertIsNone(matcher.tool_tag)
+
+    def test_plain_brackets_do_not_stop(self):
+        matcher = StopMatcher(tool_tags=True)
+        out = _run(matcher, ["a list [1, 2]", " and [SEARCH", " without a query"])
+        self.assertEqual(out, "a list [1, 2] and [SEARCH without a query")
+        self.assertFalse(matcher.stopped)
+
+    def test_earliest_match_wins(self):
+        matcher = StopMatcher(stop=["STOP"], tool_tags=True)
+        self.assertEqual(_run(matcher, ["x STOP [SEARCH: q]"]), "x ")
+        self.assertIsNone(matcher.tool_tag)
+
+        matcher = StopMatcher(stop=["STOP"], tool_tags=True)
+        self.assertEqual(_run(matcher, ["[SEARCH: q] STOP"]), "[SEARCH: q]")
+
+    def test_stop_inside_hidden_tool_tag_cuts_at_the_tag(self):
+        matcher = StopMatcher(stop=["."], tool_tags=True, hide_tool_tags=True)
+        self.assertEqual(_run(matcher, ["ok [SEARCH: a.b]"]), "ok ")
+        self.assertEqual(matcher.reason, ".")
+
+        matcher = StopMatcher(stop=["."], tool_tags=True, hide_tool_tags=True)
+        self.assertEqual(_run(matcher, ["ok [SEA", "RCH: a", ".b]"]), "ok ")
+
+        matcher = StopMatcher(stop=["."], tool_tags=True, hide_tool_tags=True)
+        self.assertEqual(_run(matcher, ["see [1]. More"]), "see [1]")
+
+
+if __name__ == "__main__":
+    unittest.main()